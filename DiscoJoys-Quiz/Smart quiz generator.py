@@ -2,12 +2,40 @@
 """
 🎵 SMART QUIZ GENERATOR - Con Claude AI
 Genera quiz intelligenti da CSV Exportify
+
+Uso interattivo (senza argomenti) oppure in batch su una cartella di CSV:
+    python "Smart quiz generator.py" --batch playlist/ --type chi_canta --genre Rock --format jsonl
 """
 
+import argparse
 import csv
+import io
 import json
 import re
 import os
+import random
+import sys
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+try:
+    import numpy as np
+except ImportError:  # senza NumPy le risposte sbagliate restano casuali
+    np = None
+
+# Chiavi canoniche condivise con il backend: "Song - Remastered 2011" == "Song"
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+try:
+    from track_keys import canonical_artist, canonical_title, track_key
+except ImportError:  # script copiato da solo, senza il backend accanto
+    def canonical_title(text):
+        return " ".join((text or "").lower().split())
+    canonical_artist = canonical_title
+    
+    def track_key(title, artist=""):
+        return f"{canonical_title(title)}|{canonical_artist(artist)}"
 
 # ============================================================
 # CONFIGURAZIONE
@@ -19,90 +47,355 @@ ANTHROPIC_API_KEY = "INSERISCI_QUI_LA_TUA_API_KEY"
 # Tipo di domande da generare
 QUIZ_TYPE = "indovina_intro"  # Opzioni: "chi_canta", "indovina_intro", "anno"
 
+# Risposte sbagliate "simili": colonne audio di Exportify e relativo peso
+AUDIO_FEATURES = [
+    ("year", 1.5),
+    ("danceability", 1.0),
+    ("energy", 1.0),
+    ("tempo", 0.7),
+    ("valence", 1.0),
+]
+GENRE_BUCKETS = 32      # i generi sono "hashati" in un numero fisso di colonne
+GENRE_WEIGHT = 1.5
+NEIGHBOURS = 8          # vicini calcolati per ogni artista/titolo
+CANDIDATES = 4096       # oltre, i vicini si cercano in un campione della playlist
+CHUNK_ROWS = 512        # righe per blocco nel calcolo delle distanze
+
 # ============================================================
 
-def generate_questions_with_claude(tracks, quiz_type="indovina_intro"):
+def sql_quote(value):
+    """Letterale stringa SQL: gli apici singoli vanno raddoppiati"""
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def sql_comment(value):
+    """Testo su una sola riga, sicuro dentro un commento --"""
+    return " ".join(str(value).split())
+
+
+class DistractorSampler:
     """
-    Genera domande intelligenti usando Claude API
+    Estrae risposte sbagliate in O(k) per domanda.
     
-    NOTA: Questa è una versione SEMPLIFICATA che non richiede API key.
-    Genera domande base ma funzionali.
+    I valori distinti (artisti o titoli) sono indicizzati una volta sola:
+    per ogni traccia si pescano indici a caso scartando la risposta giusta
+    e i doppioni, invece di copiare e mescolare tutta la playlist.
+    Due grafie dello stesso valore ("The Doors" / "Doors") contano come uno.
     """
     
-    print("\n🤖 Generazione domande intelligenti...")
-    
-    questions = []
+    def __init__(self, values, rng=None, canonical=None):
+        self._canonical = canonical or (lambda value: value)
+        self.key_of = {}
+        self.distinct = {}
+        for value in values:
+            if value not in self.key_of:
+                self.key_of[value] = self._canonical(value)
+                self.distinct.setdefault(self.key_of[value], value)
+        self.keys = list(self.distinct)
+        self.values = list(self.distinct.values())
+        self.rng = rng or random
+    
+    def canonical(self, value):
+        key = self.key_of.get(value)
+        return key if key is not None else self._canonical(value)
+    
+    def sample(self, correct, k=3):
+        correct_key = self.canonical(correct)
+        others = len(self.values) - (1 if correct_key in self.distinct else 0)
+        if others <= k:
+            return [v for key, v in zip(self.keys, self.values) if key != correct_key]
+        
+        chosen = []
+        seen = {correct_key}
+        while len(chosen) < k:
+            i = self.rng.randrange(len(self.values))
+            if self.keys[i] not in seen:
+                seen.add(self.keys[i])
+                chosen.append(self.values[i])
+        return chosen
+
+
+def build_feature_matrix(tracks):
+    """
+    Matrice tracce x caratteristiche (float32): anno e feature audio
+    standardizzate, più i generi come vettore normalizzato.
+    """
+    numeric = np.array(
+        [[t.get(name) if t.get(name) is not None else np.nan for name, _ in AUDIO_FEATURES] for t in tracks],
+        dtype=np.float32
+    ).reshape(len(tracks), len(AUDIO_FEATURES))
+    
+    # Valori mancanti = media della colonna, poi z-score pesato
+    missing = np.isnan(numeric)
+    counts = (~missing).sum(axis=0)
+    means = np.where(counts > 0, np.nansum(numeric, axis=0) / np.maximum(counts, 1), 0)
+    numeric = np.where(missing, means, numeric)
+    std = numeric.std(axis=0)
+    numeric = (numeric - means) / np.where(std > 0, std, 1)
+    numeric *= np.array([w for _, w in AUDIO_FEATURES], dtype=np.float32)
+    
+    rows, cols = [], []
+    for i, t in enumerate(tracks):
+        for genre in t.get('genres', ()):
+            rows.append(i)
+            cols.append(zlib.crc32(genre.encode('utf-8')) % GENRE_BUCKETS)
+    genres = np.zeros((len(tracks), GENRE_BUCKETS), dtype=np.float32)
+    np.add.at(genres, (np.array(rows, dtype=np.int64), np.array(cols, dtype=np.int64)), 1)
+    norms = np.linalg.norm(genres, axis=1, keepdims=True)
+    genres = genres / np.where(norms > 0, norms, 1) * GENRE_WEIGHT
+    
+    return np.hstack([numeric, genres]).astype(np.float32)
+
+
+def nearest_neighbours(matrix, k, seed=0):
+    """
+    Indici dei k vicini più prossimi di ogni riga, a blocchi per contenere
+    la memoria. Con playlist enormi il confronto è con CANDIDATES righe a
+    caso: per una risposta sbagliata plausibile basta un vicino "quasi" esatto.
+    """
+    n = len(matrix)
+    if n > CANDIDATES:
+        candidates = np.sort(np.random.default_rng(seed).choice(n, CANDIDATES, replace=False))
+    else:
+        candidates = np.arange(n)
+    k = min(k, len(candidates) - 1)
+    out = np.empty((n, max(k, 0)), dtype=np.int64)
+    if k <= 0:
+        return out
+    
+    reference = matrix[candidates]
+    ref_sq = np.einsum('ij,ij->i', reference, reference)
+    sq = np.einsum('ij,ij->i', matrix, matrix)
+    for start in range(0, n, CHUNK_ROWS):
+        block = matrix[start:start + CHUNK_ROWS]
+        dist = sq[start:start + len(block), None] + ref_sq[None, :] - 2 * (block @ reference.T)
+        # Una riga non è vicina di se stessa
+        dist[candidates[None, :] == np.arange(start, start + len(block))[:, None]] = np.inf
+        idx = np.argpartition(dist, k - 1, axis=1)[:, :k]
+        order = np.argsort(np.take_along_axis(dist, idx, axis=1), axis=1)
+        out[start:start + len(block)] = candidates[np.take_along_axis(idx, order, axis=1)]
+    return out
+
+
+class SimilarDistractors:
+    """
+    Risposte sbagliate plausibili: gli artisti (o titoli) più vicini per
+    anno, feature audio e generi. Una riga per valore distinto, media
+    delle sue tracce; i vicini si calcolano una volta per tutta la playlist.
+    """
     
-    for i, track in enumerate(tracks, 1):
-        print(f"   {i}/{len(tracks)} {track['artist']} - {track['title']}")
+    def __init__(self, tracks, key, rng=None, canonical=None):
+        self.rng = rng or random
+        self.fallback = DistractorSampler((t[key] for t in tracks), self.rng, canonical)
+        self.canonical = self.fallback.canonical
+        self.values = self.fallback.values
+        self.group_of = {k: g for g, k in enumerate(self.fallback.keys)}
         
-        # Genera opzioni sbagliate prendendo altri titoli/artisti dalla playlist
-        other_tracks = [t for t in tracks if t['id'] != track['id']]
+        features = build_feature_matrix(tracks)
+        groups = np.array([self.group_of[self.canonical(t[key])] for t in tracks], dtype=np.int64)
+        matrix = np.zeros((len(self.values), features.shape[1]), dtype=np.float32)
+        np.add.at(matrix, groups, features)
+        matrix /= np.bincount(groups, minlength=len(self.values))[:, None]
         
-        import random
-        random.shuffle(other_tracks)
+        # Senza feature nel CSV le distanze sono tutte uguali: meglio il caso
+        self.neighbours = nearest_neighbours(matrix, NEIGHBOURS) if matrix.any() else None
+    
+    def sample(self, correct, k=3):
+        g = self.group_of.get(self.canonical(correct))
+        if self.neighbours is None or g is None or self.neighbours.shape[1] < k:
+            return self.fallback.sample(correct, k)
+        # Un po' di varietà: k a caso tra i 2k più vicini
+        closest = [self.values[j] for j in self.neighbours[g][:2 * k]]
+        return self.rng.sample(closest, k)
+
+
+def iter_questions(tracks, quiz_type="indovina_intro", rng=None, verbose=True, similar=True):
+    """Genera le domande una alla volta; i vicini si calcolano prima, una volta sola"""
+    rng = rng or random
+    
+    # "anno" richiede l'anno nel CSV - per ora usiamo "indovina intro"
+    key, canonical = ('artist', canonical_artist) if quiz_type == "chi_canta" else ('title', canonical_title)
+    if similar and np is not None:
+        sampler = SimilarDistractors(tracks, key, rng, canonical)
+    else:
+        sampler = DistractorSampler((t[key] for t in tracks), rng, canonical)
+    
+    step = max(1, len(tracks) // 10)
+    for i, track in enumerate(tracks, 1):
+        if verbose and (len(tracks) <= 100 or i % step == 0 or i == len(tracks)):
+            print(f"   {i}/{len(tracks)} {track['artist']} - {track['title']}")
         
         if quiz_type == "chi_canta":
             # Domanda: Chi canta X?
             question_text = f"Chi canta {track['title']}?"
             correct = track['artist']
-            wrong = [t['artist'] for t in other_tracks[:3]]
-            
-        elif quiz_type == "anno":
-            # Domanda: In che anno è uscita X?
-            # (richiede anno nel CSV - per ora usiamo "indovina intro")
-            question_text = "Indovina questa canzone"
-            correct = track['title']
-            wrong = [t['title'] for t in other_tracks[:3]]
-            
-        else:  # indovina_intro
+        else:  # indovina_intro / anno
             # Domanda: Indovina questa canzone
             question_text = "Indovina questa canzone"
             correct = track['title']
-            wrong = [t['title'] for t in other_tracks[:3]]
         
         # Crea opzioni e mescola
-        options = [correct] + wrong
-        random.shuffle(options)
-        correct_index = options.index(correct)
+        options = [correct] + sampler.sample(correct)
+        rng.shuffle(options)
         
-        questions.append({
+        yield {
             "question": question_text,
             "options": options,
-            "correct_index": correct_index,
+            "correct_index": options.index(correct),
             "points": 15,
             "media_type": "spotify",
             "media_url": track['id']
-        })
-    
-    return questions
+        }
 
 
-def csv_to_smart_quiz(csv_file, quiz_name, category, genre, quiz_type):
-    """Converte CSV in quiz intelligente"""
+def generate_questions_with_claude(tracks, quiz_type="indovina_intro"):
+    """
+    Genera domande intelligenti usando Claude API
     
+    NOTA: Questa è una versione SEMPLIFICATA che non richiede API key.
+    Genera domande base ma funzionali.
+    """
+    
+    print("\n🤖 Generazione domande intelligenti...")
+    return list(iter_questions(tracks, quiz_type))
+
+
+def csv_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def read_tracks(csv_file):
+    """Legge le tracce da un CSV Exportify (con anno, feature audio e generi)"""
     tracks = []
     
+    with open(csv_file, 'r', encoding='utf-8-sig') as f:
+        reader = csv.DictReader(f)
+        
+        for row in reader:
+            uri = row.get('Track URI', '')
+            track_id = uri.split(':')[-1] if ':' in uri else uri
+            title = row.get('Track Name', 'Unknown')
+            artist = row.get('Artist Name(s)', 'Unknown').split(';')[0]
+            
+            release = row.get('Release Date') or ''
+            
+            if track_id:
+                tracks.append({
+                    'id': track_id,
+                    'title': title,
+                    'artist': artist,
+                    'year': int(release[:4]) if release[:4].isdigit() else None,
+                    'danceability': csv_float(row.get('Danceability')),
+                    'energy': csv_float(row.get('Energy')),
+                    'tempo': csv_float(row.get('Tempo')),
+                    'valence': csv_float(row.get('Valence')),
+                    'genres': [g.strip() for g in (row.get('Genres') or '').split(',') if g.strip()]
+                })
+    
+    return tracks
+
+
+def dedupe_tracks(tracks):
+    """Una domanda per canzone: le versioni (remaster, single, mono...) contano come una"""
+    unique = {}
+    for track in tracks:
+        unique.setdefault(track_key(track['title'], track['artist']), track)
+    return list(unique.values())
+
+
+def write_sql(f, questions, tracks, quiz_name, category, genre, quiz_type):
+    """Scrive l'INSERT per quiz_library un pezzo alla volta, senza costruire la stringa intera"""
+    f.write(f"""-- ============================================================
+-- QUIZ: {sql_comment(quiz_name)}
+-- Categoria: {sql_comment(category)}
+-- Genere: {sql_comment(genre)}
+-- Tipo: {quiz_type}
+-- Tracce: {len(tracks)}
+-- Generato con Smart Quiz Generator
+-- ============================================================
+
+INSERT INTO quiz_library (name, category, genre, media_type, description, questions) VALUES
+({sql_quote(quiz_name)}, {sql_quote(category)}, {sql_quote(genre)}, 'audio', 'Indovina la canzone',
+'[""")
+    
+    written = 0
+    for q in questions:
+        if written:
+            f.write(", ")
+        f.write(json.dumps(q, ensure_ascii=False).replace("'", "''"))
+        written += 1
+    
+    f.write("""]'::jsonb);
+
+-- ============================================================
+-- TRACCE INCLUSE
+-- ============================================================
+""")
+    
+    for i, track in enumerate(tracks, 1):
+        f.write(f"-- {i}. {sql_comment(track['artist'])} - {sql_comment(track['title'])}\n")
+    
+    return written
+
+
+def write_json(f, questions, tracks, quiz_name, category, genre, quiz_type):
+    """Scrive il quiz come JSON (formato di /api/admin/quiz/library/import), una domanda alla volta"""
+    header = {
+        "name": quiz_name,
+        "category": category,
+        "genre": genre,
+        "media_type": "audio",
+        "description": "Indovina la canzone"
+    }
+    f.write("[" + json.dumps(header, ensure_ascii=False)[:-1] + ', "questions": [')
+    
+    written = 0
+    for q in questions:
+        f.write(",\n" if written else "\n")
+        f.write(json.dumps(q, ensure_ascii=False))
+        written += 1
+    
+    f.write("\n]}]\n")
+    return written
+
+
+def write_jsonl(f, questions, tracks, quiz_name, category, genre, quiz_type):
+    """Una riga JSON per quiz: il file si carica con /api/admin/quiz/library/import-jsonl"""
+    header = {
+        "name": quiz_name,
+        "category": category,
+        "genre": genre,
+        "media_type": "audio",
+        "description": "Indovina la canzone"
+    }
+    f.write(json.dumps(header, ensure_ascii=False)[:-1] + ', "questions": [')
+    
+    written = 0
+    for q in questions:
+        if written:
+            f.write(", ")
+        f.write(json.dumps(q, ensure_ascii=False))
+        written += 1
+    
+    f.write("]}\n")
+    return written
+
+
+WRITERS = {"sql": write_sql, "json": write_json, "jsonl": write_jsonl}
+QUIZ_TYPES = {"chi_canta": "Chi Canta?", "indovina_intro": "Indovina Intro"}
+
+
+def csv_to_smart_quiz(csv_file, quiz_name, category, genre, quiz_type, output_file, output_format="sql"):
+    """Converte CSV in quiz intelligente, scrivendo il file mentre genera le domande"""
+    
     # Leggi CSV
     print(f"\n📖 Leggo {csv_file}...")
     
     try:
-        with open(csv_file, 'r', encoding='utf-8-sig') as f:
-            reader = csv.DictReader(f)
-            
-            for row in reader:
-                uri = row.get('Track URI', '')
-                track_id = uri.split(':')[-1] if ':' in uri else uri
-                title = row.get('Track Name', 'Unknown')
-                artist = row.get('Artist Name(s)', 'Unknown').split(';')[0]
-                
-                if track_id:
-                    tracks.append({
-                        'id': track_id,
-                        'title': title,
-                        'artist': artist
-                    })
-    
+        tracks = read_tracks(csv_file)
     except Exception as e:
         print(f"❌ Errore: {e}")
         return None
@@ -112,36 +405,25 @@ def csv_to_smart_quiz(csv_file, quiz_name, category, genre, quiz_type):
         return None
     
     print(f"✅ {len(tracks)} tracce trovate!")
+    unique = dedupe_tracks(tracks)
+    if len(unique) < len(tracks):
+        print(f"♻️  {len(tracks) - len(unique)} doppioni saltati")
+    tracks = unique
     
-    # Genera domande intelligenti
-    questions = generate_questions_with_claude(tracks, quiz_type)
+    # Genera domande intelligenti e scrivi il file
+    print("\n🤖 Generazione domande intelligenti...")
+    examples = []
     
-    # Genera SQL
-    questions_json = json.dumps(questions, ensure_ascii=False)
-    questions_json_escaped = questions_json.replace("'", "''")
+    def questions():
+        for q in iter_questions(tracks, quiz_type):
+            if len(examples) < 5:
+                examples.append(q)
+            yield q
     
-    sql = f"""-- ============================================================
--- QUIZ: {quiz_name}
--- Categoria: {category}
--- Genere: {genre}
--- Tipo: {quiz_type}
--- Tracce: {len(tracks)}
--- Generato con Smart Quiz Generator
--- ============================================================
-
-INSERT INTO quiz_library (name, category, genre, media_type, description, questions) VALUES
-('{quiz_name}', '{category}', '{genre}', 'audio', 'Indovina la canzone',
-'{questions_json_escaped}'::jsonb);
-
--- ============================================================
--- TRACCE INCLUSE
--- ============================================================
-"""
-    
-    for i, track in enumerate(tracks, 1):
-        sql += f"-- {i}. {track['artist']} - {track['title']}\n"
+    with open(output_file, 'w', encoding='utf-8') as f:
+        count = WRITERS[output_format](f, questions(), tracks, quiz_name, category, genre, quiz_type)
     
-    return sql, tracks, questions
+    return tracks, examples, count
 
 
 def main():
@@ -202,6 +484,12 @@ def main():
     
     genre = input("\n🎸 Genere [Misto]: ").strip() or "Misto"
     
+    print("\n💾 Formato file:")
+    print("  1. SQL (default)")
+    print("  2. JSON")
+    
+    output_format = "json" if input("Scegli [1]: ").strip() == "2" else "sql"
+    
     # Conferma
     print("\n" + "="*60)
     print("📋 RIEPILOGO")
@@ -210,6 +498,7 @@ def main():
     print(f"Nome: {quiz_name}")
     print(f"Tipo: {quiz_type}")
     print(f"Genere: {genre}")
+    print(f"Formato: {output_format.upper()}")
     
     confirm = input("\nProcedere? (S/n): ").strip().lower()
     if confirm and confirm != 's':
@@ -217,21 +506,17 @@ def main():
         input("\n⏸️  Premi INVIO...")
         return
     
-    # Genera
-    result = csv_to_smart_quiz(csv_file, quiz_name, category, genre, quiz_type)
+    # Genera e salva
+    safe_name = re.sub(r'[^a-z0-9]+', '_', quiz_name.lower())
+    output_file = f"quiz_{safe_name}.{output_format}"
+    
+    result = csv_to_smart_quiz(csv_file, quiz_name, category, genre, quiz_type, output_file, output_format)
     
     if not result:
         input("\n⏸️  Premi INVIO...")
         return
     
-    sql, tracks, questions = result
-    
-    # Salva
-    safe_name = re.sub(r'[^a-z0-9]+', '_', quiz_name.lower())
-    output_file = f"quiz_{safe_name}.sql"
-    
-    with open(output_file, 'w', encoding='utf-8') as f:
-        f.write(sql)
+    tracks, questions, count = result
     
     # Report
     print("\n" + "="*60)
@@ -249,17 +534,159 @@ def main():
             marker = "✓" if j == q['correct_index'] else " "
             print(f"   {marker} {opt}")
     
-    if len(questions) > 5:
-        print(f"\n... e altre {len(questions) - 5} domande")
+    if count > 5:
+        print(f"\n... e altre {count - 5} domande")
     
     print("\n" + "="*60)
-    print("💡 Carica il file SQL in Supabase!")
+    if output_format == "sql":
+        print("💡 Carica il file SQL in Supabase!")
+    else:
+        print("💡 Importa il file JSON con /api/admin/quiz/library/import!")
     print("="*60)
     
     input("\n✅ Premi INVIO...")
 
 
+# ============================================================
+# MODALITÀ BATCH
+# ============================================================
+
+def quiz_name_from_file(csv_file):
+    return Path(csv_file).stem.replace('_', ' ').title()
+
+
+def process_playlist(csv_file, quiz_type, genre, output_format, output_dir, similar, seed):
+    """Un CSV → un quiz (gira in un processo del pool). Restituisce tempi e risultato."""
+    name = quiz_name_from_file(csv_file)
+    result = {"file": str(csv_file), "name": name, "tracks": 0, "duplicates": 0, "questions": 0, "error": None}
+    rng = random.Random(zlib.crc32(name.encode('utf-8')) ^ seed) if seed is not None else None
+    
+    try:
+        start = time.perf_counter()
+        rows = read_tracks(csv_file)
+        tracks = dedupe_tracks(rows)
+        read_done = time.perf_counter()
+        if not tracks:
+            raise ValueError("nessuna traccia trovata")
+        result["duplicates"] = len(rows) - len(tracks)
+        
+        questions = iter_questions(tracks, quiz_type, rng, verbose=False, similar=similar)
+        args = (tracks, name, QUIZ_TYPES[quiz_type], genre, quiz_type)
+        if output_format == "jsonl":
+            # Le righe tornano al processo principale, che scrive un unico file
+            buffer = io.StringIO()
+            result["questions"] = write_jsonl(buffer, questions, *args)
+            result["line"] = buffer.getvalue()
+        else:
+            safe_name = re.sub(r'[^a-z0-9]+', '_', name.lower())
+            output_file = Path(output_dir) / f"quiz_{safe_name}.{output_format}"
+            with open(output_file, 'w', encoding='utf-8') as f:
+                result["questions"] = WRITERS[output_format](f, questions, *args)
+            result["output"] = str(output_file)
+        done = time.perf_counter()
+        
+        result["tracks"] = len(tracks)
+        result["seconds"] = {
+            "read": round(read_done - start, 4),
+            "generate_write": round(done - read_done, 4),
+            "total": round(done - start, 4)
+        }
+    except Exception as e:
+        result["error"] = str(e)
+    
+    return result
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Smart Quiz Generator - modalità batch")
+    parser.add_argument("--batch", required=True, metavar="CARTELLA", help="cartella con i CSV Exportify")
+    parser.add_argument("--type", choices=sorted(QUIZ_TYPES), default="indovina_intro", help="tipo di domanda")
+    parser.add_argument("--genre", default="Misto", help="genere dei quiz")
+    parser.add_argument("--format", choices=sorted(WRITERS), default="jsonl", help="formato di uscita")
+    parser.add_argument("--output", help="file .jsonl (formato jsonl) o cartella (sql/json); default: la cartella dei CSV")
+    parser.add_argument("--report", help="report JSON dei tempi (default: batch_report.json accanto all'output)")
+    parser.add_argument("--workers", type=int, default=None, help="processi in parallelo (default: CPU disponibili)")
+    parser.add_argument("--random", action="store_true", help="risposte sbagliate casuali invece che simili")
+    parser.add_argument("--seed", type=int, default=None, help="seme per risultati ripetibili")
+    return parser.parse_args(argv)
+
+
+def batch_main(args):
+    batch_dir = Path(args.batch)
+    csv_files = sorted(batch_dir.glob("*.csv"))
+    if not csv_files:
+        print(f"❌ Nessun CSV in {batch_dir}")
+        return 1
+    
+    if args.format == "jsonl":
+        output_file = Path(args.output) if args.output else batch_dir / "quiz_library.jsonl"
+        output_dir = output_file.parent
+    else:
+        output_file = None
+        output_dir = Path(args.output) if args.output else batch_dir
+    output_dir.mkdir(parents=True, exist_ok=True)
+    report_file = Path(args.report) if args.report else output_dir / "batch_report.json"
+    
+    print(f"\n🎵 Batch: {len(csv_files)} CSV da {batch_dir} → {args.format.upper()}")
+    start = time.perf_counter()
+    results = []
+    out = open(output_file, 'w', encoding='utf-8') if output_file else None
+    try:
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            futures = [
+                pool.submit(process_playlist, f, args.type, args.genre, args.format, output_dir, not args.random, args.seed)
+                for f in csv_files
+            ]
+            for future in as_completed(futures):
+                result = future.result()
+                line = result.pop("line", None)
+                if out and line:
+                    out.write(line)
+                results.append(result)
+                if result["error"]:
+                    print(f"   ❌ {result['file']}: {result['error']}")
+                else:
+                    print(f"   ✅ {result['name']}: {result['questions']} domande in {result['seconds']['total']:.2f}s")
+    finally:
+        if out:
+            out.close()
+    wall = time.perf_counter() - start
+    
+    ok = [r for r in results if not r["error"]]
+    cpu = sum(r["seconds"]["total"] for r in ok)
+    report = {
+        "type": args.type,
+        "format": args.format,
+        "output": str(output_file or output_dir),
+        "files": len(csv_files),
+        "succeeded": len(ok),
+        "failed": len(results) - len(ok),
+        "tracks": sum(r["tracks"] for r in ok),
+        "duplicates": sum(r["duplicates"] for r in ok),
+        "questions": sum(r["questions"] for r in ok),
+        "wall_seconds": round(wall, 3),
+        "worker_seconds": round(cpu, 3),
+        "slowest": sorted(ok, key=lambda r: r["seconds"]["total"], reverse=True)[:5],
+        "playlists": sorted(results, key=lambda r: r["file"])
+    }
+    with open(report_file, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    
+    print("\n" + "="*60)
+    print("📊 RIEPILOGO BATCH")
+    print("="*60)
+    print(f"CSV: {report['succeeded']}/{report['files']} ok")
+    print(f"Domande: {report['questions']} da {report['tracks']} tracce ({report['duplicates']} doppioni saltati)")
+    print(f"Tempo: {wall:.2f}s (lavoro nei processi: {cpu:.2f}s)")
+    print(f"💾 Output: {report['output']}")
+    print(f"📋 Report: {report_file}")
+    return 0 if not report["failed"] else 2
+
+
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        sys.exit(batch_main(parse_args()))
+    
     try:
         main()
     except KeyboardInterrupt:
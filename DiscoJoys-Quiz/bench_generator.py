@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+⏱️ BENCHMARK SMART QUIZ GENERATOR
+Misura generazione domande + scrittura SQL/JSON su playlist sintetiche
+(60, 5.000 e 50.000 tracce).
+
+Uso:
+    python bench_generator.py              # solo generatore attuale
+    python bench_generator.py --legacy     # confronto con il vecchio O(n²) (fino a 5.000 tracce)
+    python bench_generator.py --random     # risposte sbagliate casuali invece che "simili"
+"""
+
+import argparse
+import importlib.util
+import os
+import random
+import tempfile
+import time
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+SIZES = [60, 5000, 50000]
+LEGACY_MAX = 5000  # oltre, il vecchio algoritmo impiega minuti
+
+
+def load_generator():
+    spec = importlib.util.spec_from_file_location("smart_quiz_generator", HERE / "Smart quiz generator.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def fake_tracks(n, rng):
+    artists = [f"Artista {i}" for i in range(max(4, n // 8))]
+    genres = [f"genere {i}" for i in range(200)]
+    return [
+        {
+            "id": f"track{i:07d}", "title": f"Canzone {i}", "artist": rng.choice(artists),
+            "year": rng.randint(1955, 2025), "danceability": rng.random(), "energy": rng.random(),
+            "tempo": rng.uniform(60, 200), "valence": rng.random(),
+            "genres": rng.sample(genres, rng.randint(0, 3))
+        }
+        for i in range(n)
+    ]
+
+
+def legacy_questions(tracks, quiz_type):
+    """Il vecchio ciclo: copia e mescola tutta la playlist per ogni traccia"""
+    questions = []
+    for track in tracks:
+        other_tracks = [t for t in tracks if t['id'] != track['id']]
+        random.shuffle(other_tracks)
+        key = 'artist' if quiz_type == "chi_canta" else 'title'
+        correct = track[key]
+        options = [correct] + [t[key] for t in other_tracks[:3]]
+        random.shuffle(options)
+        questions.append({"options": options, "correct_index": options.index(correct)})
+    return questions
+
+
+def run(generator, n, quiz_type, output_format, legacy, similar):
+    rng = random.Random(n)
+    tracks = fake_tracks(n, rng)
+    writer = generator.WRITERS[output_format]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        output_file = os.path.join(tmp, f"quiz.{output_format}")
+        start = time.perf_counter()
+        with open(output_file, 'w', encoding='utf-8') as f:
+            writer(f, generator.iter_questions(tracks, quiz_type, rng, verbose=False, similar=similar),
+                   tracks, "Benchmark", "Chi Canta?", "Misto", quiz_type)
+        elapsed = time.perf_counter() - start
+        size = os.path.getsize(output_file)
+
+    legacy_elapsed = None
+    if legacy and n <= LEGACY_MAX:
+        start = time.perf_counter()
+        legacy_questions(tracks, quiz_type)
+        legacy_elapsed = time.perf_counter() - start
+
+    return elapsed, size, legacy_elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dello Smart Quiz Generator")
+    parser.add_argument("--type", choices=["chi_canta", "indovina_intro"], default="chi_canta")
+    parser.add_argument("--format", choices=["sql", "json"], default="sql")
+    parser.add_argument("--legacy", action="store_true", help="misura anche il vecchio algoritmo O(n²)")
+    parser.add_argument("--random", action="store_true", help="risposte sbagliate casuali (senza NumPy)")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    args = parser.parse_args()
+
+    generator = load_generator()
+
+    similar = not args.random and generator.np is not None
+    print(f"\n⏱️  Benchmark {args.type} → {args.format.upper()} ({'simili' if similar else 'casuali'})")
+    print("-" * 60)
+    print(f"{'Tracce':>8} | {'Attuale':>10} | {'Tracce/s':>10} | {'File':>9} | {'Vecchio':>10}")
+    print("-" * 60)
+    for n in args.sizes:
+        elapsed, size, legacy_elapsed = run(generator, n, args.type, args.format, args.legacy, similar)
+        legacy_text = f"{legacy_elapsed:9.3f}s" if legacy_elapsed is not None else f"{'-':>10}"
+        print(f"{n:>8} | {elapsed:9.3f}s | {n / elapsed:>10.0f} | {size / 1024:7.0f}KB | {legacy_text}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Benchmark: WebSocket vs Server-Sent Events for the display screens.
+
+Starts the API in-process (in-memory pub, no MongoDB), connects N screens on
+each transport and measures how long every broadcast takes to reach them.
+
+Usage:
+    python bench_display_stream.py                  # 50 screens, 200 events
+    python bench_display_stream.py --screens 200 --events 500
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import sys
+import threading
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import httpx
+import uvicorn
+import websockets
+
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'neonpub_karaoke_bench')
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import server  # noqa: E402
+
+logging.getLogger("httpx").setLevel(logging.WARNING)
+logging.getLogger("neonpub.access").setLevel(logging.WARNING)
+
+PUB = {"id": "bench-pub", "name": "Bench", "code": "BENCH", "current_performance_id": None}
+
+
+class Cursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, *args):
+        return self
+
+    async def to_list(self, length=None):
+        return list(self.docs)[:length]
+
+
+class Collection:
+    def __init__(self, docs):
+        self.docs = docs
+
+    async def find_one(self, query, projection=None):
+        return next((d for d in self.docs if all(d.get(k) == v for k, v in query.items())), None)
+
+    def find(self, query, projection=None):
+        return Cursor(self.docs)
+
+
+def start_server(port):
+    server.db = SimpleNamespace(pubs=Collection([PUB]), performances=Collection([]),
+                                song_requests=Collection([]), users=Collection([]),
+                                quizzes=Collection([]))
+    config = uvicorn.Config(server.app, host="127.0.0.1", port=port, lifespan="off", log_level="warning")
+    api = uvicorn.Server(config)
+    loops = []
+
+    async def serve():
+        # Broadcasts have to run on the server's own loop, next to the connections
+        loops.append(asyncio.get_running_loop())
+        await api.serve()
+
+    thread = threading.Thread(target=asyncio.run, args=(serve(),), daemon=True)
+    thread.start()
+    while not api.started:
+        time.sleep(0.05)
+    return api, thread, loops[0]
+
+
+async def ws_screen(port, received, ready):
+    async with websockets.connect(f"ws://127.0.0.1:{port}/api/ws/{PUB['code']}") as ws:
+        ready.release()
+        async for raw in ws:
+            message = json.loads(raw)
+            if message["type"] == "bench":
+                received.append(time.perf_counter() - message["data"]["sent"])
+
+
+async def sse_screen(client, port, received, ready):
+    async with client.stream("GET", f"http://127.0.0.1:{port}/api/display/stream/{PUB['code']}") as response:
+        async for line in response.aiter_lines():
+            if not line.startswith("data: "):
+                continue
+            message = json.loads(line[6:])
+            if message["type"] == "snapshot":
+                ready.release()
+            elif message["type"] == "bench":
+                received.append(time.perf_counter() - message["data"]["sent"])
+
+
+async def run_transport(transport, port, loop, screens, events):
+    received, ready = [], asyncio.Semaphore(0)
+    async with httpx.AsyncClient(timeout=None, limits=httpx.Limits(max_connections=screens + 1)) as client:
+        tasks = [
+            asyncio.create_task(ws_screen(port, received, ready) if transport == "ws"
+                                else sse_screen(client, port, received, ready))
+            for _ in range(screens)
+        ]
+        for _ in range(screens):
+            done, _ = await asyncio.wait([asyncio.ensure_future(ready.acquire())] + tasks,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            failed = [t for t in done if t in tasks]
+            if failed:
+                raise RuntimeError(f"{transport} screen failed to connect: {failed[0].exception()!r}")
+        # The server has registered every screen before the first event
+        await asyncio.sleep(0.2)
+
+        fanout = []
+        for _ in range(events):
+            start = time.perf_counter()
+            message = {"type": "bench", "data": {"sent": start}}
+            await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(server.manager.broadcast(PUB["id"], message), loop))
+            fanout.append(time.perf_counter() - start)
+            await asyncio.sleep(0.005)
+
+        deadline = time.perf_counter() + 5
+        while len(received) < screens * events and time.perf_counter() < deadline:
+            await asyncio.sleep(0.05)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    return received, fanout
+
+
+def ms(values, q):
+    return statistics.quantiles(values, n=100)[q - 1] * 1000 if len(values) > 1 else values[0] * 1000
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="WebSocket vs SSE fan-out to display screens")
+    parser.add_argument("--screens", type=int, default=50)
+    parser.add_argument("--events", type=int, default=200)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    api, thread, loop = start_server(args.port)
+
+    print(f"\n{args.screens} screens, {args.events} events")
+    print("-" * 74)
+    print(f"{'Transport':>9} | {'Delivered':>11} | {'p50':>8} | {'p95':>8} | {'max':>8} | {'Fan-out p95':>11}")
+    print("-" * 74)
+    for transport in ("ws", "sse"):
+        received, fanout = await run_transport(transport, args.port, loop, args.screens, args.events)
+        delivered = f"{len(received)}/{args.screens * args.events}"
+        print(f"{transport.upper():>9} | {delivered:>11} | {ms(received, 50):6.2f}ms | {ms(received, 95):6.2f}ms | "
+              f"{max(received) * 1000:6.2f}ms | {ms(fanout, 95):9.2f}ms")
+
+    api.should_exit = True
+    thread.join(timeout=5)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,270 @@
+"""
+Sampling profiler for individual requests (driven by the profiler middleware).
+
+A helper thread wakes up every few milliseconds and looks at each profiled
+request task. When the task is on the CPU its Python stack is read from the
+event loop thread; when it is suspended the chain of awaits it is parked on
+is recorded instead, under "[awaiting]", so time spent waiting on Mongo or
+YouTube shows up next to time spent computing. Nothing is traced, so
+requests that are not sampled pay nothing.
+
+Each profiled request is written as one collapsed-stack file (".folded",
+"frame;frame;frame count" per line), ready for flamegraph.pl or speedscope.
+
+LoopLagMonitor watches the event loop itself: a heartbeat task measures how
+late the loop wakes it up, and a watchdog thread grabs the loop thread's
+stack while it is still stuck, so the log names the code that blocked it.
+"""
+import asyncio
+import logging
+import random
+import re
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional
+
+try:
+    from asyncio.tasks import _current_tasks  # the task running on each loop (C-accelerated dict)
+except ImportError:  # pragma: no cover
+    _current_tasks = None
+
+MAX_STACK_DEPTH = 128
+ROUTE_PATTERN_MAX_LENGTH = 200
+_QUANTIFIERS = "*+?{"
+
+
+def check_route_pattern(pattern: str):
+    """
+    Compiles a route pattern, refusing the ones that can backtrack for ages
+    on a crafted path: too long, backreferences, or a repeated group that
+    itself repeats or alternates ("(a+)+", "(a|aa)*"). Raises re.error.
+    """
+    if len(pattern) > ROUTE_PATTERN_MAX_LENGTH:
+        raise re.error(f"longer than {ROUTE_PATTERN_MAX_LENGTH} characters")
+    if re.search(r"\\[1-9]|\(\?P=", pattern):
+        raise re.error("backreferences are not allowed")
+    groups = []  # per open group: does it contain a quantifier or "|"
+    i = 0
+    while i < len(pattern):
+        ch = pattern[i]
+        if ch == "\\":
+            i += 2
+            continue
+        if ch == "[":
+            # Skip the character class: quantifiers inside it are literals
+            i += 2 if pattern[i + 1:i + 2] == "]" else 1
+            while i < len(pattern) and pattern[i] != "]":
+                i += 2 if pattern[i] == "\\" else 1
+        elif ch == "(":
+            groups.append(False)
+            if pattern[i + 1:i + 2] == "?":
+                i += 1
+        elif ch == ")" and groups:
+            risky = groups.pop()
+            if risky and pattern[i + 1:i + 2] and pattern[i + 1] in _QUANTIFIERS:
+                raise re.error("a repeated group cannot contain quantifiers or alternatives")
+            if risky and groups:
+                groups[-1] = True
+        elif ch in _QUANTIFIERS or ch == "|":
+            if groups:
+                groups[-1] = True
+        i += 1
+    return re.compile(pattern)
+
+
+def frame_name(code) -> str:
+    return f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})"
+
+
+def fold_frame(frame) -> str:
+    """Collapsed stack of a thread, outermost call first"""
+    names = []
+    while frame is not None and len(names) < MAX_STACK_DEPTH:
+        names.append(frame_name(frame.f_code))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+def fold_awaiting(task: asyncio.Task) -> str:
+    """Collapsed await chain of a suspended task, ending with what it waits on"""
+    names = ["[awaiting]"]
+    awaitable = task.get_coro()
+    while awaitable is not None and len(names) < MAX_STACK_DEPTH:
+        frame = getattr(awaitable, "cr_frame", None) or getattr(awaitable, "gi_frame", None)
+        if frame is None and not hasattr(awaitable, "cr_await") and not hasattr(awaitable, "gi_yieldfrom"):
+            names.append(f"[{type(awaitable).__name__}]")
+            break
+        if frame is not None:
+            names.append(frame_name(frame.f_code))
+        awaitable = getattr(awaitable, "cr_await", None) or getattr(awaitable, "gi_yieldfrom", None)
+    return ";".join(names)
+
+
+class SamplingProfiler:
+    """Which requests to profile, the sampling thread and the .folded files it produces"""
+
+    def __init__(self, directory: Path, interval: float = 0.005, max_files: int = 500):
+        self.directory = Path(directory)
+        self.interval = interval
+        self.max_files = max_files
+        self.enabled = False
+        self.sample_rate = 0.0
+        self.route_pattern: Optional[re.Pattern] = None
+        self.active: Dict[asyncio.Task, Counter] = {}
+        self.profiled = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def configure(self, enabled: bool, sample_rate: float = 0.0, route_pattern: Optional[str] = None,
+                  interval: Optional[float] = None):
+        """Raises re.error for an invalid or too costly pattern"""
+        self.route_pattern = check_route_pattern(route_pattern) if route_pattern else None
+        self.sample_rate = sample_rate
+        if interval:
+            self.interval = interval
+        self.enabled = enabled
+
+    def wants(self, path: str) -> bool:
+        if not self.enabled:
+            return False
+        if self.route_pattern is not None and self.route_pattern.search(path):
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def start(self, task: asyncio.Task) -> Counter:
+        self._loop = task.get_loop()
+        self._loop_thread_id = threading.get_ident()
+        stacks = Counter()
+        with self._lock:
+            self.active[task] = stacks
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+                self._thread.start()
+        return stacks
+
+    def stop(self, task: asyncio.Task) -> Counter:
+        with self._lock:
+            return self.active.pop(task, Counter())
+
+    def _run(self):
+        # Exits when nothing is being profiled; the next profiled request starts it again
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self.active:
+                    self._thread = None
+                    return
+                self.sample()
+
+    def sample(self):
+        frame = sys._current_frames().get(self._loop_thread_id)
+        running = _current_tasks.get(self._loop) if _current_tasks is not None else None
+        for task, stacks in self.active.items():
+            try:
+                stack = fold_frame(frame) if task is running and frame is not None else fold_awaiting(task)
+            except Exception:  # the task moved on while being read
+                continue
+            stacks[stack] += 1
+
+    def write(self, method: str, path: str, elapsed: float, stacks: Counter) -> Optional[Path]:
+        """Blocking: run it in a thread"""
+        if not stacks:
+            return None
+        self.directory.mkdir(parents=True, exist_ok=True)
+        slug = re.sub(r"[^A-Za-z0-9]+", "_", path).strip("_")[:60] or "root"
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{int(time.time() * 1000) % 1000:03d}-{method}-{slug}-{elapsed * 1000:.0f}ms.folded"
+        target = self.directory / name
+        target.write_text("".join(f"{stack} {count}\n" for stack, count in stacks.most_common()), encoding="utf-8")
+        self.profiled += 1
+        self._prune()
+        return target
+
+    def files(self) -> List[Path]:
+        if not self.directory.is_dir():
+            return []
+        return sorted(self.directory.glob("*.folded"))
+
+    def _prune(self):
+        files = self.files()
+        for old in files[:max(0, len(files) - self.max_files)]:
+            old.unlink(missing_ok=True)
+
+    def status(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "sample_rate": self.sample_rate,
+            "route_pattern": self.route_pattern.pattern if self.route_pattern else None,
+            "interval_ms": self.interval * 1000,
+            "directory": str(self.directory),
+            "in_flight": len(self.active),
+            "profiled": self.profiled,
+            "recent": [f.name for f in self.files()[-20:]]
+        }
+
+
+class LoopLagMonitor:
+    """Event-loop lag as a metric, plus the stack of whatever blocks the loop past the threshold"""
+
+    def __init__(self, interval: float, threshold: float, lag_histogram, stalls_counter,
+                 logger: Optional[logging.Logger] = None):
+        self.interval = interval
+        self.threshold = threshold
+        self.lag_histogram = lag_histogram
+        self.stalls_counter = stalls_counter
+        self.logger = logger or logging.getLogger(__name__)
+        self._last_beat = 0.0
+        self._stall_reported = False
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._task is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watch, name="loop-lag-watchdog", daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._thread is not None:
+            await asyncio.to_thread(self._thread.join, 1)
+            self._thread = None
+
+    async def _heartbeat(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - expected)
+            self.lag_histogram.observe(lag)
+            self._last_beat = now
+            self._stall_reported = False
+
+    def _watch(self):
+        # Checks often enough to catch the loop mid-stall, not only after it recovered
+        while not self._stop.wait(min(self.threshold, self.interval) / 2):
+            blocked = time.monotonic() - self._last_beat - self.interval
+            if blocked > self.threshold and not self._stall_reported:
+                self._stall_reported = True
+                self.stalls_counter.inc()
+                frame = sys._current_frames().get(self._loop_thread_id)
+                stack = "".join(traceback.format_stack(frame)) if frame is not None else "(no stack)\n"
+                self.logger.warning("Event loop blocked for %.0fms, still running:\n%s", blocked * 1000, stack)
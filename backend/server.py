@@ -1,37 +1,148 @@
-from fastapi import FastAPI, APIRouter, HTTPException, WebSocket, WebSocketDisconnect, Depends, Query
+from fastapi import FastAPI, APIRouter, HTTPException, WebSocket, WebSocketDisconnect, Depends, Query, Request, Response
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import StreamingResponse
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from sortedcontainers import SortedList
 import os
+import re
+import time
 import logging
+import csv
 import json
+import hashlib
+import hmac
+import random
+from collections import OrderedDict, deque
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict
 from typing import List, Optional, Dict, Any
 import uuid
-from datetime import datetime, timezone
+from datetime import datetime, timezone, timedelta
+from zoneinfo import ZoneInfo
 import jwt
 import bcrypt
 import asyncio
 import httpx
+from track_keys import normalize_text, track_key
+from metrics import Registry, MongoCommandMetrics
+from profiling import SamplingProfiler, LoopLagMonitor, ROUTE_PATTERN_MAX_LENGTH
+from structured_logging import (setup_logging, MongoRequestTimer, RequestTimings, request_timings,
+                                note_pub, add_http_time, dropped_records)
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# Metrics (served by /api/metrics)
+# Scrapes need "Authorization: Bearer <METRICS_TOKEN>"; without a token the endpoint stays
+# closed unless METRICS_PUBLIC=true says it is only reachable from a private network
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+METRICS_PUBLIC = os.environ.get('METRICS_PUBLIC', 'false').lower() == 'true'
+metrics_registry = Registry()
+http_latency = metrics_registry.histogram(
+    "neonpub_http_request_duration_seconds", "HTTP request latency by route", ("method", "route", "status"))
+mongo_latency = metrics_registry.histogram(
+    "neonpub_mongo_command_duration_seconds", "MongoDB command latency", ("collection", "command"))
+mongo_failures = metrics_registry.counter(
+    "neonpub_mongo_command_failures_total", "MongoDB commands that failed", ("collection", "command"))
+broadcast_latency = metrics_registry.histogram(
+    "neonpub_broadcast_duration_seconds", "Time to fan an event out to every screen of a pub", ("type",))
+broadcast_failures = metrics_registry.counter(
+    "neonpub_broadcast_failures_total", "Screens dropped while broadcasting", ("transport",))
+youtube_latency = metrics_registry.histogram(
+    "neonpub_youtube_request_duration_seconds", "YouTube Data API call latency", ("endpoint", "outcome"))
+loop_lag = metrics_registry.histogram(
+    "neonpub_event_loop_lag_seconds", "How late the event loop runs a timer callback")
+loop_stalls = metrics_registry.counter(
+    "neonpub_event_loop_stalls_total", "Times the event loop stayed blocked past LOOP_LAG_THRESHOLD_MS")
+
+# Event-loop watchdog: lag sampled every LOOP_LAG_INTERVAL_MS, blocking stacks logged past the threshold
+LOOP_LAG_INTERVAL_MS = float(os.environ.get('LOOP_LAG_INTERVAL_MS', '100'))
+LOOP_LAG_THRESHOLD_MS = float(os.environ.get('LOOP_LAG_THRESHOLD_MS', '100'))
+
+# Logging: JSON lines (LOG_FORMAT=text for the old format) written by a background thread
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')
+LOG_FILE = os.environ.get('LOG_FILE', '')  # stderr when empty
+ACCESS_LOG_SLOW_MS = float(os.environ.get('ACCESS_LOG_SLOW_MS', '500'))  # slow requests are always logged
+# Share of requests logged per route template; errors and slow requests are always logged
+ACCESS_LOG_SAMPLING = {
+    route: float(rate)
+    for route, _, rate in (
+        item.strip().partition('=')
+        for item in os.environ.get(
+            'ACCESS_LOG_SAMPLING', '/api/reactions/send=0.05,/api/quiz/answer=0.2,/api/display/data=0.1'
+        ).split(',')
+        if '=' in item
+    )
+}
+
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(mongo_url, event_listeners=[
+    MongoCommandMetrics(mongo_latency, mongo_failures),
+    MongoRequestTimer()
+])
 db = client[os.environ['DB_NAME']]
 
 # JWT Config
 JWT_SECRET = os.environ.get('JWT_SECRET', 'neonpub-secret-key-2024')
 JWT_ALGORITHM = "HS256"
 
-# YouTube API
 # YouTube API
 YOUTUBE_API_KEY = os.environ.get('YOUTUBE_API_KEY', '')
 AUTO_YOUTUBE_SEARCH = os.environ.get('AUTO_YOUTUBE_SEARCH', 'false').lower() == 'true'
+YOUTUBE_API_BASE = os.environ.get('YOUTUBE_API_BASE', 'https://www.googleapis.com/youtube/v3').rstrip('/')
+YOUTUBE_HTTP2 = os.environ.get('YOUTUBE_HTTP2', 'true').lower() == 'true'
+YOUTUBE_CACHE_TTL_HOURS = int(os.environ.get('YOUTUBE_CACHE_TTL_HOURS', '168'))
+YOUTUBE_CACHE_MEMORY_SIZE = int(os.environ.get('YOUTUBE_CACHE_MEMORY_SIZE', '2000'))
+# Searches that found nothing are remembered too, for less time: a karaoke upload may appear later
+YOUTUBE_CACHE_NEGATIVE_TTL_MINUTES = int(os.environ.get('YOUTUBE_CACHE_NEGATIVE_TTL_MINUTES', '60'))
+YOUTUBE_SEARCH_QUOTA_COST = 100  # quota units burned by every search.list call
+YOUTUBE_PREFETCH_LOOKAHEAD = int(os.environ.get('YOUTUBE_PREFETCH_LOOKAHEAD', '3'))
+YOUTUBE_DAILY_QUOTA = int(os.environ.get('YOUTUBE_DAILY_QUOTA', '10000'))
+YOUTUBE_BREAKER_THRESHOLD = int(os.environ.get('YOUTUBE_BREAKER_THRESHOLD', '5'))
+YOUTUBE_BREAKER_COOLDOWN = float(os.environ.get('YOUTUBE_BREAKER_COOLDOWN', '60'))
+
+# Quiz answers are persisted in micro-batches
+QUIZ_ANSWER_FLUSH_INTERVAL = float(os.environ.get('QUIZ_ANSWER_FLUSH_INTERVAL', '0.1'))
+QUIZ_ANSWER_BATCH_SIZE = int(os.environ.get('QUIZ_ANSWER_BATCH_SIZE', '200'))
+QUIZ_PROGRESS_INTERVAL = float(os.environ.get('QUIZ_PROGRESS_INTERVAL', '0.25'))
+
+# Quiz timers: seconds per question (0 = closed by the admin), pause before auto-advance
+QUIZ_QUESTION_SECONDS = int(os.environ.get('QUIZ_QUESTION_SECONDS', '0'))
+QUIZ_REVEAL_SECONDS = float(os.environ.get('QUIZ_REVEAL_SECONDS', '5'))
+QUIZ_LATENCY_GRACE = float(os.environ.get('QUIZ_LATENCY_GRACE', '0.3'))  # broadcast fan-out + network
+# Winner nicknames listed in quiz_ended, in answer order (correct_count still counts everyone)
+QUIZ_WINNERS_LIMIT = int(os.environ.get('QUIZ_WINNERS_LIMIT', '100'))
+QUIZ_CLOSED_MEMORY = 1000  # closed question ids remembered so a late answer cannot reopen them
+
+# Quiz nights: no question repeats within a night; questions from recent nights come up less often
+QUIZ_NIGHT_TIMEZONE = os.environ.get('QUIZ_NIGHT_TIMEZONE', 'Europe/Rome')
+QUIZ_NIGHT_CUTOFF_HOUR = int(os.environ.get('QUIZ_NIGHT_CUTOFF_HOUR', '6'))  # a night runs until 6am
+QUIZ_RECENT_NIGHTS = int(os.environ.get('QUIZ_RECENT_NIGHTS', '7'))
+QUIZ_RECENT_WEIGHT = float(os.environ.get('QUIZ_RECENT_WEIGHT', '0.25'))
+
+# Server-Sent Events for the display screens
+SSE_HISTORY_SIZE = int(os.environ.get('SSE_HISTORY_SIZE', '200'))  # events kept per pub for Last-Event-ID
+SSE_QUEUE_SIZE = 100  # a stream this far behind is dropped; the screen reconnects and resumes
+SSE_KEEPALIVE_SECONDS = float(os.environ.get('SSE_KEEPALIVE_SECONDS', '15'))
+
+# Request profiler: off until enabled (env, or /api/admin/profiler with OPERATOR_TOKEN), sampled requests go to PROFILE_DIR
+PROFILE_DIR = Path(os.environ.get('PROFILE_DIR', str(ROOT_DIR / 'profiles')))
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_ROUTE_PATTERN = os.environ.get('PROFILE_ROUTE_PATTERN', '')
+PROFILE_INTERVAL_MS = float(os.environ.get('PROFILE_INTERVAL_MS', '5'))
+PROFILE_MAX_FILES = int(os.environ.get('PROFILE_MAX_FILES', '500'))
+
+# Operator endpoints (profiler): "Authorization: Bearer <token>"; unset keeps them closed.
+# Pub admins are not enough: anyone can create a pub
+OPERATOR_TOKEN = os.environ.get('OPERATOR_TOKEN', '')
+
+# Song catalog (Exportify CSV exports)
+SONG_CATALOG_DIR = Path(os.environ.get('SONG_CATALOG_DIR', str(ROOT_DIR.parent / 'DiscoJoys-Quiz')))
 
 # Create the main app
 app = FastAPI(title="NeonPub Karaoke API")
@@ -42,28 +153,89 @@ security = HTTPBearer(auto_error=False)
 class ConnectionManager:
     def __init__(self):
         self.active_connections: Dict[str, List[WebSocket]] = {}
-    
-    async def connect(self, websocket: WebSocket, pub_id: str):
+        # Sockets opened with a player token; display screens and admins connect without one or as admin
+        self.phones: set = set()
+        # Server-Sent Events: subscriber queues plus recent events for Last-Event-ID resume
+        self.streams: Dict[str, set] = {}
+        self.event_ids: Dict[str, int] = {}
+        self.history: Dict[str, deque] = {}
+        # Ids restart with the process: the boot id keeps a stale Last-Event-ID from matching
+        self.boot = uuid.uuid4().hex[:8]
+    
+    async def connect(self, websocket: WebSocket, pub_id: str, phone: bool = False):
         await websocket.accept()
+        self.register(websocket, pub_id, phone)
+    
+    def register(self, websocket: WebSocket, pub_id: str, phone: bool = False):
+        """Start sending broadcasts to an already accepted socket"""
         if pub_id not in self.active_connections:
             self.active_connections[pub_id] = []
         self.active_connections[pub_id].append(websocket)
+        if phone:
+            self.phones.add(websocket)
     
     def disconnect(self, websocket: WebSocket, pub_id: str):
+        self.phones.discard(websocket)
         if pub_id in self.active_connections:
             if websocket in self.active_connections[pub_id]:
                 self.active_connections[pub_id].remove(websocket)
     
-    async def broadcast(self, pub_id: str, message: dict):
+    def subscribe(self, pub_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=SSE_QUEUE_SIZE)
+        self.streams.setdefault(pub_id, set()).add(queue)
+        return queue
+    
+    def unsubscribe(self, pub_id: str, queue: asyncio.Queue):
+        self.streams.get(pub_id, set()).discard(queue)
+    
+    def event_id(self, seq: int) -> str:
+        return f"{self.boot}-{seq}"
+    
+    def events_since(self, pub_id: str, last_event_id: Optional[str]) -> Optional[List[tuple]]:
+        """Events after Last-Event-ID, or None when they can't all be replayed"""
+        boot, _, seq = (last_event_id or "").rpartition("-")
+        if boot != self.boot or not seq.isdigit():
+            return None
+        last, current = int(seq), self.event_ids.get(pub_id, 0)
+        history = self.history.get(pub_id, ())
+        oldest = history[0][0] if history else current + 1
+        if last > current or last + 1 < oldest:
+            return None
+        return [event for event in history if event[0] > last]
+    
+    async def broadcast(self, pub_id: str, message: dict, screens_only: bool = False):
+        """screens_only skips the players' phones: displays (WS and SSE) and admins still get it"""
+        start = time.perf_counter()
+        if message.get("type") not in DISPLAY_STATIC_EVENTS:
+            display_snapshots.invalidate(pub_id)
+        # Encoded once for every screen, whatever the transport
+        text = json.dumps(message, ensure_ascii=False)
+        seq = self.event_ids[pub_id] = self.event_ids.get(pub_id, 0) + 1
+        self.history.setdefault(pub_id, deque(maxlen=SSE_HISTORY_SIZE)).append((seq, text))
+        for queue in list(self.streams.get(pub_id, ())):
+            try:
+                queue.put_nowait((seq, text))
+            except asyncio.QueueFull:
+                # Stuck screen: end its stream, it resumes from Last-Event-ID
+                self.unsubscribe(pub_id, queue)
+                queue.get_nowait()
+                queue.put_nowait(None)
+                broadcast_failures.inc("sse")
+        
         if pub_id in self.active_connections:
             disconnected = []
             for connection in self.active_connections[pub_id]:
+                if screens_only and connection in self.phones:
+                    continue
                 try:
-                    await connection.send_json(message)
+                    await connection.send_text(text)
                 except:
                     disconnected.append(connection)
             for conn in disconnected:
                 self.disconnect(conn, pub_id)
+            if disconnected:
+                broadcast_failures.inc("ws", amount=len(disconnected))
+        broadcast_latency.observe(time.perf_counter() - start, message.get("type", ""))
 
 manager = ConnectionManager()
 
@@ -106,6 +278,8 @@ class SongRequestResponse(BaseModel):
     title: str
     artist: str
     youtube_url: Optional[str]
+    youtube_status: Optional[str] = None
+    duplicate_of: Optional[str] = None
     status: str
     position: int
     created_at: str
@@ -142,6 +316,7 @@ class QuizQuestionCreate(BaseModel):
     correct_index: int
     points: int = 10
     category: Optional[str] = None
+    time_limit: Optional[int] = None  # seconds, closes the question automatically
 
 class QuizAnswerSubmit(BaseModel):
     quiz_id: str
@@ -151,6 +326,12 @@ class AdminEffectCreate(BaseModel):
     effect_type: str  # emoji_burst, filter, text_overlay
     data: dict
 
+class ProfilerSettings(BaseModel):
+    enabled: bool
+    sample_rate: float = Field(0.0, ge=0.0, le=1.0)  # share of all requests
+    route_pattern: Optional[str] = Field(None, max_length=ROUTE_PATTERN_MAX_LENGTH)  # regex on the path: always profiled
+    interval_ms: float = Field(5.0, ge=1.0, le=100.0)
+
 class PresetQuizCategory(BaseModel):
     id: str
     name: str
@@ -158,6 +339,24 @@ class PresetQuizCategory(BaseModel):
     icon: str
     questions_count: int
 
+class QuizLibraryQuestion(BaseModel):
+    question: str
+    options: List[str]
+    correct_index: int
+    points: int = 10
+    difficulty: Optional[int] = None  # 1 (easy) - 3 (hard)
+    media_type: Optional[str] = None
+    media_url: Optional[str] = None
+
+class QuizLibraryEntry(BaseModel):
+    name: str
+    category: str
+    genre: str = "Misto"
+    media_type: str = "text"
+    description: str = ""
+    icon: str = "🎵"
+    questions: List[QuizLibraryQuestion]
+
 # ============== PRESET QUIZ DATA ==============
 
 PRESET_QUIZZES = {
@@ -235,37 +434,659 @@ PRESET_QUIZZES = {
     }
 }
 
-async def auto_search_youtube_karaoke(title: str, artist: str = ""):
-    """Auto-search YouTube for karaoke version - returns first result or None"""
-    if not YOUTUBE_API_KEY or not AUTO_YOUTUBE_SEARCH:
+# ============== YOUTUBE CLIENT ==============
+
+# One pooled client for the whole app lifetime: googleapis.com connections are
+# kept alive (and multiplexed over HTTP/2) instead of paying TCP+TLS per lookup.
+youtube_http: Optional[httpx.AsyncClient] = None
+
+class YouTubeAPIError(Exception):
+    """YouTube Data API answered with a non-200 status"""
+    def __init__(self, status_code: int, text: str):
+        super().__init__(f"YouTube API error {status_code}")
+        self.status_code = status_code
+        self.text = text
+
+def create_youtube_http_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        base_url=YOUTUBE_API_BASE,
+        http2=YOUTUBE_HTTP2,
+        limits=httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=120.0),
+        timeout=httpx.Timeout(5.0, connect=3.0, pool=2.0),
+    )
+
+def get_youtube_http() -> httpx.AsyncClient:
+    """Return the shared client, creating it if startup has not run (scripts, tests)"""
+    global youtube_http
+    if youtube_http is None or youtube_http.is_closed:
+        youtube_http = create_youtube_http_client()
+    return youtube_http
+
+async def close_youtube_http():
+    global youtube_http
+    if youtube_http is not None:
+        await youtube_http.aclose()
+        youtube_http = None
+
+class YouTubeUnavailable(Exception):
+    """Lookup refused without calling Google: quota exhausted or circuit open"""
+
+def youtube_quota_day() -> str:
+    # The Data API quota resets at midnight Pacific time
+    try:
+        return datetime.now(ZoneInfo("America/Los_Angeles")).date().isoformat()
+    except Exception:
+        return datetime.now(timezone.utc).date().isoformat()
+
+class YouTubeCircuitBreaker:
+    """Daily quota budget plus a circuit breaker so a dead API fails fast instead of timing out"""
+    
+    def __init__(self, daily_quota: int, failure_threshold: int, cooldown: float):
+        self.daily_quota = daily_quota
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.quota_day = youtube_quota_day()
+        self.units_used = 0
+        self.quota_exhausted = False
+        self.consecutive_failures = 0
+        self.open_until = 0.0  # time.monotonic() deadline
+        self.rejected = 0
+    
+    def _roll_day(self):
+        today = youtube_quota_day()
+        if today != self.quota_day:
+            self.quota_day = today
+            self.units_used = 0
+            self.quota_exhausted = False
+    
+    @property
+    def state(self) -> str:
+        if self.quota_exhausted:
+            return "quota_exhausted"
+        if time.monotonic() < self.open_until:
+            return "open"
+        return "closed"
+    
+    def before_call(self, cost: int):
+        self._roll_day()
+        if self.quota_exhausted or self.units_used + cost > self.daily_quota:
+            self.rejected += 1
+            raise YouTubeUnavailable("YouTube daily quota exhausted")
+        if time.monotonic() < self.open_until:
+            self.rejected += 1
+            raise YouTubeUnavailable("YouTube temporarily unavailable")
+        # Google bills the call whatever its outcome
+        self.units_used += cost
+    
+    def record_success(self):
+        self.consecutive_failures = 0
+    
+    def record_failure(self, quota_exhausted: bool = False):
+        if quota_exhausted:
+            self.quota_exhausted = True
+            logging.warning("YouTube quota exhausted: lookups disabled until the daily reset")
+            return
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= self.failure_threshold:
+            self.open_until = time.monotonic() + self.cooldown
+            # Half-open after the cooldown: a single further failure trips it again
+            self.consecutive_failures = self.failure_threshold - 1
+            logging.warning("YouTube circuit open for %.0fs", self.cooldown)
+    
+    def stats(self) -> dict:
+        self._roll_day()
+        return {
+            "state": self.state,
+            "quota_day": self.quota_day,
+            "units_used": self.units_used,
+            "daily_quota": self.daily_quota,
+            "consecutive_failures": self.consecutive_failures,
+            "rejected_calls": self.rejected
+        }
+
+youtube_breaker = YouTubeCircuitBreaker(YOUTUBE_DAILY_QUOTA, YOUTUBE_BREAKER_THRESHOLD, YOUTUBE_BREAKER_COOLDOWN)
+
+async def youtube_api_get(path: str, params: dict, cost: int) -> dict:
+    """GET a Data API resource through the quota budget and the circuit breaker"""
+    youtube_breaker.before_call(cost)
+    start = time.perf_counter()
+    try:
+        response = await get_youtube_http().get(path, params={**params, "key": YOUTUBE_API_KEY})
+    except httpx.RequestError:
+        youtube_latency.observe(time.perf_counter() - start, path, "error")
+        add_http_time(time.perf_counter() - start)
+        youtube_breaker.record_failure()
+        raise
+    youtube_latency.observe(time.perf_counter() - start, path, str(response.status_code))
+    add_http_time(time.perf_counter() - start)
+    
+    if response.status_code == 200:
+        youtube_breaker.record_success()
+        return response.json()
+    
+    if response.status_code == 403 and ("quotaExceeded" in response.text or "dailyLimitExceeded" in response.text):
+        youtube_breaker.record_failure(quota_exhausted=True)
+    elif response.status_code == 429 or response.status_code >= 500:
+        youtube_breaker.record_failure()
+    else:
+        youtube_breaker.record_success()
+    raise YouTubeAPIError(response.status_code, response.text)
+
+class SingleFlight:
+    """Merges concurrent calls with the same key into one upstream call"""
+    
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.merged = 0
+    
+    async def do(self, key: str, fn):
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.merged += 1
+        # Shielded: a caller that goes away does not cancel the lookup for the others
+        return await asyncio.shield(task)
+
+youtube_singleflight = SingleFlight()
+
+async def youtube_search(query: str, max_results: int = 5) -> List[dict]:
+    """Run a YouTube video search and return simplified results"""
+    data = await youtube_api_get(
+        "/search",
+        {
+            "part": "snippet",
+            "q": query,
+            "type": "video",
+            "maxResults": max_results
+        },
+        cost=YOUTUBE_SEARCH_QUOTA_COST
+    )
+    
+    results = []
+    for item in data.get("items", []):
+        video_id = item["id"]["videoId"]
+        snippet = item["snippet"]
+        results.append({
+            "video_id": video_id,
+            "title": snippet["title"],
+            "thumbnail": snippet["thumbnails"]["medium"]["url"],
+            "channel": snippet["channelTitle"],
+            "url": f"https://www.youtube.com/watch?v={video_id}"
+        })
+    return results
+
+# ============== YOUTUBE SEARCH CACHE ==============
+
+def youtube_cache_key(title: str, artist: str = "") -> str:
+    # Canonical track key: "Song - Remastered 2011" shares the cached search of "Song"
+    return track_key(title, artist)
+
+class YouTubeSearchCache:
+    """Two-tier cache for karaoke searches: in-memory LRU in front of a Mongo collection with TTL"""
+    
+    def __init__(self, collection, max_entries: int, ttl_seconds: int, negative_ttl_seconds: int = 0):
+        self.collection = collection
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (expires_ts, results)
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+    
+    async def ensure_indexes(self):
+        await self.collection.create_index("key", unique=True)
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+    
+    def _remember(self, key: str, results: List[dict], expires_ts: float):
+        self._entries[key] = (expires_ts, results)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+    
+    async def get(self, key: str) -> Optional[List[dict]]:
+        entry = self._entries.get(key)
+        if entry:
+            if entry[0] > time.time():
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return entry[1]
+            del self._entries[key]
+        
+        try:
+            doc = await self.collection.find_one(
+                {"key": key, "expires_at": {"$gt": datetime.now(timezone.utc)}},
+                {"_id": 0, "results": 1, "expires_at": 1}
+            )
+        except Exception as e:
+            logging.warning("YouTube cache read failed: %s", e)
+            doc = None
+        
+        if doc:
+            expires_at = doc["expires_at"].replace(tzinfo=timezone.utc)
+            self._remember(key, doc["results"], expires_at.timestamp())
+            self.db_hits += 1
+            return doc["results"]
+        
+        self.misses += 1
         return None
     
-    query = f"{title} {artist} karaoke".strip()
+    def peek(self, key: str) -> Optional[List[dict]]:
+        """Memory-only lookup: no Mongo round trip and no effect on the stats"""
+        entry = self._entries.get(key)
+        if entry and entry[0] > time.time():
+            return entry[1]
+        return None
     
-    try:
-        async with httpx.AsyncClient() as http:
-            response = await http.get(
-                "https://www.googleapis.com/youtube/v3/search",
-                params={
-                    "part": "snippet",
-                    "q": query,
-                    "type": "video",
-                    "maxResults": 1,
-                    "key": YOUTUBE_API_KEY
-                },
-                timeout=10.0
+    async def put(self, key: str, query: str, results: List[dict]):
+        now = datetime.now(timezone.utc)
+        ttl = self.ttl_seconds if results else self.negative_ttl_seconds
+        if ttl <= 0:
+            return
+        expires_at = now + timedelta(seconds=ttl)
+        self._remember(key, results, expires_at.timestamp())
+        try:
+            await self.collection.update_one(
+                {"key": key},
+                {"$set": {"key": key, "query": query, "results": results, "cached_at": now, "expires_at": expires_at}},
+                upsert=True
             )
-            
-            if response.status_code == 200:
-                data = response.json()
-                items = data.get("items", [])
-                if items:
-                    video_id = items[0]["id"]["videoId"]
-                    return f"https://www.youtube.com/watch?v={video_id}"
-    except Exception as e:
-        logging.error(f"Auto YouTube search failed: {e}")
+        except Exception as e:
+            logging.warning("YouTube cache write failed: %s", e)
+    
+    def stats(self) -> dict:
+        hits = self.memory_hits + self.db_hits
+        lookups = hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "db_hits": self.db_hits,
+            "misses": self.misses,
+            "hit_ratio": round(hits / lookups, 3) if lookups else 0.0,
+            "quota_units_saved": hits * YOUTUBE_SEARCH_QUOTA_COST,
+            "memory_entries": len(self._entries)
+        }
+
+youtube_cache = YouTubeSearchCache(db.youtube_cache, YOUTUBE_CACHE_MEMORY_SIZE, YOUTUBE_CACHE_TTL_HOURS * 3600,
+                                   YOUTUBE_CACHE_NEGATIVE_TTL_MINUTES * 60)
+
+async def search_karaoke_videos(title: str, artist: str = "") -> List[dict]:
+    """Karaoke search for a song, served from cache when the same title/artist was already looked up"""
+    key = youtube_cache_key(title, artist)
+    cached = await youtube_cache.get(key)
+    if cached is not None:
+        return cached
+    
+    async def lookup():
+        query = f"{title} {artist} karaoke".strip()
+        results = await youtube_search(query, max_results=5)
+        # Empty results too (shorter TTL): every search costs the same 100 quota units
+        await youtube_cache.put(key, query, results)
+        return results
+    
+    return await youtube_singleflight.do(key, lookup)
+
+# ============== YOUTUBE VIDEO DETAILS ==============
+
+YOUTUBE_VIDEO_ID_RE = re.compile(r"(?:v=|youtu\.be/|embed/|shorts/)([A-Za-z0-9_-]{11})")
+ISO_DURATION_RE = re.compile(r"P(?:(\d+)D)?T?(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?")
+
+def youtube_video_id(url: Optional[str]) -> Optional[str]:
+    match = YOUTUBE_VIDEO_ID_RE.search(url or "")
+    return match.group(1) if match else None
+
+def parse_iso_duration(value: str) -> int:
+    """'PT4M13S' -> 253"""
+    match = ISO_DURATION_RE.fullmatch(value or "")
+    if not match:
+        return 0
+    days, hours, minutes, seconds = (int(g) if g else 0 for g in match.groups())
+    return ((days * 24 + hours) * 60 + minutes) * 60 + seconds
+
+# Video metadata hardly ever changes: keep it for the life of the process
+youtube_video_meta: "OrderedDict[str, dict]" = OrderedDict()
+
+async def youtube_video_details(video_ids: List[str]) -> Dict[str, dict]:
+    """Duration and embeddability of videos (1 quota unit per call, 50 ids max)"""
+    missing = [v for v in dict.fromkeys(video_ids) if v not in youtube_video_meta]
+    if missing:
+        data = await youtube_api_get(
+            "/videos",
+            {"part": "contentDetails,status", "id": ",".join(missing[:50])},
+            cost=1
+        )
+        for item in data.get("items", []):
+            status = item.get("status", {})
+            youtube_video_meta[item["id"]] = {
+                "video_id": item["id"],
+                "duration_seconds": parse_iso_duration(item.get("contentDetails", {}).get("duration", "")),
+                "embeddable": status.get("embeddable", False) and status.get("privacyStatus") != "private",
+                "privacy_status": status.get("privacyStatus")
+            }
+        while len(youtube_video_meta) > YOUTUBE_CACHE_MEMORY_SIZE:
+            youtube_video_meta.popitem(last=False)
+    return {v: youtube_video_meta[v] for v in video_ids if v in youtube_video_meta}
+
+# ============== SONG CATALOG ==============
+
+class SongCatalog:
+    """In-memory song catalog with a prefix trie over the words of title and artist"""
+    
+    def __init__(self):
+        self.songs: List[dict] = []
+        self._words: List[tuple] = []
+        self._by_key: Dict[str, int] = {}
+        self._root: dict = {}
+    
+    def __len__(self):
+        return len(self.songs)
+    
+    def add(self, title: str, artist: str, youtube_url: Optional[str] = None) -> int:
+        title, artist = (title or "").strip(), (artist or "").strip()
+        key = youtube_cache_key(title, artist)
+        idx = self._by_key.get(key)
+        if idx is not None:
+            if youtube_url:
+                self.songs[idx]["youtube_url"] = youtube_url
+            return idx
+        
+        idx = len(self.songs)
+        words = tuple(dict.fromkeys(normalize_text(f"{title} {artist}").split()))
+        self.songs.append({"title": title, "artist": artist, "youtube_url": youtube_url})
+        self._words.append(words)
+        self._by_key[key] = idx
+        for word in words:
+            node = self._root
+            for ch in word:
+                # "" holds every song id reachable through this prefix
+                node = node.setdefault(ch, {"": []})
+                node[""].append(idx)
+        return idx
+    
+    def get(self, title: str, artist: str = "") -> Optional[dict]:
+        idx = self._by_key.get(youtube_cache_key(title, artist))
+        return self.songs[idx] if idx is not None else None
+    
+    def _prefix_ids(self, prefix: str) -> List[int]:
+        node = self._root
+        for ch in prefix:
+            node = node.get(ch)
+            if node is None:
+                return []
+        return node[""]
+    
+    def search(self, query: str, limit: int = 8) -> List[dict]:
+        terms = normalize_text(query).split()
+        if not terms:
+            return []
+        # Walk the shortest posting list, check the other terms against each candidate;
+        # only the results are capped, so every matching song can be reached
+        postings = [(self._prefix_ids(t), t) for t in dict.fromkeys(terms)]
+        candidates, first = min(postings, key=lambda p: len(p[0]))
+        others = [t for _, t in postings if t != first]
+        results = []
+        for idx in candidates:
+            words = self._words[idx]
+            if all(any(w.startswith(t) for w in words) for t in others):
+                song = self.songs[idx]
+                youtube_url = song["youtube_url"]
+                if not youtube_url:
+                    cached = youtube_cache.peek(youtube_cache_key(song["title"], song["artist"]))
+                    youtube_url = cached[0]["url"] if cached else None
+                results.append({"title": song["title"], "artist": song["artist"], "youtube_url": youtube_url})
+                if len(results) >= limit:
+                    break
+        return results
+    
+    def load_exportify_csv(self, csv_path: Path) -> int:
+        added = 0
+        with open(csv_path, 'r', encoding='utf-8-sig') as f:
+            for row in csv.DictReader(f):
+                title = row.get('Track Name', '')
+                artist = row.get('Artist Name(s)', '').split(';')[0]
+                if title:
+                    before = len(self.songs)
+                    self.add(title, artist)
+                    added += len(self.songs) - before
+        return added
+
+song_catalog = SongCatalog()
+
+async def load_song_catalog():
+    """Fill the catalog from the Exportify CSVs and the songs already requested in the past"""
+    if SONG_CATALOG_DIR.is_dir():
+        for csv_path in sorted(SONG_CATALOG_DIR.glob('*.csv')):
+            try:
+                added = await asyncio.to_thread(song_catalog.load_exportify_csv, csv_path)
+                logging.info("Song catalog: %s songs from %s", added, csv_path.name)
+            except Exception as e:
+                logging.warning("Song catalog: cannot read %s: %s", csv_path, e)
+    
+    past_requests = await db.song_requests.find(
+        {},
+        {"_id": 0, "title": 1, "artist": 1, "youtube_url": 1, "youtube_status": 1}
+    ).sort("created_at", -1).to_list(20000)
+    # Oldest first so the most recent URL wins. Only URLs we resolved (or an admin
+    # picked) are trusted: a link typed on a phone is never shared with other pubs
+    for request in reversed(past_requests):
+        trusted = request.get("youtube_status") == "resolved"
+        song_catalog.add(request.get("title"), request.get("artist"), request.get("youtube_url") if trusted else None)
+
+class SongQueueIndex:
+    """Pending/queued requests of each pub by track key, kept in memory for request_song"""
     
-    return None
+    def __init__(self):
+        self.pubs: Dict[str, dict] = {}
+    
+    async def get(self, pub_id: str) -> dict:
+        queue = self.pubs.get(pub_id)
+        if queue is not None:
+            return queue
+        # First request for this pub since startup: one read, then memory only
+        requests = await db.song_requests.find(
+            {"pub_id": pub_id, "status": {"$in": ["pending", "queued"]}},
+            {"_id": 0, "id": 1, "title": 1, "artist": 1}
+        ).sort("position", 1).to_list(None)
+        queue = self.pubs.get(pub_id)
+        if queue is not None:
+            return queue
+        queue = self.pubs[pub_id] = {"by_key": {}, "requests": {}}
+        for request in requests:
+            self._add(queue, request)
+        return queue
+    
+    @staticmethod
+    def _add(queue: dict, request: dict):
+        key = youtube_cache_key(request.get("title"), request.get("artist"))
+        queue["requests"][request["id"]] = key
+        queue["by_key"].setdefault(key, request["id"])
+    
+    def add(self, pub_id: str, request: dict):
+        queue = self.pubs.get(pub_id)
+        if queue is not None:
+            self._add(queue, request)
+    
+    def discard(self, pub_id: str, request_id: str):
+        """The request left the queue (rejected or on stage)"""
+        queue = self.pubs.get(pub_id)
+        if queue is None:
+            return
+        key = queue["requests"].pop(request_id, None)
+        if key and queue["by_key"].get(key) == request_id:
+            del queue["by_key"][key]
+            # Rare: another request of the same song takes over
+            twin = next((rid for rid, k in queue["requests"].items() if k == key), None)
+            if twin:
+                queue["by_key"][key] = twin
+
+song_queue_index = SongQueueIndex()
+
+# ============== BACKGROUND YOUTUBE RESOLVER ==============
+
+class YouTubeResolver:
+    """Fills youtube_url of song requests in the background so request_song never waits on Google"""
+    
+    def __init__(self, workers: int = 2, max_attempts: int = 3, base_delay: float = 2.0):
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+    
+    def start(self):
+        if self._tasks:
+            return
+        self.queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+    
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+    
+    def submit(self, request_doc: dict):
+        self.start()
+        self.queue.put_nowait({
+            "id": request_doc["id"],
+            "pub_id": request_doc["pub_id"],
+            "title": request_doc["title"],
+            "artist": request_doc["artist"]
+        })
+    
+    async def _worker(self):
+        while True:
+            job = await self.queue.get()
+            try:
+                await self._resolve(job)
+            except Exception as e:
+                logging.error("YouTube resolver crashed on request %s: %s", job['id'], e)
+            finally:
+                self.queue.task_done()
+    
+    @staticmethod
+    def _is_retryable(error: Exception) -> bool:
+        if isinstance(error, YouTubeAPIError):
+            return error.status_code == 429 or error.status_code >= 500
+        return isinstance(error, httpx.RequestError)
+    
+    async def _resolve(self, job: dict):
+        youtube_url = None
+        youtube_status = "failed"
+        for attempt in range(self.max_attempts):
+            try:
+                results = await search_karaoke_videos(job["title"], job["artist"])
+                youtube_url = results[0]["url"] if results else None
+                youtube_status = "resolved" if youtube_url else "not_found"
+                break
+            except Exception as e:
+                if attempt + 1 >= self.max_attempts or not self._is_retryable(e):
+                    logging.error("YouTube resolve failed for '%s': %s", job['title'], e)
+                    break
+                await asyncio.sleep(self.base_delay * 2 ** attempt)
+        
+        # Only fill requests that still have no URL
+        result = await db.song_requests.update_one(
+            {"id": job["id"], "youtube_url": None},
+            {"$set": {"youtube_url": youtube_url, "youtube_status": youtube_status}}
+        )
+        if result.modified_count == 0:
+            return
+        if youtube_url:
+            song_catalog.add(job["title"], job["artist"], youtube_url)
+        
+        await manager.broadcast(job["pub_id"], {
+            "type": "request_updated",
+            "data": {"id": job["id"], "youtube_url": youtube_url, "youtube_status": youtube_status}
+        })
+
+youtube_resolver = YouTubeResolver()
+
+# ============== QUEUE PREFETCH ==============
+
+class QueuePrefetcher:
+    """Resolves and validates the karaoke video of the next queued songs before they are called"""
+    
+    def __init__(self, lookahead: int, debounce: float = 0.5):
+        self.lookahead = lookahead
+        self.debounce = debounce
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._dirty: set = set()
+    
+    def schedule(self, pub_id: str):
+        """Called whenever a pub's queue changes; bursts of changes collapse into one pass"""
+        if not YOUTUBE_API_KEY or self.lookahead <= 0:
+            return
+        task = self._tasks.get(pub_id)
+        if task and not task.done():
+            self._dirty.add(pub_id)
+            return
+        self._tasks[pub_id] = asyncio.create_task(self._run(pub_id))
+    
+    async def stop(self):
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
+    
+    async def _run(self, pub_id: str):
+        try:
+            while True:
+                self._dirty.discard(pub_id)
+                await asyncio.sleep(self.debounce)
+                songs = await db.song_requests.find(
+                    {"pub_id": pub_id, "status": "queued"},
+                    {"_id": 0, "id": 1, "title": 1, "artist": 1, "youtube_url": 1, "youtube_meta": 1, "youtube_status": 1}
+                ).sort("position", 1).to_list(self.lookahead)
+                for song in songs:
+                    if song.get("youtube_meta") and song.get("youtube_url"):
+                        continue
+                    if song.get("youtube_status") == "not_found" and not song.get("youtube_url"):
+                        continue  # already searched in vain: only the admin can pick a video now
+                    try:
+                        await self._prepare(pub_id, song)
+                    except Exception as e:
+                        logging.warning("Prefetch failed for '%s': %s", song['title'], e)
+                if pub_id not in self._dirty:
+                    break
+        finally:
+            self._tasks.pop(pub_id, None)
+    
+    async def _prepare(self, pub_id: str, song: dict):
+        candidates = []
+        if song.get("youtube_url"):
+            candidates.append(song["youtube_url"])
+        # Searching spends quota: only when the pub opted in, otherwise just validate the given URL
+        if AUTO_YOUTUBE_SEARCH and not youtube_video_id(song.get("youtube_url")):
+            candidates += [r["url"] for r in await search_karaoke_videos(song["title"], song["artist"])]
+        
+        video_ids = [v for v in (youtube_video_id(url) for url in candidates) if v]
+        if not video_ids:
+            return
+        details = await youtube_video_details(video_ids)
+        chosen = next((details[v] for v in video_ids if v in details and details[v]["embeddable"]), None)
+        if not chosen:
+            # Keep what the user gave us: the admin can still search manually
+            return
+        
+        youtube_url = f"https://www.youtube.com/watch?v={chosen['video_id']}"
+        # Only if nobody (admin, resolver) changed the video while we were looking
+        result = await db.song_requests.update_one(
+            {"id": song["id"], "youtube_url": song.get("youtube_url"), "youtube_status": song.get("youtube_status")},
+            {"$set": {"youtube_url": youtube_url, "youtube_meta": chosen, "youtube_status": "resolved"}}
+        )
+        if result.modified_count == 0:
+            return
+        song_catalog.add(song["title"], song["artist"], youtube_url)
+        await manager.broadcast(pub_id, {
+            "type": "request_updated",
+            "data": {"id": song["id"], "youtube_url": youtube_url, "youtube_status": "resolved", "youtube_meta": chosen}
+        })
+
+queue_prefetcher = QueuePrefetcher(YOUTUBE_PREFETCH_LOOKAHEAD)
 
 # ============== AUTH HELPERS ==============
 
@@ -284,6 +1105,7 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     payload = decode_token(credentials.credentials)
     if not payload:
         raise HTTPException(status_code=401, detail="Invalid token")
+    note_pub(payload.get("pub_id"))
     return payload
 
 async def get_admin_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
@@ -292,12 +1114,20 @@ async def get_admin_user(credentials: HTTPAuthorizationCredentials = Depends(sec
         raise HTTPException(status_code=403, detail="Admin access required")
     return user
 
+async def require_operator(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    """Whoever runs the server, not a pub admin"""
+    if not OPERATOR_TOKEN:
+        raise HTTPException(status_code=403, detail="Operator endpoints are disabled (set OPERATOR_TOKEN)")
+    if not credentials or not hmac.compare_digest(credentials.credentials, OPERATOR_TOKEN):
+        raise HTTPException(status_code=403, detail="Operator access required")
+
 # ============== PUB ENDPOINTS ==============
 
 @api_router.post("/pub/create", response_model=PubResponse)
 async def create_pub(pub_data: PubCreate):
     pub_code = str(uuid.uuid4())[:8].upper()
-    hashed_password = bcrypt.hashpw(pub_data.admin_password.encode(), bcrypt.gensalt()).decode()
+    # bcrypt is slow on purpose: off the event loop so every socket keeps flowing
+    hashed_password = (await asyncio.to_thread(bcrypt.hashpw, pub_data.admin_password.encode(), bcrypt.gensalt())).decode()
     
     pub_doc = {
         "id": str(uuid.uuid4()),
@@ -343,6 +1173,7 @@ async def join_pub(data: UserJoin):
     }
     
     await db.users.insert_one(user_doc)
+    display_snapshots.invalidate(pub["id"])
     
     # Create index to ensure score field exists
     await db.users.create_index("pub_id")
@@ -368,7 +1199,7 @@ async def admin_login(data: AdminLogin):
     if not pub:
         raise HTTPException(status_code=404, detail="Pub not found")
     
-    if not bcrypt.checkpw(data.password.encode(), pub["admin_password"].encode()):
+    if not await asyncio.to_thread(bcrypt.checkpw, data.password.encode(), pub["admin_password"].encode()):
         raise HTTPException(status_code=401, detail="Invalid password")
     
     token = create_token({
@@ -394,19 +1225,22 @@ async def get_me(user: dict = Depends(get_current_user)):
 
 @api_router.post("/songs/request", response_model=SongRequestResponse)
 async def request_song(song_data: SongRequestCreate, user: dict = Depends(get_current_user)):
-    queue_count = await db.song_requests.count_documents({
-        "pub_id": user["pub_id"],
-        "status": {"$in": ["pending", "queued"]}
-    })
+    queue = await song_queue_index.get(user["pub_id"])
+    key = youtube_cache_key(song_data.title, song_data.artist)
     
-    # AUTO-SEARCH: Se abilitato e non c'è già un URL, cerca automaticamente
+    # AUTO-SEARCH: Se abilitato e non c'è già un URL, il resolver lo cerca in background
     youtube_url = song_data.youtube_url
-    auto_searched = False
-    
-    if AUTO_YOUTUBE_SEARCH and not youtube_url:
-        youtube_url = await auto_search_youtube_karaoke(song_data.title, song_data.artist)
-        auto_searched = True
-        logging.info(f"Auto-searched YouTube for '{song_data.title}' by '{song_data.artist}': {youtube_url}")
+    youtube_status = None
+    if not youtube_url:
+        # Same song (any spelling/release) already resolved: reuse its video, no search
+        known = song_catalog.get(song_data.title, song_data.artist)
+        cached = youtube_cache.peek(key)
+        youtube_url = (known or {}).get("youtube_url") or (cached[0]["url"] if cached else None)
+        if youtube_url:
+            youtube_status = "resolved"
+    auto_searched = bool(AUTO_YOUTUBE_SEARCH and YOUTUBE_API_KEY and not youtube_url)
+    if auto_searched:
+        youtube_status = "resolving"
     
     request_doc = {
         "id": str(uuid.uuid4()),
@@ -416,13 +1250,18 @@ async def request_song(song_data: SongRequestCreate, user: dict = Depends(get_cu
         "title": song_data.title,
         "artist": song_data.artist,
         "youtube_url": youtube_url,
-        "auto_searched": auto_searched,  # Flag per sapere se è stato trovato automaticamente
+        "auto_searched": auto_searched or youtube_status == "resolved",  # Flag per sapere se è stato trovato automaticamente
+        "youtube_status": youtube_status,
+        "duplicate_of": queue["by_key"].get(key),  # Stessa canzone già in coda
         "status": "pending",
-        "position": queue_count + 1,
+        "position": len(queue["requests"]) + 1,
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     
     await db.song_requests.insert_one(request_doc)
+    song_queue_index.add(user["pub_id"], request_doc)
+    # Searchable from now on, but a URL typed by the singer is never recorded
+    song_catalog.add(song_data.title, song_data.artist)
     
     # Broadcast new request to admin
     await manager.broadcast(user["pub_id"], {
@@ -430,8 +1269,16 @@ async def request_song(song_data: SongRequestCreate, user: dict = Depends(get_cu
         "data": {k: v for k, v in request_doc.items() if k != "_id"}
     })
     
+    if auto_searched:
+        youtube_resolver.submit(request_doc)
+    
     return SongRequestResponse(**request_doc)
 
+@api_router.get("/songs/autocomplete")
+async def autocomplete_songs(q: str = Query(..., min_length=1), limit: int = Query(8, ge=1, le=25), user: dict = Depends(get_current_user)):
+    """Prefix suggestions from the local song catalog, with the karaoke URL when already known"""
+    return song_catalog.search(q, limit)
+
 @api_router.get("/songs/queue", response_model=List[SongRequestResponse])
 async def get_song_queue(user: dict = Depends(get_current_user)):
     requests = await db.song_requests.find(
@@ -460,40 +1307,25 @@ async def search_youtube_karaoke(title: str, artist: str = "", admin: dict = Dep
     query = f"{title} {artist} karaoke".strip()
     
     try:
-        async with httpx.AsyncClient() as http:
-            response = await http.get(
-                "https://www.googleapis.com/youtube/v3/search",
-                params={
-                    "part": "snippet",
-                    "q": query,
-                    "type": "video",
-                    "maxResults": 5,
-                    "key": YOUTUBE_API_KEY
-                },
-                timeout=10.0
-            )
-            
-            if response.status_code != 200:
-                raise HTTPException(status_code=500, detail=f"YouTube API error: {response.text}")
-            
-            data = response.json()
-            results = []
-            
-            for item in data.get("items", []):
-                video_id = item["id"]["videoId"]
-                snippet = item["snippet"]
-                results.append({
-                    "video_id": video_id,
-                    "title": snippet["title"],
-                    "thumbnail": snippet["thumbnails"]["medium"]["url"],
-                    "channel": snippet["channelTitle"],
-                    "url": f"https://www.youtube.com/watch?v={video_id}"
-                })
-            
-            return {"results": results, "query": query}
-            
+        results = await search_karaoke_videos(title, artist)
+    except YouTubeUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except YouTubeAPIError as e:
+        raise HTTPException(status_code=500, detail=f"YouTube API error: {e.text}")
     except httpx.RequestError as e:
         raise HTTPException(status_code=500, detail=f"Network error: {str(e)}")
+    
+    return {"results": results, "query": query}
+
+@api_router.get("/admin/youtube/cache-stats")
+async def get_youtube_cache_stats(admin: dict = Depends(get_admin_user)):
+    """Hit/miss counters of the YouTube search cache and the quota they saved"""
+    return youtube_cache.stats()
+
+@api_router.get("/admin/youtube/quota")
+async def get_youtube_quota(admin: dict = Depends(get_admin_user)):
+    """Quota spent today, circuit breaker state and lookups merged by single-flight"""
+    return {**youtube_breaker.stats(), "merged_lookups": youtube_singleflight.merged}
 
 # ============== ADMIN QUEUE MANAGEMENT ==============
 
@@ -507,6 +1339,7 @@ async def approve_request(request_id: str, admin: dict = Depends(get_admin_user)
         raise HTTPException(status_code=404, detail="Request not found")
     
     await manager.broadcast(admin["pub_id"], {"type": "queue_updated"})
+    queue_prefetcher.schedule(admin["pub_id"])
     return {"status": "approved"}
 
 @api_router.post("/admin/queue/reject/{request_id}")
@@ -517,6 +1350,7 @@ async def reject_request(request_id: str, admin: dict = Depends(get_admin_user))
     )
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Request not found")
+    song_queue_index.discard(admin["pub_id"], request_id)
     
     await manager.broadcast(admin["pub_id"], {"type": "queue_updated"})
     return {"status": "rejected"}
@@ -530,6 +1364,7 @@ async def reorder_queue(order: List[str], admin: dict = Depends(get_admin_user))
         )
     
     await manager.broadcast(admin["pub_id"], {"type": "queue_updated"})
+    queue_prefetcher.schedule(admin["pub_id"])
     return {"status": "reordered"}
 
 # ============== PERFORMANCE ENDPOINTS ==============
@@ -552,6 +1387,7 @@ async def start_performance(request_id: str, youtube_url: str = Query(None), adm
         "song_title": request["title"],
         "song_artist": request["artist"],
         "youtube_url": final_youtube_url,
+        "youtube_meta": request.get("youtube_meta") if final_youtube_url == request.get("youtube_url") else None,
         "status": "live",
         "average_score": 0,
         "vote_count": 0,
@@ -561,13 +1397,21 @@ async def start_performance(request_id: str, youtube_url: str = Query(None), adm
     }
     
     await db.performances.insert_one(performance_doc)
-    await db.song_requests.update_one({"id": request_id}, {"$set": {"status": "performing"}})
+    request_update = {"status": "performing"}
+    if youtube_url and youtube_url != request.get("youtube_url"):
+        # The admin picked this video: other singers of the same song get it too
+        request_update.update({"youtube_url": youtube_url, "youtube_status": "resolved"})
+        song_catalog.add(request["title"], request["artist"], youtube_url)
+    await db.song_requests.update_one({"id": request_id}, {"$set": request_update})
+    song_queue_index.discard(admin["pub_id"], request_id)
     await db.pubs.update_one({"id": admin["pub_id"]}, {"$set": {"current_performance_id": performance_doc["id"]}})
     
     await manager.broadcast(admin["pub_id"], {
         "type": "performance_started",
         "data": {k: v for k, v in performance_doc.items() if k != "_id"}
     })
+    # The queue moved up by one: get the next singers ready
+    queue_prefetcher.schedule(admin["pub_id"])
     
     return {k: v for k, v in performance_doc.items() if k != "_id"}
 
@@ -848,7 +1692,9 @@ async def get_remaining_reactions(user: dict = Depends(get_current_user)):
     """Get how many reactions the user can still send for current performance"""
     pub = await db.pubs.find_one({"id": user["pub_id"]}, {"_id": 0})
     perf_id = pub.get("current_performance_id") if pub else None
-    
+    return await remaining_reactions(user, perf_id)
+
+async def remaining_reactions(user: dict, perf_id: Optional[str]) -> dict:
     if not perf_id:
         return {"remaining": REACTION_LIMIT_PER_USER, "limit": REACTION_LIMIT_PER_USER}
     
@@ -920,147 +1766,747 @@ async def reject_message(message_id: str, admin: dict = Depends(get_admin_user))
     )
     return {"status": "rejected"}
 
-# ============== QUIZ ENDPOINTS ==============
+# ============== QUIZ LIBRARY ==============
+
+def slugify(text: str) -> str:
+    return re.sub(r"[^a-z0-9]+", "_", normalize_text(text)).strip("_") or "quiz"
+
+def quiz_question_id(question: dict) -> str:
+    """Stable id of a question, whatever order it was imported in"""
+    raw = json.dumps([question["question"], question["options"], question.get("media_url")], ensure_ascii=False)
+    return hashlib.sha1(raw.encode()).hexdigest()[:12]
+
+def build_library_doc(entry: QuizLibraryEntry) -> dict:
+    if not entry.questions:
+        raise HTTPException(status_code=400, detail=f"Quiz '{entry.name}' has no questions")
+    questions = []
+    for q in entry.questions:
+        if len(q.options) < 2 or not 0 <= q.correct_index < len(q.options):
+            raise HTTPException(status_code=400, detail=f"Invalid question in '{entry.name}': {q.question}")
+        question = q.model_dump()
+        question["id"] = quiz_question_id(question)
+        questions.append(question)
+    return {
+        "id": slugify(f"{entry.category} {entry.name}"),
+        "name": entry.name,
+        "category": entry.category,
+        "genre": entry.genre,
+        "media_type": entry.media_type,
+        "description": entry.description,
+        "icon": entry.icon,
+        "questions": questions,
+        "imported_at": datetime.now(timezone.utc).isoformat()
+    }
 
-@api_router.get("/quiz/categories")
-async def get_quiz_categories():
-    """Get available preset quiz categories"""
-    categories = []
+SQL_STRING_RE = re.compile(r"'((?:[^']|'')*)'")
+
+def parse_quiz_library_sql(sql: str) -> List[QuizLibraryEntry]:
+    """Read the INSERT INTO quiz_library statements written by the Smart Quiz Generator"""
+    entries = []
+    for statement in re.split(r"INSERT INTO quiz_library", sql)[1:]:
+        values = statement.split("VALUES", 1)[-1].split(";\n", 1)[0]
+        literals = [v.replace("''", "'") for v in SQL_STRING_RE.findall(values)]
+        if len(literals) < 6:
+            continue
+        name, category, genre, media_type, description, questions = literals[:6]
+        entries.append(QuizLibraryEntry(
+            name=name, category=category, genre=genre, media_type=media_type,
+            description=description, questions=json.loads(questions)
+        ))
+    return entries
+
+def parse_quiz_library_jsonl(text: str) -> List[QuizLibraryEntry]:
+    """Read the JSON lines written by the Smart Quiz Generator batch mode"""
+    return [QuizLibraryEntry(**json.loads(line)) for line in text.splitlines() if line.strip()]
+
+class QuizLibraryIndex:
+    """Quiz categories compiled in memory, with lookups by genre, media type and category"""
+    
+    def __init__(self):
+        self.categories: Dict[str, dict] = {}
+        self.by_genre: Dict[str, List[str]] = {}
+        self.by_media_type: Dict[str, List[str]] = {}
+        self.by_category: Dict[str, List[str]] = {}
+        self._listing: Dict[str, dict] = {}
+    
+    def add(self, doc: dict):
+        cat_id = doc["id"]
+        if cat_id in self.categories:
+            self.remove(cat_id)
+        self.categories[cat_id] = doc
+        self._listing[cat_id] = {
+            "id": cat_id,
+            "name": doc["name"],
+            "description": doc.get("description", ""),
+            "icon": doc.get("icon", "🎵"),
+            "questions_count": len(doc["questions"]),
+            "category": doc.get("category"),
+            "genre": doc.get("genre"),
+            "media_type": doc.get("media_type")
+        }
+        for index, value in ((self.by_genre, doc.get("genre")),
+                             (self.by_media_type, doc.get("media_type")),
+                             (self.by_category, doc.get("category"))):
+            index.setdefault(normalize_text(value or ""), []).append(cat_id)
+    
+    def remove(self, cat_id: str):
+        doc = self.categories.pop(cat_id)
+        self._listing.pop(cat_id, None)
+        for index, value in ((self.by_genre, doc.get("genre")),
+                             (self.by_media_type, doc.get("media_type")),
+                             (self.by_category, doc.get("category"))):
+            index.get(normalize_text(value or ""), []).remove(cat_id)
+    
+    def get(self, cat_id: str) -> Optional[dict]:
+        return self.categories.get(cat_id)
+    
+    def listing(self, genre: Optional[str] = None, media_type: Optional[str] = None, category: Optional[str] = None) -> List[dict]:
+        ids = None
+        for index, value in ((self.by_genre, genre), (self.by_media_type, media_type), (self.by_category, category)):
+            if value:
+                matches = index.get(normalize_text(value), [])
+                if ids is None:
+                    ids = matches
+                else:
+                    wanted = set(matches)
+                    ids = [i for i in ids if i in wanted]
+        if ids is None:
+            return list(self._listing.values())
+        return [self._listing[i] for i in ids]
+
+def preset_library_docs() -> List[dict]:
+    docs = []
     for cat_id, cat_data in PRESET_QUIZZES.items():
-        categories.append({
+        questions = [{**q, "points": 10} for q in cat_data["questions"]]
+        for q in questions:
+            q["id"] = quiz_question_id(q)
+        docs.append({
             "id": cat_id,
             "name": cat_data["name"],
+            "category": "preset",
+            "genre": cat_data["name"],
+            "media_type": "text",
             "description": cat_data["description"],
             "icon": cat_data["icon"],
-            "questions_count": len(cat_data["questions"])
+            "questions": questions
         })
-    return categories
-
-@api_router.post("/admin/quiz/start-session/{category_id}")
-async def start_quiz_session(category_id: str, num_questions: int = 5, admin: dict = Depends(get_admin_user)):
-    """Start a multi-question quiz session from a category"""
-    if category_id not in PRESET_QUIZZES:
-        raise HTTPException(status_code=404, detail="Category not found")
-    
-    category = PRESET_QUIZZES[category_id]
-    import random
-    
-    # Get random questions (up to available)
-    available_questions = category["questions"]
-    num_q = min(num_questions, len(available_questions))
-    selected_questions = random.sample(available_questions, num_q)
-    
-    session_doc = {
-        "id": str(uuid.uuid4()),
-        "pub_id": admin["pub_id"],
-        "category": category_id,
-        "category_name": category["name"],
-        "questions": selected_questions,
-        "current_question_index": 0,
-        "total_questions": num_q,
-        "status": "active",
-        "started_at": datetime.now(timezone.utc).isoformat(),
-        "ended_at": None
-    }
-    
-    await db.quiz_sessions.insert_one(session_doc)
-    
-    # Start first question
-    first_q = selected_questions[0]
-    quiz_doc = {
-        "id": str(uuid.uuid4()),
-        "session_id": session_doc["id"],
-        "pub_id": admin["pub_id"],
-        "category": category_id,
-        "category_name": category["name"],
-        "question_number": 1,
-        "total_questions": num_q,
-        "question": first_q["question"],
-        "options": first_q["options"],
-        "correct_index": first_q["correct_index"],
-        "points": 10,
-        "status": "active",
-        "started_at": datetime.now(timezone.utc).isoformat()
-    }
-    
-    await db.quizzes.insert_one(quiz_doc)
+    return docs
+
+quiz_library = QuizLibraryIndex()
+for _doc in preset_library_docs():
+    quiz_library.add(_doc)
+
+async def load_quiz_library():
+    async for doc in db.quiz_library.find({}, {"_id": 0}):
+        quiz_library.add(doc)
+
+async def import_quiz_library(entries: List[QuizLibraryEntry]) -> dict:
+    docs = [build_library_doc(entry) for entry in entries]
+    if not docs:
+        raise HTTPException(status_code=400, detail="No quizzes to import")
+    await db.quiz_library.bulk_write(
+        [UpdateOne({"id": doc["id"]}, {"$set": doc}, upsert=True) for doc in docs],
+        ordered=False
+    )
+    for doc in docs:
+        quiz_library.add(doc)
+    return {"imported": len(docs), "questions": sum(len(doc["questions"]) for doc in docs)}
+
+# ============== QUIZ QUESTION SAMPLER ==============
+
+# Relative weight of a question by distance from the requested difficulty
+DIFFICULTY_WEIGHTS = {0: 1.0, 1: 0.35, 2: 0.1}
+UNRATED_DIFFICULTY_WEIGHT = 0.5
+
+class QuestionPool:
+    """Questions of a category not yet asked tonight, bucketed by (difficulty, asked recently)"""
+    
+    def __init__(self, questions: List[dict], exclude: set, recent: set):
+        self.source = questions
+        self.buckets: Dict[tuple, List[dict]] = {}
+        for q in questions:
+            if q["id"] not in exclude:
+                self.buckets.setdefault((q.get("difficulty"), q["id"] in recent), []).append(q)
+    
+    def __len__(self) -> int:
+        return sum(len(b) for b in self.buckets.values())
+    
+    def draw(self, weight) -> dict:
+        """Weighted pick of a bucket (a handful at most), then an O(1) swap-remove inside it"""
+        buckets = [(key, b) for key, b in self.buckets.items() if b]
+        key, bucket = random.choices(buckets, [weight(key) * len(b) for key, b in buckets])[0]
+        i = random.randrange(len(bucket))
+        bucket[i], bucket[-1] = bucket[-1], bucket[i]
+        return bucket.pop()
+
+class NightlyQuestionSampler:
+    """Draws quiz questions for a pub without repeats across the sessions of the same night"""
+    
+    def __init__(self, timezone_name: str, cutoff_hour: int, recent_nights: int, recent_weight: float):
+        self.tz = ZoneInfo(timezone_name)
+        self.cutoff = timedelta(hours=cutoff_hour)
+        self.recent_nights = recent_nights
+        self.recent_weight = recent_weight
+        self.pubs: Dict[str, dict] = {}
+    
+    def night_start(self, now: Optional[datetime] = None) -> datetime:
+        local = (now or datetime.now(timezone.utc)).astimezone(self.tz)
+        night = (local - self.cutoff).date()
+        return datetime.combine(night, datetime.min.time(), tzinfo=self.tz) + self.cutoff
+    
+    async def _state(self, pub_id: str) -> dict:
+        night = self.night_start()
+        state = self.pubs.get(pub_id)
+        if state and state["night"] == night:
+            return state
+        # First draw of the night (or after a restart): one read of the questions asked lately
+        since = night - timedelta(days=self.recent_nights)
+        asked = await db.quizzes.find(
+            {"pub_id": pub_id, "started_at": {"$gte": since.astimezone(timezone.utc).isoformat()}},
+            {"_id": 0, "question_id": 1, "started_at": 1}
+        ).to_list(None)
+        tonight = night.astimezone(timezone.utc).isoformat()
+        state = self.pubs.get(pub_id)
+        if state and state["night"] == night:
+            return state
+        state = self.pubs[pub_id] = {
+            "night": night,
+            "asked": {q["question_id"] for q in asked if q.get("question_id") and q["started_at"] >= tonight},
+            "recent": {q["question_id"] for q in asked if q.get("question_id") and q["started_at"] < tonight},
+            "pools": {}
+        }
+        return state
+    
+    def _weight(self, difficulty: Optional[int]):
+        def weight(key: tuple) -> float:
+            level, recent = key
+            w = self.recent_weight if recent else 1.0
+            if difficulty:
+                w *= DIFFICULTY_WEIGHTS.get(abs(level - difficulty), 0.05) if level else UNRATED_DIFFICULTY_WEIGHT
+            return w
+        return weight
+    
+    async def draw(self, pub_id: str, category: dict, k: int, difficulty: Optional[int] = None) -> List[dict]:
+        """Up to k distinct questions; O(k) once the category pool exists"""
+        state = await self._state(pub_id)
+        questions = category["questions"]
+        pool = state["pools"].get(category["id"])
+        if pool is None or pool.source is not questions:
+            # Built once per pub, category and night (or library re-import)
+            pool = state["pools"][category["id"]] = QuestionPool(questions, state["asked"], state["recent"])
+        
+        weight = self._weight(difficulty)
+        picked: List[dict] = []
+        while len(picked) < k:
+            if not pool:
+                # The whole category was asked tonight: start over, still no repeats within this draw
+                pool = state["pools"][category["id"]] = QuestionPool(questions, {q["id"] for q in picked}, state["asked"])
+                if not pool:
+                    break
+            picked.append(pool.draw(weight))
+        state["asked"].update(q["id"] for q in picked)
+        return picked
+
+question_sampler = NightlyQuestionSampler(QUIZ_NIGHT_TIMEZONE, QUIZ_NIGHT_CUTOFF_HOUR, QUIZ_RECENT_NIGHTS, QUIZ_RECENT_WEIGHT)
+
+# ============== QUIZ ANSWER PIPELINE ==============
+
+class ActiveQuiz:
+    """In-memory copy of the question phones are answering"""
+    __slots__ = ("id", "pub_id", "session_id", "question_number", "correct_index", "points", "options",
+                 "time_limit", "auto_advance", "started", "answered", "option_counts", "progress_task",
+                 "correct_count", "winners", "complete")
+    
+    def __init__(self, quiz_doc: dict, started: Optional[float] = None):
+        self.id = quiz_doc["id"]
+        self.pub_id = quiz_doc["pub_id"]
+        self.session_id = quiz_doc.get("session_id")
+        self.question_number = quiz_doc.get("question_number", 1)
+        self.correct_index = quiz_doc["correct_index"]
+        self.points = quiz_doc["points"]
+        self.options = quiz_doc["options"]
+        self.time_limit = quiz_doc.get("time_limit") or 0
+        self.auto_advance = quiz_doc.get("auto_advance", False)
+        # Monotonic clock: response times do not jump with NTP or DST
+        self.started = time.monotonic() if started is None else started
+        self.answered: set = set()
+        self.option_counts = [0] * len(self.options)
+        self.progress_task: Optional[asyncio.Task] = None
+        self.correct_count = 0
+        self.winners: List[str] = []  # the first QUIZ_WINNERS_LIMIT correct answers
+        # False when rebuilt from Mongo mid-question: the counters miss the winners' order
+        self.complete = started is None
+    
+    def results(self) -> dict:
+        return {
+            "total_answers": len(self.answered),
+            "correct_count": self.correct_count,
+            "winners": list(self.winners),
+            "counts": list(self.option_counts)
+        }
     
-    await manager.broadcast(admin["pub_id"], {
-        "type": "quiz_started",
-        "data": {
-            "id": quiz_doc["id"],
-            "session_id": session_doc["id"],
-            "category": category_id,
-            "category_name": category["name"],
-            "question": quiz_doc["question"],
-            "options": quiz_doc["options"],
-            "points": quiz_doc["points"],
-            "question_number": 1,
-            "total_questions": num_q
+    @property
+    def deadline(self) -> Optional[float]:
+        return self.started + self.time_limit if self.time_limit else None
+    
+    def progress(self) -> dict:
+        return {"quiz_id": self.id, "counts": list(self.option_counts), "answered": len(self.answered)}
+
+class SessionLeaderboard:
+    """Running standings of one quiz session, kept ordered as answers are scored"""
+    
+    def __init__(self, session_id: str, pub_id: str):
+        self.session_id = session_id
+        self.pub_id = pub_id
+        # (-score, seq, user_id): on equal scores whoever got there first ranks higher
+        self.ranking = SortedList()
+        self.entries: Dict[str, tuple] = {}
+        self.nicknames: Dict[str, str] = {}
+        self._seq = 0
+    
+    def __len__(self) -> int:
+        return len(self.entries)
+    
+    def record(self, user_id: str, nickname: str, points: int):
+        """O(log n): move the player to their new place"""
+        old = self.entries.get(user_id)
+        if old and not points:
+            return
+        score = points
+        if old:
+            self.ranking.remove(old)
+            score -= old[0]
+        self._seq += 1
+        entry = (-score, self._seq, user_id)
+        self.ranking.add(entry)
+        self.entries[user_id] = entry
+        self.nicknames[user_id] = nickname
+    
+    def rank(self, user_id: str) -> dict:
+        entry = self.entries.get(user_id)
+        if not entry:
+            return {"session_id": self.session_id, "rank": None, "score": 0, "players": len(self)}
+        return {
+            "session_id": self.session_id,
+            "rank": self.ranking.index(entry) + 1,
+            "score": -entry[0],
+            "players": len(self)
         }
-    })
     
-    return {
-        "session_id": session_doc["id"],
-        "quiz_id": quiz_doc["id"],
-        "question_number": 1,
-        "total_questions": num_q,
-        "question": quiz_doc["question"],
-        "options": quiz_doc["options"]
-    }
+    def top(self, limit: int = 10) -> List[dict]:
+        return [
+            {"rank": i + 1, "user_id": user_id, "nickname": self.nicknames[user_id], "score": -neg_score}
+            for i, (neg_score, _, user_id) in enumerate(self.ranking.islice(0, limit))
+        ]
 
-@api_router.post("/admin/quiz/start-preset/{category_id}")
-async def start_preset_quiz(category_id: str, admin: dict = Depends(get_admin_user)):
-    """Start a single preset quiz question from a category (backward compatible)"""
-    if category_id not in PRESET_QUIZZES:
-        raise HTTPException(status_code=404, detail="Category not found")
-    
-    category = PRESET_QUIZZES[category_id]
-    import random
-    question = random.choice(category["questions"])
+class QuizAnswerPipeline:
+    """Validates and deduplicates quiz answers in memory, then persists them in micro-batches"""
+    
+    def __init__(self, flush_interval: float, batch_size: int, progress_interval: float):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.progress_interval = progress_interval
+        self.active: Dict[str, ActiveQuiz] = {}
+        # Recently closed questions: the cold path must not reopen them while their "ended" write is in flight
+        self.closed: "OrderedDict[str, None]" = OrderedDict()
+        self.leaderboards: Dict[str, SessionLeaderboard] = {}
+        # Sessions whose board is being rebuilt: answers scored meanwhile, applied once it is ready
+        self._rebuilding: Dict[str, List[tuple]] = {}
+        self._rebuilds = SingleFlight()
+        self._loads = SingleFlight()
+        self._answers: List[dict] = []
+        self._scores: Dict[str, dict] = {}
+        self._pending: Optional[asyncio.Event] = None
+        self._full: Optional[asyncio.Event] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+    
+    def start(self):
+        if self._task:
+            return
+        self._pending = asyncio.Event()
+        self._full = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+            await self.flush()
+    
+    def activate(self, quiz_doc: dict, started: Optional[float] = None) -> ActiveQuiz:
+        quiz = ActiveQuiz(quiz_doc, started)
+        self.active[quiz.id] = quiz
+        return quiz
+    
+    def deactivate(self, quiz_id: str) -> Optional[ActiveQuiz]:
+        self.closed[quiz_id] = None
+        while len(self.closed) > QUIZ_CLOSED_MEMORY:
+            self.closed.popitem(last=False)
+        quiz = self.active.pop(quiz_id, None)
+        if quiz and quiz.progress_task:
+            quiz.progress_task.cancel()
+        return quiz
+    
+    def deactivate_session(self, session_id: str):
+        for quiz_id in [q.id for q in self.active.values() if q.session_id == session_id]:
+            self.deactivate(quiz_id)
+    
+    def open_leaderboard(self, session_id: str, pub_id: str) -> SessionLeaderboard:
+        """A new session replaces the standings of the pub's previous ones"""
+        for old_id in [b.session_id for b in self.leaderboards.values() if b.pub_id == pub_id]:
+            del self.leaderboards[old_id]
+        board = self.leaderboards[session_id] = SessionLeaderboard(session_id, pub_id)
+        return board
+    
+    async def get_leaderboard(self, session_id: str, pub_id: str) -> Optional[SessionLeaderboard]:
+        board = self.leaderboards.get(session_id)
+        if board is not None:
+            return board if board.pub_id == pub_id else None
+        # Cold path (e.g. after a restart, or an old session): rebuild the standings from the stored answers
+        session = await db.quiz_sessions.find_one({"id": session_id, "pub_id": pub_id}, {"_id": 0, "id": 1})
+        if not session:
+            return None
+        board = await self._rebuilds.do(session_id, lambda: self._rebuild_leaderboard(session_id, pub_id))
+        return board if board.pub_id == pub_id else None
+    
+    async def _rebuild_leaderboard(self, session_id: str, pub_id: str) -> SessionLeaderboard:
+        """Added next to the live boards, never replacing them (only a new session does)"""
+        scored_meanwhile = self._rebuilding[session_id] = []
+        try:
+            await self.flush()
+            totals = await db.quiz_answers.aggregate([
+                {"$match": {"session_id": session_id}},
+                {"$group": {
+                    "_id": "$user_id",
+                    "nickname": {"$first": "$user_nickname"},
+                    "score": {"$sum": "$points_earned"},
+                    "quizzes": {"$addToSet": "$quiz_id"},
+                    "last": {"$max": "$answered_at"}
+                }},
+                {"$sort": {"last": 1}}
+            ]).to_list(None)
+        finally:
+            del self._rebuilding[session_id]
+        board = self.leaderboards.get(session_id)
+        if board is not None:
+            return board
+        board = self.leaderboards[session_id] = SessionLeaderboard(session_id, pub_id)
+        counted = {}
+        for total in totals:
+            board.record(total["_id"], total["nickname"], total["score"])
+            counted[total["_id"]] = set(total["quizzes"])
+        # Answers scored during the rebuild that the aggregate did not see yet
+        for user_id, nickname, points, quiz_id in scored_meanwhile:
+            if quiz_id not in counted.get(user_id, ()):
+                board.record(user_id, nickname, points)
+        return board
+    
+    async def get_active(self, quiz_id: str, pub_id: str) -> Optional[ActiveQuiz]:
+        quiz = self.active.get(quiz_id)
+        if quiz:
+            return quiz if quiz.pub_id == pub_id else None
+        if quiz_id in self.closed:
+            return None
+        # Cold path (e.g. after a restart): one load per question, however many phones answer at once
+        quiz = await self._loads.do(quiz_id, lambda: self._load(quiz_id))
+        if not quiz or quiz.pub_id != pub_id:
+            return None
+        if quiz.session_id:
+            await self.get_leaderboard(quiz.session_id, pub_id)
+        return quiz
+    
+    async def _load(self, quiz_id: str) -> Optional[ActiveQuiz]:
+        quiz_doc = await db.quizzes.find_one({"id": quiz_id, "status": "active"}, {"_id": 0})
+        if not quiz_doc:
+            return None
+        counts = await db.quiz_answers.aggregate([
+            {"$match": {"quiz_id": quiz_id}},
+            {"$group": {"_id": "$answer_index", "users": {"$push": "$user_id"}}}
+        ]).to_list(None)
+        # The monotonic start is lost: rebuild it from the stored wall-clock start
+        elapsed = (datetime.now(timezone.utc) - datetime.fromisoformat(quiz_doc["started_at"])).total_seconds()
+        if quiz_id in self.closed:
+            return None  # closed while the answers were being read
+        if quiz_id in self.active:
+            return self.active[quiz_id]  # live counts already moved on: the aggregate is stale
+        quiz = self.activate(quiz_doc, time.monotonic() - max(0.0, elapsed))
+        # No timer survived the restart: a timed question must still close on its own (at once if overdue)
+        schedule_quiz_close(quiz)
+        for bucket in counts:
+            quiz.answered.update(bucket["users"])
+            if 0 <= bucket["_id"] < len(quiz.option_counts):
+                quiz.option_counts[bucket["_id"]] = len(bucket["users"])
+        return quiz
+    
+    def submit(self, quiz: ActiveQuiz, user: dict, answer_index: int) -> dict:
+        if user["user_id"] in quiz.answered:
+            raise HTTPException(status_code=400, detail="Already answered")
+        response_time = max(0.0, time.monotonic() - quiz.started - QUIZ_LATENCY_GRACE)
+        if quiz.time_limit and response_time > quiz.time_limit:
+            raise HTTPException(status_code=400, detail="Tempo scaduto")
+        quiz.answered.add(user["user_id"])
+        
+        is_correct = answer_index == quiz.correct_index
+        points_earned = 0
+        if is_correct:
+            quiz.correct_count += 1
+            if len(quiz.winners) < QUIZ_WINNERS_LIMIT:
+                quiz.winners.append(user["nickname"])
+            points_earned = quiz.points
+            if quiz.time_limit:
+                # Speed bonus: full points when instant, half points at the buzzer
+                points_earned = round(quiz.points * (1 - 0.5 * response_time / quiz.time_limit))
+        if 0 <= answer_index < len(quiz.option_counts):
+            quiz.option_counts[answer_index] += 1
+        self._schedule_progress(quiz)
+        board = self.leaderboards.get(quiz.session_id) if quiz.session_id else None
+        if board is not None:
+            board.record(user["user_id"], user["nickname"], points_earned)
+        elif quiz.session_id in self._rebuilding:
+            self._rebuilding[quiz.session_id].append((user["user_id"], user["nickname"], points_earned, quiz.id))
+        
+        self._answers.append({
+            "id": str(uuid.uuid4()),
+            "quiz_id": quiz.id,
+            "session_id": quiz.session_id,
+            "pub_id": user["pub_id"],
+            "user_id": user["user_id"],
+            "user_nickname": user["nickname"],
+            "answer_index": answer_index,
+            "is_correct": is_correct,
+            "points_earned": points_earned,
+            "response_ms": int(response_time * 1000),
+            "answered_at": datetime.now(timezone.utc).isoformat()
+        })
+        if is_correct:
+            score = self._scores.setdefault(user["user_id"], {"points": 0, "pub_id": user["pub_id"], "nickname": user["nickname"]})
+            score["points"] += points_earned
+        
+        self.start()
+        self._pending.set()
+        if len(self._answers) >= self.batch_size:
+            self._full.set()
+        return {"is_correct": is_correct, "points_earned": points_earned, "response_ms": int(response_time * 1000)}
+    
+    def _schedule_progress(self, quiz: ActiveQuiz):
+        """At most one quiz_progress broadcast per interval, however many answers arrive"""
+        if quiz.progress_task is None or quiz.progress_task.done():
+            quiz.progress_task = asyncio.create_task(self._send_progress(quiz))
+    
+    async def _send_progress(self, quiz: ActiveQuiz):
+        await asyncio.sleep(self.progress_interval)
+        # Live answer counts would tip off the players still thinking: displays and admins only
+        await manager.broadcast(quiz.pub_id, {"type": "quiz_progress", "data": quiz.progress()}, screens_only=True)
+    
+    async def _run(self):
+        while True:
+            await self._pending.wait()
+            # Let the burst accumulate unless the batch is already full
+            try:
+                await asyncio.wait_for(self._full.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._pending.clear()
+            self._full.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.error("Quiz answer flush failed, will retry: %s", e)
+                await asyncio.sleep(1.0)
+                self._pending.set()
+    
+    async def flush(self):
+        """Write buffered answers with one insert_many and score increments with one bulk_write"""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            answers, self._answers = self._answers, []
+            scores, self._scores = self._scores, {}
+            try:
+                if answers:
+                    try:
+                        await db.quiz_answers.insert_many(answers, ordered=False)
+                    except BulkWriteError as e:
+                        # Duplicates already stored (unique quiz_id/user_id) are fine
+                        if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+                            raise
+                    answers = []
+                if scores:
+                    now = datetime.now(timezone.utc).isoformat()
+                    await db.users.bulk_write([
+                        UpdateOne(
+                            {"id": user_id},
+                            {
+                                "$inc": {"score": score["points"]},
+                                "$setOnInsert": {
+                                    "pub_id": score["pub_id"],
+                                    "nickname": score["nickname"],
+                                    "is_admin": False,
+                                    "joined_at": now
+                                }
+                            },
+                            upsert=True
+                        )
+                        for user_id, score in scores.items()
+                    ], ordered=False)
+                    # New scores: the display leaderboard changed
+                    for pub_id in {score["pub_id"] for score in scores.values()}:
+                        display_snapshots.invalidate(pub_id)
+            except Exception:
+                # Put back what was not written, ahead of newer answers
+                self._answers[:0] = [{k: v for k, v in a.items() if k != "_id"} for a in answers]
+                for user_id, score in scores.items():
+                    merged = self._scores.setdefault(user_id, {**score, "points": 0})
+                    merged["points"] += score["points"]
+                raise
+
+quiz_answer_pipeline = QuizAnswerPipeline(QUIZ_ANSWER_FLUSH_INTERVAL, QUIZ_ANSWER_BATCH_SIZE, QUIZ_PROGRESS_INTERVAL)
+
+# ============== QUIZ TIMERS ==============
+
+# Admin clicks and timers touching the same pub's quiz are serialized
+quiz_locks: Dict[str, asyncio.Lock] = {}
+
+def quiz_lock(pub_id: str) -> asyncio.Lock:
+    if pub_id not in quiz_locks:
+        quiz_locks[pub_id] = asyncio.Lock()
+    return quiz_locks[pub_id]
+
+class QuizTimers:
+    """Absolute monotonic deadlines on the event loop: no drift from chained sleeps"""
     
-    quiz_doc = {
-        "id": str(uuid.uuid4()),
-        "pub_id": admin["pub_id"],
-        "category": category_id,
-        "category_name": category["name"],
-        "question": question["question"],
-        "options": question["options"],
-        "correct_index": question["correct_index"],
-        "points": 10,
-        "status": "active",
-        "question_number": 1,
-        "total_questions": 1,
-        "started_at": datetime.now(timezone.utc).isoformat(),
-        "answers": []
+    def __init__(self):
+        self._handles: Dict[str, asyncio.TimerHandle] = {}
+        self._tasks: set = set()
+    
+    def schedule_at(self, key: str, deadline: float, fn, *args):
+        """Run fn(*args) at deadline (time.monotonic() scale), replacing any timer with the same key"""
+        self.cancel(key)
+        loop = asyncio.get_running_loop()
+        delay = max(0.0, deadline - time.monotonic())
+        self._handles[key] = loop.call_at(loop.time() + delay, self._fire, key, fn, args)
+    
+    def _fire(self, key: str, fn, args):
+        self._handles.pop(key, None)
+        task = asyncio.create_task(fn(*args))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+    
+    def cancel(self, key: str):
+        handle = self._handles.pop(key, None)
+        if handle:
+            handle.cancel()
+    
+    async def stop(self):
+        for handle in self._handles.values():
+            handle.cancel()
+        self._handles.clear()
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+quiz_timers = QuizTimers()
+
+def arm_quiz(quiz_doc: dict) -> ActiveQuiz:
+    """Open the question for answers and start its countdown; call right before broadcasting quiz_started"""
+    quiz = quiz_answer_pipeline.activate(quiz_doc)
+    schedule_quiz_close(quiz)
+    return quiz
+
+def schedule_quiz_close(quiz: ActiveQuiz):
+    if quiz.deadline:
+        quiz_timers.schedule_at(f"close:{quiz.id}", quiz.deadline + QUIZ_LATENCY_GRACE, on_quiz_deadline, quiz.pub_id, quiz.id)
+
+async def on_quiz_deadline(pub_id: str, quiz_id: str):
+    async with quiz_lock(pub_id):
+        quiz = quiz_answer_pipeline.active.get(quiz_id)
+        if not quiz:
+            return  # the admin got there first
+        quiz_doc = await db.quizzes.find_one({"id": quiz_id}, {"_id": 0})
+        if not quiz_doc:
+            return
+        await close_quiz(pub_id, quiz_doc)
+        if quiz.session_id and quiz.auto_advance:
+            quiz_timers.schedule_at(
+                f"advance:{quiz.session_id}", time.monotonic() + QUIZ_REVEAL_SECONDS,
+                on_session_advance, pub_id, quiz.session_id, quiz.question_number
+            )
+
+async def on_session_advance(pub_id: str, session_id: str, question_number: int):
+    async with quiz_lock(pub_id):
+        session = await db.quiz_sessions.find_one({"id": session_id, "pub_id": pub_id}, {"_id": 0})
+        # Skip if the admin already moved on (or ended the session) during the reveal
+        if not session or session["status"] != "active" or session["current_question_index"] + 1 != question_number:
+            return
+        await advance_quiz_session(pub_id, session)
+
+async def aggregate_quiz_results(quiz_id: str, num_options: int) -> dict:
+    """Quiz results computed inside Mongo: flat memory whatever the room size"""
+    facets = await db.quiz_answers.aggregate([
+        {"$match": {"quiz_id": quiz_id}},
+        {"$facet": {
+            "by_option": [{"$group": {"_id": "$answer_index", "count": {"$sum": 1}}}],
+            "correct": [{"$match": {"is_correct": True}}, {"$count": "n"}],
+            "winners": [
+                {"$match": {"is_correct": True}},
+                {"$sort": {"answered_at": 1}},
+                {"$limit": QUIZ_WINNERS_LIMIT},
+                {"$project": {"_id": 0, "user_nickname": 1}}
+            ]
+        }}
+    ]).to_list(1)
+    facet = facets[0] if facets else {"by_option": [], "correct": [], "winners": []}
+    counts = [0] * num_options
+    total = 0
+    for bucket in facet["by_option"]:
+        total += bucket["count"]
+        if isinstance(bucket["_id"], int) and 0 <= bucket["_id"] < num_options:
+            counts[bucket["_id"]] = bucket["count"]
+    return {
+        "total_answers": total,
+        "correct_count": facet["correct"][0]["n"] if facet["correct"] else 0,
+        "winners": [w["user_nickname"] for w in facet["winners"]],
+        "counts": counts
     }
+
+async def close_quiz(pub_id: str, quiz: dict) -> dict:
+    """End a question, store its last answers and broadcast the results (at most QUIZ_WINNERS_LIMIT winners)"""
+    quiz_id = quiz["id"]
+    quiz_timers.cancel(f"close:{quiz_id}")
+    active = quiz_answer_pipeline.deactivate(quiz_id)
+    await db.quizzes.update_one({"id": quiz_id}, {"$set": {"status": "ended"}})
+    # Make sure the last micro-batch is stored with the quiz
+    await quiz_answer_pipeline.flush()
     
-    await db.quizzes.insert_one(quiz_doc)
+    if active and active.complete:
+        results = active.results()
+    else:
+        results = await aggregate_quiz_results(quiz_id, len(quiz["options"]))
     
-    await manager.broadcast(admin["pub_id"], {
-        "type": "quiz_started",
+    await manager.broadcast(pub_id, {
+        "type": "quiz_ended",
         "data": {
-            "id": quiz_doc["id"],
-            "category": category_id,
-            "category_name": category["name"],
-            "question": quiz_doc["question"],
-            "options": quiz_doc["options"],
-            "points": quiz_doc["points"],
-            "question_number": 1,
-            "total_questions": 1
+            "quiz_id": quiz_id,
+            "correct_answer": quiz["correct_index"],
+            "correct_option": quiz["options"][quiz["correct_index"]],
+            **results
         }
     })
     
-    return {k: v for k, v in quiz_doc.items() if k not in ["_id", "correct_index"]}
+    return {"status": "ended", "winners": results["correct_count"]}
 
-@api_router.post("/admin/quiz/next-question/{session_id}")
-async def next_quiz_question(session_id: str, admin: dict = Depends(get_admin_user)):
-    """Move to next question in a quiz session"""
-    session = await db.quiz_sessions.find_one({"id": session_id, "pub_id": admin["pub_id"]}, {"_id": 0})
-    if not session or session["status"] != "active":
-        raise HTTPException(status_code=404, detail="Quiz session not found or ended")
+async def advance_quiz_session(pub_id: str, session: dict) -> dict:
+    """Close the current question of a session and start the next one (or end the session)"""
+    session_id = session["id"]
+    quiz_timers.cancel(f"advance:{session_id}")
     
     # End current question
+    for quiz in [q for q in quiz_answer_pipeline.active.values() if q.session_id == session_id]:
+        quiz_timers.cancel(f"close:{quiz.id}")
+    quiz_answer_pipeline.deactivate_session(session_id)
     await db.quizzes.update_many(
         {"session_id": session_id, "status": "active"},
         {"$set": {"status": "ended"}}
@@ -1075,13 +2521,12 @@ async def next_quiz_question(session_id: str, admin: dict = Depends(get_admin_us
             {"$set": {"status": "ended", "ended_at": datetime.now(timezone.utc).isoformat()}}
         )
         
-        # Get final leaderboard for this session
-        leaderboard = await db.users.find(
-            {"pub_id": admin["pub_id"]},
-            {"_id": 0, "nickname": 1, "score": 1}
-        ).sort("score", -1).to_list(10)
+        # Final standings of this session, already in order
+        board = await quiz_answer_pipeline.get_leaderboard(session_id, pub_id)
+        leaderboard = board.top(10) if board is not None else []
+        await db.quiz_sessions.update_one({"id": session_id}, {"$set": {"leaderboard": leaderboard}})
         
-        await manager.broadcast(admin["pub_id"], {
+        await manager.broadcast(pub_id, {
             "type": "quiz_session_ended",
             "data": {
                 "session_id": session_id,
@@ -1103,22 +2548,28 @@ async def next_quiz_question(session_id: str, admin: dict = Depends(get_admin_us
     quiz_doc = {
         "id": str(uuid.uuid4()),
         "session_id": session_id,
-        "pub_id": admin["pub_id"],
+        "pub_id": pub_id,
         "category": session["category"],
         "category_name": session["category_name"],
         "question_number": next_index + 1,
         "total_questions": session["total_questions"],
+        "question_id": next_q.get("id"),
         "question": next_q["question"],
         "options": next_q["options"],
         "correct_index": next_q["correct_index"],
-        "points": 10,
+        "points": next_q.get("points", 10),
+        "media_type": next_q.get("media_type"),
+        "media_url": next_q.get("media_url"),
+        "time_limit": session.get("question_seconds") or None,
+        "auto_advance": session.get("auto_advance", False),
         "status": "active",
         "started_at": datetime.now(timezone.utc).isoformat()
     }
     
     await db.quizzes.insert_one(quiz_doc)
+    arm_quiz(quiz_doc)
     
-    await manager.broadcast(admin["pub_id"], {
+    await manager.broadcast(pub_id, {
         "type": "quiz_started",
         "data": {
             "id": quiz_doc["id"],
@@ -1128,6 +2579,9 @@ async def next_quiz_question(session_id: str, admin: dict = Depends(get_admin_us
             "question": quiz_doc["question"],
             "options": quiz_doc["options"],
             "points": quiz_doc["points"],
+            "media_type": quiz_doc.get("media_type"),
+            "media_url": quiz_doc.get("media_url"),
+            "time_limit": quiz_doc["time_limit"],
             "question_number": next_index + 1,
             "total_questions": session["total_questions"]
         }
@@ -1138,117 +2592,258 @@ async def next_quiz_question(session_id: str, admin: dict = Depends(get_admin_us
         "question_number": next_index + 1,
         "total_questions": session["total_questions"],
         "question": quiz_doc["question"],
-        "options": quiz_doc["options"]
+        "options": quiz_doc["options"],
+        "time_limit": quiz_doc["time_limit"]
     }
 
-@api_router.post("/admin/quiz/start")
-async def start_quiz(quiz_data: QuizQuestionCreate, admin: dict = Depends(get_admin_user)):
-    quiz_doc = {
-        "id": str(uuid.uuid4()),
-        "pub_id": admin["pub_id"],
-        "category": quiz_data.category or "custom",
-        "question": quiz_data.question,
-        "options": quiz_data.options,
-        "correct_index": quiz_data.correct_index,
-        "points": quiz_data.points,
-        "status": "active",
-        "question_number": 1,
-        "total_questions": 1,
-        "started_at": datetime.now(timezone.utc).isoformat(),
-        "answers": []
-    }
-    
-    await db.quizzes.insert_one(quiz_doc)
+# ============== QUIZ ENDPOINTS ==============
+
+@api_router.get("/quiz/categories")
+async def get_quiz_categories(genre: Optional[str] = None, media_type: Optional[str] = None, category: Optional[str] = None):
+    """Get available quiz categories (presets and imported library)"""
+    return quiz_library.listing(genre, media_type, category)
+
+@api_router.post("/admin/quiz/library/import")
+async def import_quiz_library_json(entries: List[QuizLibraryEntry], admin: dict = Depends(get_admin_user)):
+    """Bulk import quizzes (same fields as the generator's quiz_library rows); re-importing a quiz replaces it"""
+    return await import_quiz_library(entries)
+
+@api_router.post("/admin/quiz/library/import-sql")
+async def import_quiz_library_sql(request: Request, admin: dict = Depends(get_admin_user)):
+    """Bulk import the .sql file written by the Smart Quiz Generator"""
+    sql = (await request.body()).decode("utf-8")
+    try:
+        entries = parse_quiz_library_sql(sql)
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid quiz SQL: {e}")
+    return await import_quiz_library(entries)
+
+@api_router.post("/admin/quiz/library/import-jsonl")
+async def import_quiz_library_jsonl(request: Request, admin: dict = Depends(get_admin_user)):
+    """Bulk import the .jsonl file written by the Smart Quiz Generator batch mode (one quiz per line)"""
+    body = (await request.body()).decode("utf-8")
+    try:
+        entries = parse_quiz_library_jsonl(body)
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid quiz JSONL: {e}")
+    return await import_quiz_library(entries)
+
+@api_router.post("/admin/quiz/start-session/{category_id}")
+async def start_quiz_session(category_id: str, num_questions: int = 5, question_seconds: Optional[int] = Query(None, ge=0),
+                             auto_advance: bool = False, difficulty: Optional[int] = Query(None, ge=1, le=3),
+                             admin: dict = Depends(get_admin_user)):
+    """Start a multi-question quiz session from a category, optionally timed and self-advancing"""
+    category = quiz_library.get(category_id)
+    if not category:
+        raise HTTPException(status_code=404, detail="Category not found")
     
-    await manager.broadcast(admin["pub_id"], {
-        "type": "quiz_started",
-        "data": {
-            "id": quiz_doc["id"],
+    async with quiz_lock(admin["pub_id"]):
+        # Random questions not asked yet tonight (up to available)
+        selected_questions = await question_sampler.draw(admin["pub_id"], category, num_questions, difficulty)
+        if not selected_questions:
+            raise HTTPException(status_code=400, detail="Category has no questions")
+        num_q = len(selected_questions)
+        if question_seconds is None:
+            question_seconds = QUIZ_QUESTION_SECONDS
+        
+        session_doc = {
+            "id": str(uuid.uuid4()),
+            "pub_id": admin["pub_id"],
+            "category": category_id,
+            "category_name": category["name"],
+            "questions": selected_questions,
+            "current_question_index": 0,
+            "total_questions": num_q,
+            "question_seconds": question_seconds,
+            "auto_advance": auto_advance and question_seconds > 0,
+            "status": "active",
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "ended_at": None
+        }
+        
+        await db.quiz_sessions.insert_one(session_doc)
+        quiz_answer_pipeline.open_leaderboard(session_doc["id"], admin["pub_id"])
+        
+        # Start first question
+        first_q = selected_questions[0]
+        quiz_doc = {
+            "id": str(uuid.uuid4()),
+            "session_id": session_doc["id"],
+            "pub_id": admin["pub_id"],
+            "category": category_id,
+            "category_name": category["name"],
+            "question_number": 1,
+            "total_questions": num_q,
+            "question_id": first_q.get("id"),
+            "question": first_q["question"],
+            "options": first_q["options"],
+            "correct_index": first_q["correct_index"],
+            "points": first_q.get("points", 10),
+            "media_type": first_q.get("media_type"),
+            "media_url": first_q.get("media_url"),
+            "time_limit": question_seconds or None,
+            "auto_advance": session_doc["auto_advance"],
+            "status": "active",
+            "started_at": datetime.now(timezone.utc).isoformat()
+        }
+        
+        await db.quizzes.insert_one(quiz_doc)
+        arm_quiz(quiz_doc)
+        
+        await manager.broadcast(admin["pub_id"], {
+            "type": "quiz_started",
+            "data": {
+                "id": quiz_doc["id"],
+                "session_id": session_doc["id"],
+                "category": category_id,
+                "category_name": category["name"],
+                "question": quiz_doc["question"],
+                "options": quiz_doc["options"],
+                "points": quiz_doc["points"],
+                "media_type": quiz_doc.get("media_type"),
+                "media_url": quiz_doc.get("media_url"),
+                "time_limit": quiz_doc["time_limit"],
+                "question_number": 1,
+                "total_questions": num_q
+            }
+        })
+        
+        return {
+            "session_id": session_doc["id"],
+            "quiz_id": quiz_doc["id"],
+            "question_number": 1,
+            "total_questions": num_q,
             "question": quiz_doc["question"],
             "options": quiz_doc["options"],
-            "points": quiz_doc["points"],
-            "question_number": 1,
-            "total_questions": 1
+            "time_limit": quiz_doc["time_limit"]
         }
-    })
+
+@api_router.post("/admin/quiz/start-preset/{category_id}")
+async def start_preset_quiz(category_id: str, question_seconds: Optional[int] = Query(None, ge=0), admin: dict = Depends(get_admin_user)):
+    """Start a single preset quiz question from a category (backward compatible)"""
+    category = quiz_library.get(category_id)
+    if not category:
+        raise HTTPException(status_code=404, detail="Category not found")
     
-    return {k: v for k, v in quiz_doc.items() if k not in ["_id", "correct_index"]}
+    async with quiz_lock(admin["pub_id"]):
+        questions = await question_sampler.draw(admin["pub_id"], category, 1)
+        if not questions:
+            raise HTTPException(status_code=400, detail="Category has no questions")
+        question = questions[0]
+        
+        quiz_doc = {
+            "id": str(uuid.uuid4()),
+            "pub_id": admin["pub_id"],
+            "category": category_id,
+            "category_name": category["name"],
+            "question_id": question.get("id"),
+            "question": question["question"],
+            "options": question["options"],
+            "correct_index": question["correct_index"],
+            "points": question.get("points", 10),
+            "media_type": question.get("media_type"),
+            "media_url": question.get("media_url"),
+            "time_limit": (QUIZ_QUESTION_SECONDS if question_seconds is None else question_seconds) or None,
+            "status": "active",
+            "question_number": 1,
+            "total_questions": 1,
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "answers": []
+        }
+        
+        await db.quizzes.insert_one(quiz_doc)
+        arm_quiz(quiz_doc)
+        
+        await manager.broadcast(admin["pub_id"], {
+            "type": "quiz_started",
+            "data": {
+                "id": quiz_doc["id"],
+                "category": category_id,
+                "category_name": category["name"],
+                "question": quiz_doc["question"],
+                "options": quiz_doc["options"],
+                "points": quiz_doc["points"],
+                "media_type": quiz_doc.get("media_type"),
+                "media_url": quiz_doc.get("media_url"),
+                "time_limit": quiz_doc["time_limit"],
+                "question_number": 1,
+                "total_questions": 1
+            }
+        })
+        
+        return {k: v for k, v in quiz_doc.items() if k not in ["_id", "correct_index"]}
+
+@api_router.post("/admin/quiz/next-question/{session_id}")
+async def next_quiz_question(session_id: str, admin: dict = Depends(get_admin_user)):
+    """Move to next question in a quiz session"""
+    async with quiz_lock(admin["pub_id"]):
+        session = await db.quiz_sessions.find_one({"id": session_id, "pub_id": admin["pub_id"]}, {"_id": 0})
+        if not session or session["status"] != "active":
+            raise HTTPException(status_code=404, detail="Quiz session not found or ended")
+        return await advance_quiz_session(admin["pub_id"], session)
+
+@api_router.post("/admin/quiz/start")
+async def start_quiz(quiz_data: QuizQuestionCreate, admin: dict = Depends(get_admin_user)):
+    async with quiz_lock(admin["pub_id"]):
+        quiz_doc = {
+            "id": str(uuid.uuid4()),
+            "pub_id": admin["pub_id"],
+            "category": quiz_data.category or "custom",
+            "question": quiz_data.question,
+            "options": quiz_data.options,
+            "correct_index": quiz_data.correct_index,
+            "points": quiz_data.points,
+            "time_limit": quiz_data.time_limit or None,
+            "status": "active",
+            "question_number": 1,
+            "total_questions": 1,
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "answers": []
+        }
+        
+        await db.quizzes.insert_one(quiz_doc)
+        arm_quiz(quiz_doc)
+        
+        await manager.broadcast(admin["pub_id"], {
+            "type": "quiz_started",
+            "data": {
+                "id": quiz_doc["id"],
+                "question": quiz_doc["question"],
+                "options": quiz_doc["options"],
+                "points": quiz_doc["points"],
+                "media_type": quiz_doc.get("media_type"),
+                "media_url": quiz_doc.get("media_url"),
+                "time_limit": quiz_doc["time_limit"],
+                "question_number": 1,
+                "total_questions": 1
+            }
+        })
+        
+        return {k: v for k, v in quiz_doc.items() if k not in ["_id", "correct_index"]}
 
 @api_router.post("/quiz/answer")
 async def answer_quiz(answer_data: QuizAnswerSubmit, user: dict = Depends(get_current_user)):
-    quiz = await db.quizzes.find_one(
-        {"id": answer_data.quiz_id, "pub_id": user["pub_id"], "status": "active"},
-        {"_id": 0}
-    )
+    quiz = await quiz_answer_pipeline.get_active(answer_data.quiz_id, user["pub_id"])
     if not quiz:
         raise HTTPException(status_code=404, detail="Quiz not found or closed")
     
-    # Check if already answered
-    existing = await db.quiz_answers.find_one({
-        "quiz_id": answer_data.quiz_id,
-        "user_id": user["user_id"]
-    })
-    if existing:
-        raise HTTPException(status_code=400, detail="Already answered")
-    
-    is_correct = answer_data.answer_index == quiz["correct_index"]
-    points_earned = quiz["points"] if is_correct else 0
-    
-    answer_doc = {
-        "id": str(uuid.uuid4()),
-        "quiz_id": answer_data.quiz_id,
-        "pub_id": user["pub_id"],
-        "user_id": user["user_id"],
-        "user_nickname": user["nickname"],
-        "answer_index": answer_data.answer_index,
-        "is_correct": is_correct,
-        "points_earned": points_earned,
-        "answered_at": datetime.now(timezone.utc).isoformat()
-    }
-    
-    await db.quiz_answers.insert_one(answer_doc)
-    
-    if is_correct:
-        # Use upsert to create user if not exists, and increment score
-        await db.users.update_one(
-            {"id": user["user_id"]},
-            {
-                "$inc": {"score": points_earned},
-                "$setOnInsert": {
-                    "pub_id": user["pub_id"],
-                    "nickname": user["nickname"],
-                    "is_admin": False,
-                    "joined_at": datetime.now(timezone.utc).isoformat()
-                }
-            },
-            upsert=True
-        )
-    
-    return {"is_correct": is_correct, "points_earned": points_earned}
+    return quiz_answer_pipeline.submit(quiz, user, answer_data.answer_index)
+
+@api_router.get("/quiz/session/{session_id}/my-rank")
+async def get_my_session_rank(session_id: str, user: dict = Depends(get_current_user)):
+    """Where the player stands in this quiz session"""
+    board = await quiz_answer_pipeline.get_leaderboard(session_id, user["pub_id"])
+    if board is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return board.rank(user["user_id"])
 
 @api_router.post("/admin/quiz/end/{quiz_id}")
 async def end_quiz(quiz_id: str, admin: dict = Depends(get_admin_user)):
-    quiz = await db.quizzes.find_one({"id": quiz_id, "pub_id": admin["pub_id"]}, {"_id": 0})
-    if not quiz:
-        raise HTTPException(status_code=404, detail="Quiz not found")
-    
-    await db.quizzes.update_one({"id": quiz_id}, {"$set": {"status": "ended"}})
-    
-    answers = await db.quiz_answers.find({"quiz_id": quiz_id}, {"_id": 0}).to_list(1000)
-    correct_answers = [a for a in answers if a["is_correct"]]
-    
-    await manager.broadcast(admin["pub_id"], {
-        "type": "quiz_ended",
-        "data": {
-            "quiz_id": quiz_id,
-            "correct_answer": quiz["correct_index"],
-            "correct_option": quiz["options"][quiz["correct_index"]],
-            "winners": [a["user_nickname"] for a in correct_answers],
-            "total_answers": len(answers)
-        }
-    })
-    
-    return {"status": "ended", "winners": len(correct_answers)}
+    async with quiz_lock(admin["pub_id"]):
+        quiz = await db.quizzes.find_one({"id": quiz_id, "pub_id": admin["pub_id"]}, {"_id": 0})
+        if not quiz:
+            raise HTTPException(status_code=404, detail="Quiz not found")
+        return await close_quiz(admin["pub_id"], quiz)
 
 @api_router.get("/quiz/active")
 async def get_active_quiz(user: dict = Depends(get_current_user)):
@@ -1283,47 +2878,208 @@ async def get_leaderboard(user: dict = Depends(get_current_user)):
 
 # ============== DISPLAY DATA ==============
 
+# Events that never change the display snapshot (no need to rebuild it)
+DISPLAY_STATIC_EVENTS = {"reaction", "quiz_progress", "new_message", "message_approved", "effect"}
+
+class DisplaySnapshotCache:
+    """Encoded /display/data body per pub, rebuilt only after an event changed it"""
+    
+    def __init__(self):
+        # Versions restart with the process: the boot id keeps old ETags from matching
+        self.boot = uuid.uuid4().hex[:8]
+        self.versions: Dict[str, int] = {}
+        self.entries: Dict[str, dict] = {}
+        self.pubs_by_code: Dict[str, dict] = {}
+        self._builds = SingleFlight()
+        self.hits = 0
+        self.builds = 0
+    
+    def invalidate(self, pub_id: str):
+        self.versions[pub_id] = self.versions.get(pub_id, 0) + 1
+    
+    def etag(self, pub_id: str) -> str:
+        return f'W/"{self.boot}-{self.versions.get(pub_id, 0)}"'
+    
+    async def get_pub(self, pub_code: str) -> Optional[dict]:
+        code = pub_code.upper()
+        pub = self.pubs_by_code.get(code)
+        if pub is None:
+            pub = await db.pubs.find_one({"code": code}, {"_id": 0, "id": 1, "name": 1, "code": 1})
+            if pub:
+                self.pubs_by_code[code] = pub
+        if pub:
+            note_pub(pub["id"])
+        return pub
+    
+    def fresh(self, pub_id: str) -> Optional[dict]:
+        entry = self.entries.get(pub_id)
+        if entry and entry["version"] == self.versions.get(pub_id, 0):
+            return entry
+        return None
+    
+    async def get(self, pub: dict) -> dict:
+        entry = self.fresh(pub["id"])
+        if entry:
+            self.hits += 1
+            return entry
+        return await self._builds.do(pub["id"], lambda: self._build(pub))
+    
+    async def _build(self, pub: dict) -> dict:
+        # Captured before reading: an event arriving meanwhile makes this entry stale at once
+        version = self.versions.get(pub["id"], 0)
+        # The phones' queue (pending included) and active quiz ride along for the WebSocket hello
+        pub_doc, queued, requests, leaderboard, active_quiz = await asyncio.gather(
+            db.pubs.find_one({"id": pub["id"]}, {"_id": 0, "current_performance_id": 1}),
+            # Read on its own: a burst of pending requests must not push the TV queue out
+            db.song_requests.find(
+                {"pub_id": pub["id"], "status": "queued"},
+                {"_id": 0}
+            ).sort("position", 1).to_list(10),
+            db.song_requests.find(
+                {"pub_id": pub["id"], "status": {"$in": ["pending", "queued"]}},
+                {"_id": 0}
+            ).sort("position", 1).to_list(100),
+            db.users.find(
+                {"pub_id": pub["id"]},
+                {"_id": 0, "nickname": 1, "score": 1}
+            ).sort("score", -1).to_list(5),
+            db.quizzes.find_one(
+                {"pub_id": pub["id"], "status": "active"},
+                {"_id": 0, "correct_index": 0}
+            )
+        )
+        
+        current_performance = None
+        if pub_doc and pub_doc.get("current_performance_id"):
+            current_performance = await db.performances.find_one(
+                {"id": pub_doc["current_performance_id"]},
+                {"_id": 0}
+            )
+        
+        data = {
+            "pub": {"name": pub["name"], "code": pub["code"]},
+            "current_performance": current_performance,
+            "queue": queued,
+            "leaderboard": leaderboard
+        }
+        entry = {
+            "version": version,
+            "etag": f'W/"{self.boot}-{version}"',
+            "data": data,
+            "state": {
+                "current_performance": current_performance,
+                "queue": requests,
+                "active_quiz": active_quiz
+            },
+            "body": json.dumps(data, ensure_ascii=False).encode("utf-8")
+        }
+        self.builds += 1
+        if version == self.versions.get(pub["id"], 0):
+            self.entries[pub["id"]] = entry
+        return entry
+
+display_snapshots = DisplaySnapshotCache()
+
 @api_router.get("/display/data")
-async def get_display_data(pub_code: str):
-    pub = await db.pubs.find_one({"code": pub_code.upper()}, {"_id": 0})
+async def get_display_data(pub_code: str, request: Request):
+    pub = await display_snapshots.get_pub(pub_code)
     if not pub:
         raise HTTPException(status_code=404, detail="Pub not found")
     
-    current_performance = None
-    if pub.get("current_performance_id"):
-        current_performance = await db.performances.find_one(
-            {"id": pub["current_performance_id"]},
-            {"_id": 0}
-        )
+    # Screen already shows the current snapshot: no Mongo read, no encoding
+    if request.headers.get("if-none-match") == display_snapshots.etag(pub["id"]) and display_snapshots.fresh(pub["id"]):
+        display_snapshots.hits += 1
+        return Response(status_code=304, headers={"ETag": display_snapshots.etag(pub["id"])})
     
-    queue = await db.song_requests.find(
-        {"pub_id": pub["id"], "status": "queued"},
-        {"_id": 0}
-    ).sort("position", 1).to_list(10)
-    
-    leaderboard = await db.users.find(
-        {"pub_id": pub["id"]},
-        {"_id": 0, "nickname": 1, "score": 1}
-    ).sort("score", -1).to_list(5)
-    
-    return {
-        "pub": {"name": pub["name"], "code": pub["code"]},
-        "current_performance": current_performance,
-        "queue": queue,
-        "leaderboard": leaderboard
-    }
+    entry = await display_snapshots.get(pub)
+    return Response(
+        content=entry["body"],
+        media_type="application/json",
+        headers={"ETag": entry["etag"], "Cache-Control": "no-cache"}
+    )
+
+def sse_event(event_id: str, text: str) -> str:
+    return f"id: {event_id}\ndata: {text}\n\n"
+
+@api_router.get("/display/stream/{pub_code}")
+async def display_stream(pub_code: str, request: Request, last_event_id: Optional[str] = None):
+    """Server-Sent Events for display screens: a snapshot, then the same events as the WebSocket"""
+    pub = await display_snapshots.get_pub(pub_code)
+    if not pub:
+        raise HTTPException(status_code=404, detail="Pub not found")
+    pub_id = pub["id"]
+    # EventSource sends the header on reconnect; the query parameter is for the first connection
+    last_event_id = request.headers.get("last-event-id") or last_event_id
+    
+    # Subscribe first so nothing published while the snapshot is read gets lost
+    queue = manager.subscribe(pub_id)
+    
+    async def stream():
+        try:
+            missed = manager.events_since(pub_id, last_event_id)
+            if missed is None:
+                # New screen, restarted server or too far behind: start from a full snapshot
+                sent = manager.event_ids.get(pub_id, 0)
+                entry = await display_snapshots.get(pub)
+                snapshot = json.dumps({"type": "snapshot", "data": entry["data"]}, ensure_ascii=False)
+                yield "retry: 3000\n" + sse_event(manager.event_id(sent), snapshot)
+            else:
+                sent = int(last_event_id.rpartition("-")[2])
+                for seq, text in missed:
+                    yield sse_event(manager.event_id(seq), text)
+                    sent = seq
+            
+            while True:
+                try:
+                    item = await asyncio.wait_for(queue.get(), timeout=SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if item is None:
+                    return
+                seq, text = item
+                # Already sent in the replay, or part of the snapshot
+                if seq <= sent:
+                    continue
+                yield sse_event(manager.event_id(seq), text)
+                sent = seq
+        finally:
+            manager.unsubscribe(pub_id, queue)
+    
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"  # no proxy buffering (nginx)
+    })
 
 # ============== WEBSOCKET ==============
 
 @app.websocket("/api/ws/{pub_code}")
-async def websocket_endpoint(websocket: WebSocket, pub_code: str):
-    pub = await db.pubs.find_one({"code": pub_code.upper()}, {"_id": 0})
+async def websocket_endpoint(websocket: WebSocket, pub_code: str, token: Optional[str] = None):
+    pub = await display_snapshots.get_pub(pub_code)
     if not pub:
         await websocket.close(code=4004)
         return
-    
-    await manager.connect(websocket, pub["id"])
+    # Phones pass their token to get their own reaction allowance in the hello
+    user = decode_token(token) if token else None
+    if user and user.get("pub_id") != pub["id"]:
+        user = None
+    
+    await websocket.accept()
+    # First frame: what phones used to fetch with four REST calls, from the cached snapshot
+    for _ in range(3):
+        entry = await display_snapshots.get(pub)
+        perf = entry["state"]["current_performance"]
+        reactions = await remaining_reactions(user, perf["id"] if perf else None) if user else None
+        # An event arrived meanwhile: it would not reach this socket yet, so read again
+        if display_snapshots.fresh(pub["id"]) is entry:
+            break
+    manager.register(websocket, pub["id"], phone=bool(user and not user.get("is_admin")))
     try:
+        await websocket.send_json({"type": "hello", "data": {
+            "pub": entry["data"]["pub"],
+            **entry["state"],
+            "reactions": reactions
+        }})
         while True:
             data = await websocket.receive_text()
             # Handle ping/pong for connection keep-alive
@@ -1332,6 +3088,157 @@ async def websocket_endpoint(websocket: WebSocket, pub_code: str):
     except WebSocketDisconnect:
         manager.disconnect(websocket, pub["id"])
 
+# ============== METRICS ==============
+
+def websocket_counts() -> dict:
+    return {(pub_id, "ws"): len(sockets) for pub_id, sockets in manager.active_connections.items()} | \
+        {(pub_id, "sse"): len(queues) for pub_id, queues in manager.streams.items()}
+
+def youtube_cache_lookups() -> dict:
+    return {("memory_hit",): youtube_cache.memory_hits, ("db_hit",): youtube_cache.db_hits, ("miss",): youtube_cache.misses}
+
+# Read when scraped: these numbers already live in the manager and the caches
+metrics_registry.gauge("neonpub_screen_connections", "Open display/phone connections per pub",
+                       ("pub_id", "transport"), websocket_counts)
+metrics_registry.collected_counter("neonpub_youtube_cache_lookups_total", "YouTube search cache lookups",
+                                   ("result",), youtube_cache_lookups)
+metrics_registry.gauge("neonpub_youtube_cache_hit_ratio", "Share of YouTube searches answered from the cache",
+                       (), lambda: {(): youtube_cache.stats()["hit_ratio"]})
+metrics_registry.collected_counter("neonpub_display_snapshot_requests_total", "Display snapshots built vs served from memory",
+                                   ("result",), lambda: {("build",): display_snapshots.builds, ("hit",): display_snapshots.hits})
+metrics_registry.collected_counter("neonpub_log_records_dropped_total", "Log records dropped because the log queue was full",
+                                   (), lambda: {(): dropped_records()})
+
+class MetricsMiddleware:
+    """Per-route latency histogram; plain ASGI so the request path pays two clock reads and a bisect"""
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        status = [500]
+        streaming = [False]
+        
+        def observe():
+            # Route template, not the raw path: /api/display/stream/{pub_code} stays one series
+            route = scope.get("route")
+            http_latency.observe(time.perf_counter() - start, scope["method"],
+                                 route.path if route else "unmatched", str(status[0]))
+        
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                # An event stream lasts as long as the screen stays on: time it until it opens
+                if any(k == b"content-type" and v.startswith(b"text/event-stream") for k, v in message.get("headers", [])):
+                    streaming[0] = True
+                    observe()
+            await send(message)
+        
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if not streaming[0]:
+                observe()
+
+# ============== PROFILER ==============
+
+request_profiler = SamplingProfiler(PROFILE_DIR, PROFILE_INTERVAL_MS / 1000, PROFILE_MAX_FILES)
+request_profiler.configure(bool(PROFILE_SAMPLE_RATE or PROFILE_ROUTE_PATTERN), PROFILE_SAMPLE_RATE, PROFILE_ROUTE_PATTERN or None)
+
+class ProfilerMiddleware:
+    """Profiles the sampled requests; the others only pay the wants() check"""
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not request_profiler.wants(scope["path"]):
+            return await self.app(scope, receive, send)
+        task = asyncio.current_task()
+        start = time.perf_counter()
+        request_profiler.start(task)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            stacks = request_profiler.stop(task)
+            elapsed = time.perf_counter() - start
+            try:
+                await asyncio.to_thread(request_profiler.write, scope["method"], scope["path"], elapsed, stacks)
+            except OSError as e:
+                logging.warning("Profile not written: %s", e)
+
+@api_router.get("/admin/profiler", dependencies=[Depends(require_operator)])
+async def get_profiler():
+    return request_profiler.status()
+
+@api_router.post("/admin/profiler", dependencies=[Depends(require_operator)])
+async def set_profiler(settings: ProfilerSettings):
+    """Turn request profiling on/off at runtime, by sample rate and/or route pattern"""
+    try:
+        request_profiler.configure(settings.enabled, settings.sample_rate, settings.route_pattern,
+                                   settings.interval_ms / 1000)
+    except re.error as e:
+        raise HTTPException(status_code=400, detail=f"Invalid route pattern: {e}")
+    return request_profiler.status()
+
+# ============== ACCESS LOG ==============
+
+access_logger = logging.getLogger("neonpub.access")
+
+class AccessLogMiddleware:
+    """One JSON line per request with its DB and outbound HTTP time; busy routes are sampled"""
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        timings = RequestTimings()
+        token = request_timings.set(timings)
+        start = time.perf_counter()
+        status = [500]
+        
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+        
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            request_timings.reset(token)
+            elapsed = time.perf_counter() - start
+            route = scope.get("route")
+            route_path = route.path if route else "unmatched"
+            rate = ACCESS_LOG_SAMPLING.get(route_path, 1.0)
+            if rate >= 1.0 or status[0] >= 400 or elapsed * 1000 >= ACCESS_LOG_SLOW_MS or random.random() < rate:
+                access_logger.info("%s %s %s", scope["method"], route_path, status[0], extra={"fields": {
+                    "route": route_path,
+                    "method": scope["method"],
+                    "status": status[0],
+                    "pub_id": timings.pub_id,
+                    "total_ms": round(elapsed * 1000, 2),
+                    "db_ms": round(timings.db * 1000, 2),
+                    "db_ops": timings.db_ops,
+                    "http_ms": round(timings.http * 1000, 2),
+                    "http_calls": timings.http_calls,
+                    "sample_rate": rate
+                }})
+
+@api_router.get("/metrics")
+async def get_metrics(request: Request):
+    """Prometheus text exposition"""
+    if METRICS_TOKEN:
+        if not hmac.compare_digest(request.headers.get("authorization", ""), f"Bearer {METRICS_TOKEN}"):
+            raise HTTPException(status_code=401, detail="Metrics token required")
+    elif not METRICS_PUBLIC:
+        raise HTTPException(status_code=403, detail="Metrics are disabled (set METRICS_TOKEN or METRICS_PUBLIC)")
+    return Response(content=metrics_registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 # ============== ROOT ==============
 
 @api_router.get("/")
@@ -1348,14 +3255,84 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(AccessLogMiddleware)
+app.add_middleware(ProfilerMiddleware)
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Configure logging: handlers only enqueue, a background thread formats and writes
+log_listener = setup_logging(logging.INFO, json_lines=LOG_FORMAT == 'json', path=LOG_FILE or None)
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def startup_http_clients():
+    get_youtube_http()
+
+loop_lag_monitor = LoopLagMonitor(LOOP_LAG_INTERVAL_MS / 1000, LOOP_LAG_THRESHOLD_MS / 1000, loop_lag, loop_stalls, logger)
+
+@app.on_event("startup")
+async def startup_loop_lag_monitor():
+    loop_lag_monitor.start()
+
+@app.on_event("startup")
+async def startup_db_indexes():
+    try:
+        await youtube_cache.ensure_indexes()
+        await db.quiz_library.create_index("id", unique=True)
+        await db.quiz_answers.create_index([("quiz_id", 1), ("user_id", 1)], unique=True)
+        await db.quiz_answers.create_index("session_id")
+        await db.quizzes.create_index([("pub_id", 1), ("started_at", 1)])
+    except Exception as e:
+        logger.warning("Could not create indexes: %s", e)
+
+@app.on_event("startup")
+async def startup_quiz_library():
+    try:
+        await load_quiz_library()
+    except Exception as e:
+        logger.warning("Could not load quiz library: %s", e)
+    logger.info("Quiz library ready: %s categories", len(quiz_library.categories))
+
+@app.on_event("startup")
+async def startup_song_catalog():
+    try:
+        await load_song_catalog()
+    except Exception as e:
+        logger.warning("Could not load song catalog: %s", e)
+    logger.info("Song catalog ready: %s songs", len(song_catalog))
+
+@app.on_event("startup")
+async def startup_youtube_resolver():
+    youtube_resolver.start()
+    # Requeue requests left half-resolved by a restart
+    try:
+        pending = await db.song_requests.find(
+            {"youtube_status": "resolving"},
+            {"_id": 0, "id": 1, "pub_id": 1, "title": 1, "artist": 1}
+        ).to_list(500)
+    except Exception as e:
+        logger.warning("Could not requeue YouTube lookups: %s", e)
+        return
+    for request_doc in pending:
+        youtube_resolver.submit(request_doc)
+
+# Background workers stop first: they still use Mongo and the HTTP client
+@app.on_event("shutdown")
+async def shutdown_background_tasks():
+    await loop_lag_monitor.stop()
+    await quiz_timers.stop()
+    await quiz_answer_pipeline.stop()
+    await youtube_resolver.stop()
+    await queue_prefetcher.stop()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
     client.close()
+
+@app.on_event("shutdown")
+async def shutdown_http_clients():
+    await close_youtube_http()
+
+@app.on_event("shutdown")
+async def shutdown_logging():
+    # Flushes whatever is still queued
+    log_listener.stop()
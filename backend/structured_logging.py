@@ -0,0 +1,134 @@
+"""
+Non-blocking structured logging.
+
+Handlers on the event loop only put records on a bounded queue. A
+background thread formats them as JSON lines and writes them out, so a
+slow disk or terminal never stalls a request. When the queue is full,
+records are dropped and counted; the request is never made to wait.
+
+RequestTimings collects, per request, the time spent in MongoDB (from
+pymongo command monitoring) and in outbound HTTP calls. The access-log
+middleware reports it through a ContextVar. Motor runs every command in
+its executor with a copy of the caller's context, so the DB time lands on
+the right request.
+"""
+import copy
+import json
+import logging
+import queue
+import sys
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+from pymongo import monitoring
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+LOG_QUEUE_SIZE = 10000
+
+
+class RequestTimings:
+    __slots__ = ("pub_id", "db", "db_ops", "http", "http_calls")
+
+    def __init__(self):
+        self.pub_id: Optional[str] = None
+        self.db = 0.0
+        self.db_ops = 0
+        self.http = 0.0
+        self.http_calls = 0
+
+
+request_timings: ContextVar[Optional[RequestTimings]] = ContextVar("request_timings", default=None)
+
+
+def note_pub(pub_id: Optional[str]):
+    timings = request_timings.get()
+    if timings is not None and timings.pub_id is None:
+        timings.pub_id = pub_id
+
+
+def add_http_time(seconds: float):
+    timings = request_timings.get()
+    if timings is not None:
+        timings.http += seconds
+        timings.http_calls += 1
+
+
+class MongoRequestTimer(monitoring.CommandListener):
+    """Adds every Mongo command's duration to the request that issued it"""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        timings = request_timings.get()
+        if timings is not None:
+            timings.db += event.duration_micros / 1e6
+            timings.db_ops += 1
+
+    failed = succeeded
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage()
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Never blocks the caller: a full queue drops the record"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Only the message is resolved here; JSON encoding happens on the writer thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def dropped_records() -> int:
+    """Records dropped so far by the queue handlers on the root logger"""
+    return sum(h.dropped for h in logging.getLogger().handlers if isinstance(h, DroppingQueueHandler))
+
+
+def setup_logging(level: int = logging.INFO, json_lines: bool = True, path: Optional[str] = None,
+                  queue_size: int = LOG_QUEUE_SIZE) -> QueueListener:
+    """Route the root logger through a queue to a writer thread; stop() the listener to flush"""
+    handler = logging.FileHandler(path, encoding="utf-8") if path else logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JsonFormatter() if json_lines else logging.Formatter(TEXT_FORMAT))
+    log_queue = queue.Queue(maxsize=queue_size)
+    listener = QueueListener(log_queue, handler)
+
+    root = logging.getLogger()
+    for old in [h for h in root.handlers if isinstance(h, DroppingQueueHandler)]:
+        root.removeHandler(old)
+    root.addHandler(DroppingQueueHandler(log_queue))
+    root.setLevel(level)
+    listener.start()
+    return listener
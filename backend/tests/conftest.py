@@ -0,0 +1,125 @@
+"""
+Shared setup for the offline backend tests: the environment server.py reads at
+import time, in-memory stand-ins for the Mongo collections, and a recorder for
+the connection manager's broadcasts.
+"""
+import json
+import os
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'neonpub_karaoke_test')
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import server  # noqa: E402
+
+
+def matches(doc, query):
+    """Equality and $in filters, which is all the code under test sends"""
+    return all(doc.get(k) in v["$in"] if isinstance(v, dict) else doc.get(k) == v for k, v in query.items())
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, *args):
+        return self
+
+    async def to_list(self, length=None):
+        return list(self.docs)[:length]
+
+
+class FakeCollection:
+    """Keeps documents in a list, logs every read query and records every write"""
+
+    def __init__(self, docs=None, reads=None):
+        self.docs = list(docs or [])
+        self.reads = [] if reads is None else reads
+        self.calls = []
+
+    async def find_one(self, query, projection=None):
+        self.reads.append(query)
+        return next((d for d in self.docs if matches(d, query)), None)
+
+    def find(self, query, projection=None):
+        self.reads.append(query)
+        return FakeCursor([d for d in self.docs if matches(d, query)])
+
+    async def count_documents(self, query):
+        self.reads.append(query)
+        return sum(matches(d, query) for d in self.docs)
+
+    async def insert_one(self, doc):
+        self.calls.append(("insert_one", doc))
+        self.docs.append(doc)
+
+    async def insert_many(self, docs, ordered=True):
+        self.calls.append(("insert_many", list(docs)))
+
+    async def update_one(self, query, update, upsert=False):
+        self.calls.append(("update_one", query, update))
+        doc = next((d for d in self.docs if matches(d, query)), None)
+        if doc is not None:
+            doc.update(update.get("$set", {}))
+        return SimpleNamespace(modified_count=int(doc is not None))
+
+    async def bulk_write(self, requests, ordered=True):
+        self.calls.append(("bulk_write", list(requests)))
+
+
+class FakeDB:
+    """Hands out an empty FakeCollection for any name; all of them log reads to self.reads"""
+
+    def __init__(self):
+        self.reads = []
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        collection = FakeCollection(reads=self.reads)
+        setattr(self, name, collection)
+        return collection
+
+
+class FakeSocket:
+    """A WebSocket that keeps the type of every message sent, or fails like a dropped screen"""
+
+    def __init__(self, broken=False):
+        self.broken = broken
+        self.sent = []
+
+    async def send_text(self, text):
+        if self.broken:
+            raise RuntimeError("gone")
+        self.sent.append(json.loads(text)["type"])
+
+
+class Broadcasts(list):
+    """Messages broadcast during a test, in order; pubs[i] is where the i-th one went"""
+
+    def __init__(self):
+        super().__init__()
+        self.pubs = []
+
+    async def broadcast(self, pub_id, message, screens_only=False):
+        self.pubs.append(pub_id)
+        self.append(message)
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    fake = FakeDB()
+    monkeypatch.setattr(server, "db", fake)
+    return fake
+
+
+@pytest.fixture
+def broadcasts(monkeypatch):
+    sent = Broadcasts()
+    monkeypatch.setattr(server.manager, "broadcast", sent.broadcast)
+    return sent
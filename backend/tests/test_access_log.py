@@ -0,0 +1,90 @@
+"""
+Test the structured, queue-based logging:
+1. Records are written as JSON lines by the listener thread, extra fields included
+2. Each request gets one access line with its route, pub and DB time
+3. Busy routes are sampled, but errors are always logged
+4. A full queue drops records and counts them in /api/metrics
+"""
+import json
+import logging
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+import structured_logging
+
+
+@pytest.fixture
+def root_logger():
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    yield root
+    root.handlers[:] = handlers
+    root.setLevel(level)
+
+
+def test_json_lines(tmp_path, root_logger):
+    path = tmp_path / "app.log"
+    listener = structured_logging.setup_logging(logging.INFO, path=str(path))
+    logging.getLogger("neonpub.test").info("Song catalog: %s songs", 3, extra={"fields": {"pub_id": "pub1"}})
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        logging.getLogger("neonpub.test").exception("Flush failed")
+    listener.stop()
+
+    first, second = [json.loads(line) for line in path.read_text().splitlines()]
+    assert first["msg"] == "Song catalog: 3 songs" and first["pub_id"] == "pub1"
+    assert first["level"] == "INFO" and first["logger"] == "neonpub.test"
+    assert second["level"] == "ERROR" and "ValueError: boom" in second["exc"]
+
+
+def test_full_queue_drops_instead_of_blocking(root_logger):
+    before = structured_logging.dropped_records()
+    handler = structured_logging.DroppingQueueHandler(structured_logging.queue.Queue(maxsize=2))
+    root_logger.addHandler(handler)
+    logger = logging.getLogger("neonpub.flood")
+    for i in range(5):
+        logger.warning("flood %s", i)
+    assert handler.dropped == 3
+    assert structured_logging.dropped_records() == before + 3
+    assert f"neonpub_log_records_dropped_total {before + 3}" in server.metrics_registry.render().splitlines()
+
+
+def access_lines(caplog):
+    return [r.fields for r in caplog.records if r.name == "neonpub.access"]
+
+
+def test_request_line(fake_db, monkeypatch, caplog):
+    fake_db.pubs.docs.append({"id": "pub1", "name": "Neon", "code": "ABC"})
+    monkeypatch.setattr(server, "display_snapshots", server.DisplaySnapshotCache())
+    monkeypatch.setattr(server, "ACCESS_LOG_SAMPLING", {})
+    http = TestClient(server.app)
+
+    def fake_db_time(*args):
+        # What the Mongo command listener does on Motor's executor thread
+        structured_logging.MongoRequestTimer().succeeded(SimpleNamespace(duration_micros=1500))
+        raise server.HTTPException(status_code=404, detail="Pub not found")
+
+    monkeypatch.setattr(server.display_snapshots, "get", fake_db_time)
+    with caplog.at_level(logging.INFO, logger="neonpub.access"):
+        http.get("/api/display/data", params={"pub_code": "abc"})
+
+    line = access_lines(caplog)[0]
+    assert line["route"] == "/api/display/data" and line["status"] == 404
+    assert line["pub_id"] == "pub1"
+    assert line["db_ms"] == 1.5 and line["db_ops"] == 1
+    assert line["http_ms"] == 0 and line["total_ms"] > 0
+
+
+def test_busy_routes_sampled(monkeypatch, caplog):
+    monkeypatch.setattr(server, "ACCESS_LOG_SAMPLING", {"/api/": 0.0, "unmatched": 0.0})
+    http = TestClient(server.app)
+    with caplog.at_level(logging.INFO, logger="neonpub.access"):
+        for _ in range(20):
+            http.get("/api/")
+        http.get("/api/nope")
+
+    assert [line["status"] for line in access_lines(caplog)] == [404]
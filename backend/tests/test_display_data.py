@@ -0,0 +1,172 @@
+"""
+Test the cached /api/display/data snapshot:
+1. Repeated polls are served from memory, with a 304 when the screen is up to date
+2. Events that change the display invalidate the snapshot; reactions do not,
+   and pending requests never crowd queued songs off the TV
+3. The SSE stream opens with the snapshot, then carries the broadcast events
+4. A screen reconnecting with Last-Event-ID gets only what it missed
+5. A WebSocket opens with a hello snapshot instead of four REST calls
+6. Screen-only events (live quiz counts) skip the players' phones
+"""
+import asyncio
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.requests import Request
+
+import server
+from conftest import FakeSocket
+
+
+@pytest.fixture
+def client(fake_db, monkeypatch):
+    fake_db.pubs.docs.append({"id": "pub1", "name": "Neon", "code": "ABC", "current_performance_id": None})
+    fake_db.song_requests.docs.append({"id": "r1", "pub_id": "pub1", "title": "Wonderwall", "status": "queued"})
+    fake_db.users.docs.append({"pub_id": "pub1", "nickname": "Anna", "score": 30})
+    monkeypatch.setattr(server, "display_snapshots", server.DisplaySnapshotCache())
+    return TestClient(server.app), fake_db.reads
+
+
+def test_polls_hit_the_cache(client):
+    http, reads = client
+    first = http.get("/api/display/data", params={"pub_code": "abc"})
+    assert first.status_code == 200
+    assert first.json()["queue"][0]["title"] == "Wonderwall"
+    reads_after_first = len(reads)
+
+    again = http.get("/api/display/data", params={"pub_code": "ABC"})
+    assert again.content == first.content
+    not_modified = http.get("/api/display/data", params={"pub_code": "ABC"},
+                            headers={"If-None-Match": first.headers["etag"]})
+    assert not_modified.status_code == 304
+    assert len(reads) == reads_after_first
+
+
+def test_events_invalidate(client):
+    http, reads = client
+    etag = http.get("/api/display/data", params={"pub_code": "ABC"}).headers["etag"]
+
+    asyncio.run(server.manager.broadcast("pub1", {"type": "reaction", "data": {}}))
+    assert http.get("/api/display/data", params={"pub_code": "ABC"},
+                    headers={"If-None-Match": etag}).status_code == 304
+
+    asyncio.run(server.manager.broadcast("pub1", {"type": "queue_updated"}))
+    fresh = http.get("/api/display/data", params={"pub_code": "ABC"}, headers={"If-None-Match": etag})
+    assert fresh.status_code == 200
+    assert fresh.headers["etag"] != etag
+    assert server.display_snapshots.builds == 2
+
+
+def test_pending_burst_keeps_tv_queue(client):
+    http, reads = client
+    server.db.song_requests.docs[:] = [
+        {"id": f"p{i}", "pub_id": "pub1", "title": f"Pending {i}", "status": "pending", "position": i}
+        for i in range(150)
+    ] + [{"id": "r1", "pub_id": "pub1", "title": "Wonderwall", "status": "queued", "position": 150}]
+
+    assert [r["id"] for r in http.get("/api/display/data", params={"pub_code": "ABC"}).json()["queue"]] == ["r1"]
+
+
+def stream_request(last_event_id=None):
+    headers = [(b"last-event-id", last_event_id.encode())] if last_event_id else []
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": headers, "query_string": b""})
+
+
+async def next_event(body):
+    while True:
+        chunk = await asyncio.wait_for(body.__anext__(), timeout=1)
+        if not chunk.startswith(":"):
+            fields = dict(line.split(": ", 1) for line in chunk.strip().splitlines())
+            return fields["id"], json.loads(fields["data"])
+
+
+def test_stream_snapshot_then_events(client, monkeypatch):
+    monkeypatch.setattr(server, "manager", server.ConnectionManager())
+
+    async def run():
+        response = await server.display_stream("abc", stream_request())
+        body = response.body_iterator
+        first = await next_event(body)
+        await server.manager.broadcast("pub1", {"type": "reaction", "data": {"emoji": "🔥"}})
+        second = await next_event(body)
+        await body.aclose()
+        return response, first, second
+
+    response, (snapshot_id, snapshot), (event_id, event) = asyncio.run(run())
+    assert response.media_type == "text/event-stream"
+    assert snapshot["type"] == "snapshot"
+    assert snapshot["data"]["queue"][0]["title"] == "Wonderwall"
+    assert event == {"type": "reaction", "data": {"emoji": "🔥"}}
+    assert event_id == server.manager.event_id(1)
+    assert not server.manager.streams["pub1"]
+
+
+def test_stream_resumes_from_last_event_id(client, monkeypatch):
+    monkeypatch.setattr(server, "manager", server.ConnectionManager())
+    monkeypatch.setattr(server, "SSE_HISTORY_SIZE", 3)
+
+    async def run():
+        for i in range(5):
+            await server.manager.broadcast("pub1", {"type": "reaction", "data": {"n": i}})
+        resumed = await server.display_stream("ABC", stream_request(server.manager.event_id(3)))
+        missed = [await next_event(resumed.body_iterator) for _ in range(2)]
+        await resumed.body_iterator.aclose()
+        # Event 1 has left the history: a full snapshot instead of a partial replay
+        too_old = await server.display_stream("ABC", stream_request(server.manager.event_id(1)))
+        restarted = await server.display_stream("ABC", stream_request("deadbeef-4"))
+        firsts = [await next_event(r.body_iterator) for r in (too_old, restarted)]
+        for r in (too_old, restarted):
+            await r.body_iterator.aclose()
+        return missed, firsts
+
+    missed, firsts = asyncio.run(run())
+    assert [e["data"]["n"] for _, e in missed] == [3, 4]
+    assert [e["type"] for _, e in firsts] == ["snapshot", "snapshot"]
+    assert firsts[0][0] == server.manager.event_id(5)
+
+
+def test_websocket_hello(client, monkeypatch):
+    http, reads = client
+    monkeypatch.setattr(server, "manager", server.ConnectionManager())
+    server.db.pubs.docs[0]["current_performance_id"] = "perf1"
+    server.db.performances.docs.append({"id": "perf1", "title": "Wonderwall", "status": "live"})
+    server.db.quizzes.docs.append({"id": "quiz1", "pub_id": "pub1", "status": "active", "question": "?"})
+    server.db.reactions.docs += [{"pub_id": "pub1", "user_id": "u1", "performance_id": "perf1"}] * 2
+    token = server.create_token({"user_id": "u1", "pub_id": "pub1", "nickname": "Anna"})
+
+    with http.websocket_connect(f"/api/ws/ABC?token={token}") as ws:
+        hello = ws.receive_json()
+    reads_after_first = len(reads)
+    with http.websocket_connect("/api/ws/ABC") as ws:
+        anonymous = ws.receive_json()
+
+    assert hello["type"] == "hello"
+    data = hello["data"]
+    assert data["current_performance"]["title"] == "Wonderwall"
+    assert data["queue"][0]["id"] == "r1"
+    assert data["active_quiz"]["id"] == "quiz1"
+    assert data["reactions"] == {"remaining": server.REACTION_LIMIT_PER_USER - 2, "limit": server.REACTION_LIMIT_PER_USER}
+    # The second screen is served from the cached snapshot
+    assert anonymous["data"]["reactions"] is None
+    assert len(reads) == reads_after_first
+
+
+def test_screen_only_events_skip_phones():
+    manager = server.ConnectionManager()
+    phone, display, admin = FakeSocket(), FakeSocket(), FakeSocket()
+    manager.register(phone, "pub1", phone=True)
+    manager.register(display, "pub1")
+    manager.register(admin, "pub1")
+    stream = manager.subscribe("pub1")
+
+    async def run():
+        await manager.broadcast("pub1", {"type": "quiz_progress", "data": {}}, screens_only=True)
+        await manager.broadcast("pub1", {"type": "quiz_ended", "data": {}})
+
+    asyncio.run(run())
+    assert phone.sent == ["quiz_ended"]
+    assert display.sent == admin.sent == ["quiz_progress", "quiz_ended"]
+    assert stream.qsize() == 2
+    manager.disconnect(phone, "pub1")
+    assert not manager.phones
@@ -0,0 +1,108 @@
+"""
+Test the /api/metrics instrumentation:
+1. Histograms and counters render in the Prometheus text format
+2. Requests are timed per route template, not per raw path; event streams
+   until they open. The endpoint is closed unless a token or METRICS_PUBLIC is set
+3. Mongo commands are timed by collection and command name
+4. Broadcast fan-out is timed and dropped screens are counted
+"""
+import asyncio
+from types import SimpleNamespace
+
+from fastapi.testclient import TestClient
+
+import metrics
+import server
+from conftest import FakeSocket
+
+
+def test_text_format():
+    registry = metrics.Registry()
+    latency = registry.histogram("lat_seconds", "Latency", ("route",), buckets=(0.1, 1.0))
+    errors = registry.counter("errors_total", "Errors", ("kind",))
+    registry.gauge("open", "Open things", ("pub",), lambda: {('pub"1',): 3})
+    latency.observe(0.05, "/a")
+    latency.observe(0.5, "/a")
+    latency.observe(7, "/a")
+    errors.inc("x")
+    errors.inc("x", amount=2)
+
+    lines = registry.render().splitlines()
+    assert "# TYPE lat_seconds histogram" in lines
+    assert 'lat_seconds_bucket{route="/a",le="0.1"} 1' in lines
+    assert 'lat_seconds_bucket{route="/a",le="1.0"} 2' in lines
+    assert 'lat_seconds_bucket{route="/a",le="+Inf"} 3' in lines
+    assert 'lat_seconds_count{route="/a"} 3' in lines
+    assert 'lat_seconds_sum{route="/a"} 7.55' in lines
+    assert 'errors_total{kind="x"} 3' in lines
+    assert 'open{pub="pub\\"1"} 3' in lines
+
+
+def test_routes_are_timed(monkeypatch):
+    http = TestClient(server.app)
+    before = server.http_latency.count("GET", "/api/", "200")
+    http.get("/api/")
+    http.get("/api/nope")
+    assert server.http_latency.count("GET", "/api/", "200") == before + 1
+
+    monkeypatch.setattr(server, "METRICS_TOKEN", "")
+    assert http.get("/api/metrics").status_code == 403
+    monkeypatch.setattr(server, "METRICS_PUBLIC", True)
+    assert http.get("/api/metrics").status_code == 200
+    monkeypatch.setattr(server, "METRICS_TOKEN", "secret")
+    assert http.get("/api/metrics").status_code == 401
+    body = http.get("/api/metrics", headers={"Authorization": "Bearer secret"}).text
+    assert 'neonpub_http_request_duration_seconds_count{method="GET",route="/api/",status="200"}' in body
+    assert 'route="unmatched",status="404"' in body
+    assert "# TYPE neonpub_youtube_cache_lookups_total counter" in body
+
+
+def test_event_streams_timed_until_open():
+    async def stream_app(scope, receive, send):
+        scope["route"] = SimpleNamespace(path="/api/test/stream")
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"text/event-stream; charset=utf-8")]})
+        await asyncio.sleep(0.2)
+        await send({"type": "http.response.body", "body": b"data: {}\n\n", "more_body": False})
+
+    async def noop(message=None):
+        return {"type": "http.disconnect"}
+
+    asyncio.run(server.MetricsMiddleware(stream_app)({"type": "http", "method": "GET"}, noop, noop))
+    counts, total = server.http_latency.series[("GET", "/api/test/stream", "200")]
+    assert sum(counts) == 1 and total < 0.1
+
+
+def test_mongo_commands_by_collection():
+    registry = metrics.Registry()
+    latency = registry.histogram("mongo", "Mongo", ("collection", "command"))
+    failures = registry.counter("mongo_failures", "Mongo failures", ("collection", "command"))
+    listener = metrics.MongoCommandMetrics(latency, failures)
+
+    def event(name, command, request_id, micros=2000):
+        return SimpleNamespace(command_name=name, command=command, request_id=request_id,
+                               connection_id=("db", 27017), duration_micros=micros)
+
+    listener.started(event("find", {"find": "song_requests"}, 1))
+    listener.started(event("getMore", {"getMore": 123, "collection": "song_requests"}, 2))
+    listener.started(event("ping", {"ping": 1}, 3))
+    listener.succeeded(event("find", {}, 1))
+    listener.failed(event("getMore", {}, 2))
+    listener.succeeded(event("ping", {}, 3))
+
+    assert latency.count("song_requests", "find") == 1
+    assert latency.count("song_requests", "getMore") == 1
+    assert failures.values == {("song_requests", "getMore"): 1}
+    assert not listener._pending
+
+
+def test_broadcast_failures_counted(monkeypatch):
+    manager = server.ConnectionManager()
+    manager.register(FakeSocket(broken=True), "pub1")
+    before = server.broadcast_failures.values.get(("ws",), 0)
+    sent_before = server.broadcast_latency.count("effect")
+
+    asyncio.run(manager.broadcast("pub1", {"type": "effect", "data": {}}))
+    assert server.broadcast_failures.values[("ws",)] == before + 1
+    assert server.broadcast_latency.count("effect") == sent_before + 1
+    assert manager.active_connections["pub1"] == []
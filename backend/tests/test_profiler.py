@@ -0,0 +1,106 @@
+"""
+Test the sampled request profiler:
+1. CPU time and awaits of a profiled task both land in the collapsed stacks
+2. The operator endpoint turns profiling on at runtime for matching routes only
+   and refuses pub admins and patterns prone to catastrophic backtracking
+3. The loop-lag watchdog measures a stall and logs the code that caused it
+"""
+import asyncio
+import logging
+import time
+
+from fastapi.testclient import TestClient
+
+import metrics
+import profiling
+import server
+
+
+def burn(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+async def slow_handler():
+    burn(0.05)
+    await asyncio.sleep(0.05)
+
+
+def test_samples_cpu_and_awaits(tmp_path):
+    profiler = profiling.SamplingProfiler(tmp_path, interval=0.002)
+
+    async def run():
+        task = asyncio.create_task(slow_handler())
+        profiler.start(task)
+        await task
+        return profiler.stop(task)
+
+    stacks = asyncio.run(run())
+    on_cpu = sum(n for stack, n in stacks.items() if "burn" in stack.split(";")[-1])
+    waiting = sum(n for stack, n in stacks.items() if stack.startswith("[awaiting];slow_handler"))
+    assert on_cpu >= 5 and waiting >= 5
+
+    path = profiler.write("GET", "/api/slow/{x}", 0.1, stacks)
+    assert path.name.endswith("-GET-api_slow_x-100ms.folded")
+    line = path.read_text().splitlines()[0]
+    assert line.rsplit(" ", 1)[1].isdigit()
+
+
+def test_operator_toggle(tmp_path, monkeypatch):
+    profiler = profiling.SamplingProfiler(tmp_path)
+    monkeypatch.setattr(server, "request_profiler", profiler)
+    http = TestClient(server.app)
+    pub_admin = {"Authorization": "Bearer " + server.create_token({"user_id": "a", "pub_id": "pub1", "is_admin": True})}
+    admin = {"Authorization": "Bearer ops-secret"}
+
+    http.get("/api/")
+    assert profiler.files() == []
+    # Without OPERATOR_TOKEN nobody can reach it
+    monkeypatch.setattr(server, "OPERATOR_TOKEN", "")
+    assert http.post("/api/admin/profiler", json={"enabled": True}, headers=admin).status_code == 403
+    monkeypatch.setattr(server, "OPERATOR_TOKEN", "ops-secret")
+    assert http.post("/api/admin/profiler", json={"enabled": True}, headers=pub_admin).status_code == 403
+    assert http.get("/api/admin/profiler").status_code == 403
+    assert http.post("/api/admin/profiler", json={"enabled": True, "route_pattern": "("}, headers=admin).status_code == 400
+    for pattern in ("(a+)+$", "(\\w+\\s?)*$", "(x)\\1"):
+        assert http.post("/api/admin/profiler", json={"enabled": True, "route_pattern": pattern},
+                         headers=admin).status_code == 400
+    assert http.post("/api/admin/profiler", json={"enabled": True, "route_pattern": "a" * 500},
+                     headers=admin).status_code == 422
+    assert not profiler.enabled
+
+    status = http.post("/api/admin/profiler", json={"enabled": True, "route_pattern": "^/api/$"}, headers=admin).json()
+    assert status["enabled"] and status["route_pattern"] == "^/api/$"
+    written = []
+    monkeypatch.setattr(profiler, "write", lambda method, path, elapsed, stacks: written.append((method, path)))
+    http.get("/api/")
+    http.get("/api/metrics")
+    assert written == [("GET", "/api/")]
+
+    http.post("/api/admin/profiler", json={"enabled": False}, headers=admin)
+    assert not profiler.wants("/api/")
+
+
+def blocking_login():
+    time.sleep(0.3)
+
+
+def test_loop_lag_stack_capture(caplog):
+    registry = metrics.Registry()
+    lag = registry.histogram("lag", "Lag")
+    stalls = registry.counter("stalls", "Stalls")
+    monitor = profiling.LoopLagMonitor(0.02, 0.1, lag, stalls, logging.getLogger("lag-test"))
+
+    async def run():
+        monitor.start()
+        await asyncio.sleep(0.1)
+        blocking_login()
+        await asyncio.sleep(0.1)
+        await monitor.stop()
+
+    with caplog.at_level(logging.WARNING, logger="lag-test"):
+        asyncio.run(run())
+    assert stalls.values == {(): 1}
+    assert lag.series[()][1] >= 0.25
+    assert "Event loop blocked" in caplog.text and "blocking_login" in caplog.text
@@ -0,0 +1,174 @@
+"""
+Test the quiz library:
+1. The Smart Quiz Generator .sql output parses into library entries
+2. The in-memory index lists and filters categories by genre/media type/category
+3. The nightly sampler never repeats a question within a pub's night
+4. Streamed generator output (quotes included) loads back into the library
+5. Generator distractors come from similar-sounding artists when NumPy is available
+"""
+import asyncio
+import importlib.util
+import io
+import json
+import random
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import pytest
+
+import server
+from conftest import FakeCollection, FakeCursor
+
+SAMPLE_SQL = Path(__file__).resolve().parents[2] / 'DiscoJoys-Quiz' / 'quiz_figli_dei_fiori.sql'
+GENERATOR = Path(__file__).resolve().parents[2] / 'DiscoJoys-Quiz' / 'Smart quiz generator.py'
+
+
+def load_generator():
+    spec = importlib.util.spec_from_file_location("smart_quiz_generator", GENERATOR)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_parse_generator_sql():
+    entries = server.parse_quiz_library_sql(SAMPLE_SQL.read_text(encoding='utf-8'))
+    assert len(entries) == 1
+    entry = entries[0]
+    assert entry.name == "Figli Dei Fiori"
+    assert entry.category == "Chi Canta?"
+    assert entry.media_type == "audio"
+    assert len(entry.questions) == 63
+    # Doubled quotes are SQL escaping, not content
+    assert any("Surfin' U.S.A." in q.question for q in entry.questions)
+
+
+def test_generator_output_round_trip():
+    generator = load_generator()
+    tracks = [{"id": f"t{i}", "title": f"Song {i}", "artist": f"Artist {i % 7}"} for i in range(50)]
+    tracks[0]["artist"] = "Guns N' Roses"
+
+    for fmt in ("sql", "json", "jsonl"):
+        out = io.StringIO()
+        written = generator.WRITERS[fmt](out, generator.iter_questions(tracks, "chi_canta", verbose=False),
+                                         tracks, "Rock 'n' Roll", "Chi Canta?", "Misto", "chi_canta")
+        if fmt == "sql":
+            entry = server.parse_quiz_library_sql(out.getvalue())[0]
+        elif fmt == "jsonl":
+            entry = server.parse_quiz_library_jsonl(out.getvalue() * 2)[1]
+        else:
+            entry = server.QuizLibraryEntry(**json.loads(out.getvalue())[0])
+        assert written == len(entry.questions) == 50
+        assert entry.name == "Rock 'n' Roll"
+        first = entry.questions[0]
+        assert first.options[first.correct_index] == "Guns N' Roses"
+        assert all(len(set(q.options)) == 4 for q in entry.questions)
+
+
+def test_similar_distractors():
+    pytest.importorskip("numpy")
+    generator = load_generator()
+    tracks = []
+    for i in range(40):
+        sixties = i % 2 == 0
+        tracks.append({
+            "id": f"t{i}", "title": f"Song {i}", "artist": f"{'Beat' if sixties else 'Synth'} Band {i}",
+            "year": 1965 + i % 5 if sixties else 2015 + i % 5,
+            "danceability": 0.4 if sixties else 0.8, "energy": 0.6, "tempo": 120.0, "valence": 0.5,
+            "genres": ["rock classico"] if sixties else ["electropop"]
+        })
+
+    sampler = generator.SimilarDistractors(tracks, "artist", random.Random(1))
+    for track in tracks:
+        wrong = sampler.sample(track["artist"])
+        assert len(set(wrong)) == 3 and track["artist"] not in wrong
+        assert all(w.split()[0] == track["artist"].split()[0] for w in wrong)
+
+
+def test_index_lookups():
+    index = server.QuizLibraryIndex()
+    for doc in server.preset_library_docs():
+        index.add(doc)
+    entry = server.parse_quiz_library_sql(SAMPLE_SQL.read_text(encoding='utf-8'))[0]
+    doc = server.build_library_doc(entry)
+    index.add(doc)
+
+    assert len(index.listing()) == len(server.PRESET_QUIZZES) + 1
+    assert [c["id"] for c in index.listing(media_type="audio")] == [doc["id"]]
+    assert [c["id"] for c in index.listing(category="chi canta")] == [doc["id"]]
+    assert index.listing(genre="nope") == []
+    assert index.get("anni80")["questions"][0]["id"]
+
+    # Re-importing replaces the entry instead of duplicating it
+    index.add(doc)
+    assert len(index.listing(media_type="audio")) == 1
+
+
+def test_invalid_question_rejected():
+    entry = server.QuizLibraryEntry(name="Broken", category="Test", questions=[
+        {"question": "?", "options": ["a", "b"], "correct_index": 5}
+    ])
+    with pytest.raises(server.HTTPException):
+        server.build_library_doc(entry)
+
+
+class AskedEverywhere(FakeCollection):
+    """Tonight's history is the same whichever pub asks for it"""
+
+    def find(self, query, projection=None):
+        return FakeCursor(self.docs)
+
+
+def make_category(n, difficulty=None):
+    return {"id": "cat", "name": "Cat", "questions": [
+        {"id": f"q{i}", "question": f"Q{i}", "options": ["a", "b"], "correct_index": 0,
+         "difficulty": difficulty(i) if difficulty else None}
+        for i in range(n)
+    ]}
+
+
+@pytest.fixture
+def sampler(fake_db):
+    random.seed(38)
+    return server.NightlyQuestionSampler("Europe/Rome", 6, 7, 0.25)
+
+
+def test_no_repeats_within_night(sampler):
+    category = make_category(20)
+
+    async def run():
+        return [await sampler.draw("pub1", category, 5) for _ in range(4)], await sampler.draw("pub1", category, 5)
+
+    sessions, fifth = asyncio.run(run())
+    drawn = [q["id"] for s in sessions for q in s]
+    assert len(drawn) == len(set(drawn)) == 20
+    # Everything was asked: a new round starts, still without repeats inside the session
+    assert len({q["id"] for q in fifth}) == 5
+
+
+def test_night_starts_at_cutoff(sampler):
+    late = datetime(2026, 3, 7, 2, 30, tzinfo=timezone.utc)   # 03:30 in Rome, still Friday night
+    start = sampler.night_start(late)
+    assert start.date().isoformat() == "2026-03-06" and start.hour == 6
+    assert sampler.night_start(late + timedelta(hours=4)).date().isoformat() == "2026-03-07"
+
+
+def test_restart_remembers_tonight_and_weights_recent(fake_db, sampler):
+    category = make_category(50)
+    tonight = sampler.night_start().astimezone(timezone.utc)
+    asked = [{"question_id": f"q{i}", "started_at": (tonight + timedelta(minutes=i)).isoformat()} for i in range(10)]
+    asked += [{"question_id": f"q{i}", "started_at": (tonight - timedelta(days=1)).isoformat()} for i in range(10, 30)]
+    fake_db.quizzes = AskedEverywhere(asked)
+
+    async def run():
+        return [(await sampler.draw(f"pub{n}", category, 1))[0] for n in range(500)]
+
+    firsts = [int(q["id"][1:]) for q in asyncio.run(run())]
+    assert min(firsts) >= 10
+    # 20 fresh questions at weight 1 vs 20 from last night at 0.25: fresh ones come up ~80% of the time
+    assert sum(i >= 30 for i in firsts) / len(firsts) > 0.7
+
+
+def test_difficulty_preference(sampler):
+    category = make_category(300, difficulty=lambda i: i % 3 + 1)
+    picked = asyncio.run(sampler.draw("pub1", category, 30, difficulty=3))
+    assert sum(q["difficulty"] == 3 for q in picked) >= 15
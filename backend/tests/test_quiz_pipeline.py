@@ -0,0 +1,316 @@
+"""
+Test the in-memory quiz answer pipeline:
+1. Answers are validated and deduplicated without touching Mongo
+2. A burst is persisted with one insert_many and one bulk_write of score increments
+3. Live per-option counts go out as throttled quiz_progress broadcasts
+4. Timed questions close on the server clock and score faster answers higher
+5. Question results come from the live counters, without reading the answers back
+6. Session standings stay ordered in memory as answers are scored
+7. An answer racing the close of its question cannot reopen it
+8. Rebuilding an old session's board neither evicts the live one nor loses answers
+9. A question reloaded after a restart is read once and still closes on its timer
+"""
+import asyncio
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+import server
+from conftest import FakeCollection, FakeCursor
+
+
+def make_quiz(quiz_id="quiz1"):
+    return {
+        "id": quiz_id, "pub_id": "pub1", "session_id": "sess1",
+        "correct_index": 2, "points": 10, "options": ["a", "b", "c", "d"]
+    }
+
+
+def player(i):
+    return {"user_id": f"user{i}", "pub_id": "pub1", "nickname": f"Player {i}"}
+
+
+def test_burst_is_batched(fake_db, broadcasts):
+    async def run():
+        pipeline = server.QuizAnswerPipeline(flush_interval=0.05, batch_size=1000, progress_interval=0.01)
+        quiz = pipeline.activate(make_quiz())
+        results = [pipeline.submit(quiz, player(i), i % 4) for i in range(300)]
+        with pytest.raises(server.HTTPException):
+            pipeline.submit(quiz, player(0), 2)
+        await asyncio.sleep(0.2)
+        await pipeline.stop()
+        return results
+
+    results = asyncio.run(run())
+    assert sum(r["is_correct"] for r in results) == 75
+    ops = [name for name, _ in fake_db.quiz_answers.calls + fake_db.users.calls]
+    assert ops == ["insert_many", "bulk_write"]
+    assert len(fake_db.quiz_answers.calls[0][1]) == 300
+    assert len(fake_db.users.calls[0][1]) == 75
+
+
+def test_full_batch_flushes_early(fake_db, broadcasts):
+    async def run():
+        pipeline = server.QuizAnswerPipeline(flush_interval=10, batch_size=50, progress_interval=0.01)
+        quiz = pipeline.activate(make_quiz())
+        for i in range(50):
+            pipeline.submit(quiz, player(i), 0)
+        await asyncio.sleep(0.05)
+        calls = list(fake_db.quiz_answers.calls)
+        await pipeline.stop()
+        return calls
+
+    calls = asyncio.run(run())
+    assert len(calls) == 1 and len(calls[0][1]) == 50
+
+
+def test_wrong_pub_is_rejected(fake_db):
+    async def run():
+        pipeline = server.QuizAnswerPipeline(flush_interval=0.05, batch_size=10, progress_interval=0.01)
+        pipeline.activate(make_quiz())
+        return await pipeline.get_active("quiz1", "another-pub")
+
+    assert asyncio.run(run()) is None
+
+
+def test_progress_is_throttled(fake_db, broadcasts):
+    async def run():
+        pipeline = server.QuizAnswerPipeline(flush_interval=0.05, batch_size=1000, progress_interval=0.1)
+        quiz = pipeline.activate(make_quiz())
+        for i in range(200):
+            pipeline.submit(quiz, player(i), i % 4)
+            if i % 50 == 49:
+                await asyncio.sleep(0.06)
+        await asyncio.sleep(0.15)
+        await pipeline.stop()
+
+    asyncio.run(run())
+    progress = [m for m in broadcasts if m["type"] == "quiz_progress"]
+    assert 1 < len(progress) <= 3
+    assert progress[-1]["data"] == {"quiz_id": "quiz1", "counts": [50, 50, 50, 50], "answered": 200}
+
+
+@pytest.fixture
+def timed_pipeline(monkeypatch, fake_db):
+    monkeypatch.setattr(server, "QUIZ_LATENCY_GRACE", 0.0)
+    pipeline = server.QuizAnswerPipeline(flush_interval=0.01, batch_size=1000, progress_interval=10)
+    monkeypatch.setattr(server, "quiz_answer_pipeline", pipeline)
+    monkeypatch.setattr(server, "quiz_timers", server.QuizTimers())
+    monkeypatch.setattr(server, "quiz_locks", {})
+    return pipeline
+
+
+def test_timed_question_closes_itself(fake_db, broadcasts, timed_pipeline):
+    quiz_doc = {**make_quiz(), "time_limit": 0.2}
+    fake_db.quizzes.docs.append(quiz_doc)
+
+    async def run():
+        start = time.monotonic()
+        quiz = server.arm_quiz(quiz_doc)
+        fast = timed_pipeline.submit(quiz, player(1), 2)
+        await asyncio.sleep(0.1)
+        slow = timed_pipeline.submit(quiz, player(2), 2)
+        while not any(m["type"] == "quiz_ended" for m in broadcasts):
+            await asyncio.sleep(0.01)
+        closed_after = time.monotonic() - start
+        with pytest.raises(server.HTTPException):
+            timed_pipeline.submit(quiz, player(3), 2)
+        await server.quiz_timers.stop()
+        await timed_pipeline.stop()
+        return fast, slow, closed_after
+
+    fast, slow, closed_after = asyncio.run(run())
+    assert 0.2 <= closed_after < 0.35
+    assert fast["points_earned"] == 10
+    assert 5 <= slow["points_earned"] < fast["points_earned"]
+    assert "quiz1" not in timed_pipeline.active
+
+
+def test_admin_close_cancels_timer(fake_db, broadcasts, timed_pipeline):
+    quiz_doc = {**make_quiz(), "time_limit": 0.1}
+    fake_db.quizzes.docs.append(quiz_doc)
+
+    async def run():
+        server.arm_quiz(quiz_doc)
+        async with server.quiz_lock("pub1"):
+            await server.close_quiz("pub1", quiz_doc)
+        await asyncio.sleep(0.2)
+        await timed_pipeline.stop()
+
+    asyncio.run(run())
+    assert [m["type"] for m in broadcasts].count("quiz_ended") == 1
+
+
+def test_results_from_counters(fake_db, broadcasts, timed_pipeline):
+    quiz_doc = make_quiz()
+    fake_db.quizzes.docs.append(quiz_doc)
+
+    async def run():
+        quiz = server.arm_quiz(quiz_doc)
+        for i in range(2000):
+            timed_pipeline.submit(quiz, player(i), (i + 2) % 4)
+        async with server.quiz_lock("pub1"):
+            result = await server.close_quiz("pub1", quiz_doc)
+        await timed_pipeline.stop()
+        return result
+
+    result = asyncio.run(run())
+    ended = next(m["data"] for m in broadcasts if m["type"] == "quiz_ended")
+    assert result == {"status": "ended", "winners": 500}
+    assert ended["total_answers"] == 2000 and ended["correct_count"] == 500
+    assert ended["counts"] == [500, 500, 500, 500]
+    assert ended["winners"][:2] == ["Player 0", "Player 4"]
+    assert len(ended["winners"]) == server.QUIZ_WINNERS_LIMIT
+
+
+def test_session_leaderboard_order():
+    board = server.SessionLeaderboard("sess1", "pub1")
+    board.record("a", "Anna", 10)
+    board.record("b", "Bruno", 10)
+    board.record("c", "Carla", 0)
+    board.record("b", "Bruno", 5)
+    board.record("a", "Anna", 0)
+
+    assert [e["nickname"] for e in board.top()] == ["Bruno", "Anna", "Carla"]
+    assert board.rank("a") == {"session_id": "sess1", "rank": 2, "score": 10, "players": 3}
+    assert board.rank("nobody")["rank"] is None
+    # Equal scores: whoever got there first stays ahead
+    board.record("c", "Carla", 15)
+    assert [e["user_id"] for e in board.top(2)] == ["b", "c"]
+
+
+def test_answers_update_session_rank(fake_db, broadcasts):
+    async def run():
+        pipeline = server.QuizAnswerPipeline(flush_interval=0.05, batch_size=1000, progress_interval=10)
+        pipeline.open_leaderboard("sess1", "pub1")
+        quiz = pipeline.activate(make_quiz())
+        for i in range(1000):
+            pipeline.submit(quiz, player(i), 2 if i % 3 == 0 else 0)
+        board = await pipeline.get_leaderboard("sess1", "pub1")
+        foreign = await pipeline.get_leaderboard("sess1", "another-pub")
+        await pipeline.stop()
+        return board, foreign
+
+    board, foreign = asyncio.run(run())
+    assert foreign is None
+    assert len(board) == 1000
+    assert board.rank("user0")["rank"] == 1
+    assert board.rank("user3")["rank"] == 2
+    assert board.rank("user1") == {"session_id": "sess1", "rank": 335, "score": 0, "players": 1000}
+
+
+class SlowQuizzes(FakeCollection):
+    """The "ended" write takes a while, as it would on a real database"""
+
+    async def update_one(self, query, update, upsert=False):
+        await asyncio.sleep(0.05)
+        return await super().update_one(query, update, upsert)
+
+
+class NoAnswers(FakeCollection):
+    def aggregate(self, pipeline):
+        return FakeCursor([])
+
+
+def test_answer_during_close_does_not_reopen(fake_db, broadcasts, timed_pipeline):
+    fake_db.quizzes = SlowQuizzes()
+    fake_db.quiz_answers = NoAnswers()
+    quiz_doc = {**make_quiz(), "status": "active", "started_at": datetime.now(timezone.utc).isoformat()}
+    fake_db.quizzes.docs.append(quiz_doc)
+
+    async def run():
+        server.arm_quiz(quiz_doc)
+        closing = asyncio.create_task(server.close_quiz("pub1", dict(quiz_doc)))
+        await asyncio.sleep(0.01)
+        # The doc still says "active": the cold path must not bring the question back
+        late = await timed_pipeline.get_active("quiz1", "pub1")
+        await closing
+        await timed_pipeline.stop()
+        return late
+
+    assert asyncio.run(run()) is None
+    assert "quiz1" not in timed_pipeline.active
+
+
+class SlowCursor(FakeCursor):
+    async def to_list(self, length=None):
+        await asyncio.sleep(0.05)
+        return await super().to_list(length)
+
+
+class StoredTotals(FakeCollection):
+    def __init__(self, totals):
+        super().__init__()
+        self.totals = totals
+
+    def aggregate(self, pipeline):
+        return SlowCursor(self.totals)
+
+
+def test_cold_rebuild_keeps_live_board(fake_db, broadcasts):
+    fake_db.quiz_sessions.docs += [{"id": "sess0", "pub_id": "pub1"}, {"id": "sess1", "pub_id": "pub1"}]
+    # user1 already answered quiz0 (stored); quiz1 answers arrive during the rebuild
+    fake_db.quiz_answers = StoredTotals([
+        {"_id": "user1", "nickname": "Player 1", "score": 10, "quizzes": ["quiz0"], "last": "1"}
+    ])
+
+    async def run():
+        pipeline = server.QuizAnswerPipeline(flush_interval=0.01, batch_size=1000, progress_interval=10)
+        live = pipeline.open_leaderboard("sess0", "pub1")
+        quiz = pipeline.activate({**make_quiz("quiz1"), "session_id": "sess1"})
+        rebuild = asyncio.create_task(pipeline.get_leaderboard("sess1", "pub1"))
+        await asyncio.sleep(0.01)
+        pipeline.submit(quiz, player(1), 2)
+        pipeline.submit(quiz, player(2), 2)
+        board = await rebuild
+        await pipeline.stop()
+        return pipeline, live, board
+
+    pipeline, live, board = asyncio.run(run())
+    assert pipeline.leaderboards["sess0"] is live
+    assert board.rank("user1")["score"] == 20
+    assert board.rank("user2")["score"] == 10
+
+
+class RestartAnswers(FakeCollection):
+    """user7 answered before the restart; results are aggregated like in Mongo"""
+
+    def __init__(self):
+        super().__init__()
+        self.loads = 0
+
+    def aggregate(self, pipeline):
+        if "$facet" in pipeline[1]:
+            return FakeCursor([{"by_option": [{"_id": 2, "count": 2}], "correct": [{"n": 2}], "winners": []}])
+        self.loads += 1
+        return SlowCursor([{"_id": 2, "users": ["user7"]}])
+
+
+def test_restart_reload_is_single_and_timed(fake_db, broadcasts, timed_pipeline):
+    fake_db.quiz_answers = RestartAnswers()
+    started = datetime.now(timezone.utc).isoformat()
+    fake_db.quizzes.docs.append({**make_quiz(), "session_id": None, "time_limit": 0.3, "status": "active",
+                                 "started_at": started})
+
+    async def run():
+        first = asyncio.create_task(timed_pipeline.get_active("quiz1", "pub1"))
+        await asyncio.sleep(0.01)
+        second = asyncio.create_task(timed_pipeline.get_active("quiz1", "pub1"))
+        quiz = await first
+        timed_pipeline.submit(quiz, player(1), 2)
+        assert await second is quiz
+        counts = list(quiz.option_counts)
+        for _ in range(100):
+            if any(m["type"] == "quiz_ended" for m in broadcasts):
+                break
+            await asyncio.sleep(0.01)
+        await server.quiz_timers.stop()
+        await timed_pipeline.stop()
+        return counts
+
+    counts = asyncio.run(run())
+    assert fake_db.quiz_answers.loads == 1
+    # The second caller did not overwrite the live count with its stale aggregate
+    assert counts == [0, 0, 2, 0]
+    assert "quiz1" not in timed_pipeline.active
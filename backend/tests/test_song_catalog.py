@@ -0,0 +1,109 @@
+"""
+Test the in-memory song catalog behind /api/songs/autocomplete:
+1. Exportify CSVs load and duplicate spellings collapse
+2. Prefix search matches any word of title or artist
+3. Lookups stay well under a millisecond
+4. Requests of a song already queued or resolved are spotted from memory
+5. A URL typed by a singer never reaches the shared catalog
+6. Songs behind a crowded prefix are still found
+"""
+import asyncio
+import time
+from pathlib import Path
+
+import server
+
+SAMPLE_CSV = Path(__file__).resolve().parents[2] / 'DiscoJoys-Quiz' / 'figli_dei_fiori.csv'
+
+
+def test_load_exportify_csv():
+    catalog = server.SongCatalog()
+    added = catalog.load_exportify_csv(SAMPLE_CSV)
+    assert added == len(catalog)
+    # "Stuck In The Middle With You" is in the playlist twice
+    assert added == 62
+
+
+def test_prefix_search():
+    catalog = server.SongCatalog()
+    catalog.add("Bohemian Rhapsody", "Queen", "https://www.youtube.com/watch?v=fJ9rUzIMcZQ")
+    catalog.add("Wonderwall", "Oasis")
+    catalog.add("Perché no", "Lucio Battisti")
+
+    assert [s["title"] for s in catalog.search("rhap")] == ["Bohemian Rhapsody"]
+    assert catalog.search("que boh")[0]["youtube_url"] == "https://www.youtube.com/watch?v=fJ9rUzIMcZQ"
+    assert [s["title"] for s in catalog.search("PERCHE")] == ["Perché no"]
+    assert catalog.search("wonderwall blur") == []
+    assert catalog.search("   ") == []
+
+
+def test_duplicate_spelling_keeps_one_entry():
+    catalog = server.SongCatalog()
+    catalog.add("Wonderwall", "Oasis")
+    catalog.add("wonderwall!", "OASIS", "https://www.youtube.com/watch?v=bx1Bh8ZvH84")
+    assert len(catalog) == 1
+    assert catalog.search("wond")[0]["youtube_url"] == "https://www.youtube.com/watch?v=bx1Bh8ZvH84"
+
+
+def test_crowded_prefix_reaches_every_song():
+    catalog = server.SongCatalog()
+    for i in range(200):
+        catalog.add(f"Love Song {i}", f"Band {i}")
+    catalog.add("Love Me Tender", "Elvis Presley")
+
+    assert [s["title"] for s in catalog.search("lo elvis")] == ["Love Me Tender"]
+    assert [s["title"] for s in catalog.search("love tender")] == ["Love Me Tender"]
+    assert [s["artist"] for s in catalog.search("lo band 199")] == ["Band 199"]
+    assert len(catalog.search("lo", limit=100)) == 100
+
+
+def test_search_is_sub_millisecond():
+    catalog = server.SongCatalog()
+    catalog.load_exportify_csv(SAMPLE_CSV)
+    for i in range(20000):
+        catalog.add(f"Song {i} Title", f"Artist {i % 500}")
+
+    start = time.perf_counter()
+    for _ in range(1000):
+        catalog.search("the do")
+    assert (time.perf_counter() - start) / 1000 < 0.001
+
+
+def test_queue_index_spots_duplicates(fake_db):
+    fake_db.song_requests.docs.append({"id": "r1", "pub_id": "pub1", "status": "queued",
+                                       "title": "Hotel California - 2013 Remaster", "artist": "Eagles"})
+    index = server.SongQueueIndex()
+
+    async def run():
+        queue = await index.get("pub1")
+        assert queue["by_key"].get(server.youtube_cache_key("Hotel California", "The Eagles")) == "r1"
+        index.add("pub1", {"id": "r2", "title": "Hotel California", "artist": "Eagles"})
+        index.discard("pub1", "r1")
+        queue = await index.get("pub1")
+        return queue
+
+    queue = asyncio.run(run())
+    assert len(fake_db.reads) == 1
+    assert queue["by_key"] == {server.youtube_cache_key("Hotel California", "Eagles"): "r2"}
+    assert len(queue["requests"]) == 1
+
+
+def test_catalog_lookup_by_variant():
+    catalog = server.SongCatalog()
+    catalog.add("Don't Stop Me Now - Remastered 2011", "Queen", "https://www.youtube.com/watch?v=HgzGwKwLmgM")
+    assert catalog.get("Don't Stop Me Now", "Queen")["youtube_url"].endswith("HgzGwKwLmgM")
+    assert catalog.get("Bohemian Rhapsody", "Queen") is None
+
+
+def test_user_supplied_url_not_recorded(fake_db, broadcasts, monkeypatch):
+    catalog = server.SongCatalog()
+    index = server.SongQueueIndex()
+    index.pubs["pub1"] = {"by_key": {}, "requests": {}}
+    monkeypatch.setattr(server, "song_catalog", catalog)
+    monkeypatch.setattr(server, "song_queue_index", index)
+    user = {"pub_id": "pub1", "user_id": "u1", "nickname": "Ale"}
+    song = server.SongRequestCreate(title="Wonderwall", artist="Oasis", youtube_url="https://evil.example/rickroll")
+
+    asyncio.run(server.request_song(song, user))
+    assert fake_db.song_requests.docs[0]["youtube_url"] == "https://evil.example/rickroll"
+    assert catalog.get("Wonderwall", "Oasis") == {"title": "Wonderwall", "artist": "Oasis", "youtube_url": None}
@@ -0,0 +1,35 @@
+"""
+Test the canonical track keys shared with the Smart Quiz Generator:
+1. Release decorations and artist spellings collapse to one key
+2. Different songs keep different keys
+"""
+from track_keys import track_key
+
+
+def test_variants_share_a_key():
+    same = [
+        ("Surfin' U.S.A. - Remastered 2001", "The Beach Boys"),
+        ("Surfin USA", "Beach Boys"),
+        ("Surfin' U.S.A. (Mono)", "The Beach Boys; Brian Wilson"),
+    ]
+    assert len({track_key(t, a) for t, a in same}) == 1
+    assert track_key("California Dreamin' - Single Version", "The Mamas & The Papas") == \
+        track_key("California Dreamin'", "Mamas & the Papas")
+    assert track_key("Breathe (In The Air) - 2011 Remastered Version", "Pink Floyd") == \
+        track_key("Breathe (In the Air)", "Pink Floyd")
+    assert track_key("Despacito (feat. Daddy Yankee)", "Luis Fonsi") == \
+        track_key("Despacito", "Luis Fonsi feat. Daddy Yankee")
+    assert track_key("Hotel California - 2013 Remaster", "Eagles") == track_key("Hotel California", "Eagles")
+    assert track_key("Danger Zone - From \"Top Gun\" Original Soundtrack", "Kenny Loggins") == \
+        track_key("Danger Zone", "Kenny Loggins")
+
+
+def test_different_songs_stay_apart():
+    assert track_key("Funky Nassau, Pt. 1", "The Beginning Of The End") != \
+        track_key("Funky Nassau, Pt. 2", "The Beginning Of The End")
+    assert track_key("Live and Let Die", "Wings") != track_key("Let Die", "Wings")
+    # "With"/"From" are part of these titles, not release decorations
+    assert track_key("Love Me (With All Your Heart)", "The Flamingos") != track_key("Love Me", "The Flamingos")
+    assert track_key("Let It Be - From Abbey Road", "X") != track_key("Let It Be", "X")
+    assert track_key("Live", "The The") == "live|the"
+    assert track_key("Time", "Pink Floyd") != track_key("Time", "Hans Zimmer")
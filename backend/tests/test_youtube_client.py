@@ -0,0 +1,391 @@
+"""
+Test the shared YouTube HTTP client against a local stub server:
+1. Search results are parsed from the Data API format
+2. Consecutive lookups reuse one pooled keep-alive connection
+3. Non-200 answers surface as YouTubeAPIError
+4. Karaoke searches are cached by normalized title/artist, empty ones briefly
+5. The background resolver retries transient failures and broadcasts the URL
+6. The queue prefetcher skips videos that cannot be embedded and songs already
+   not found, and never overwrites a video changed meanwhile
+7. Identical in-flight lookups are merged; quota and errors trip the breaker
+"""
+import asyncio
+import json
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import httpx
+import pytest
+
+import server
+
+
+class StubYouTubeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    connections = set()
+    requests_seen = []
+    status_code = 200
+    delay = 0.0
+    no_results = False
+
+    def do_GET(self):
+        StubYouTubeHandler.connections.add(self.client_address)
+        time.sleep(StubYouTubeHandler.delay)
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        StubYouTubeHandler.requests_seen.append((url.path, params))
+        if StubYouTubeHandler.status_code == 403:
+            body = json.dumps({"error": {"code": 403, "errors": [{"reason": "quotaExceeded"}]}}).encode()
+        elif StubYouTubeHandler.status_code != 200:
+            body = json.dumps({"error": {"code": StubYouTubeHandler.status_code}}).encode()
+        elif url.path == "/videos":
+            body = json.dumps({"items": [
+                {
+                    "id": video_id,
+                    "contentDetails": {"duration": "PT4M13S"},
+                    # The first search result is never embeddable
+                    "status": {"embeddable": video_id != "vid00000000", "privacyStatus": "public"}
+                }
+                for video_id in params["id"][0].split(",")
+            ]}).encode()
+        else:
+            max_results = 0 if StubYouTubeHandler.no_results else int(params.get("maxResults", ["5"])[0])
+            body = json.dumps({"items": [
+                {
+                    "id": {"videoId": f"vid{i:08d}"},
+                    "snippet": {
+                        "title": f"{params['q'][0]} #{i}",
+                        "thumbnails": {"medium": {"url": f"https://img/{i}.jpg"}},
+                        "channelTitle": "Stub Karaoke"
+                    }
+                }
+                for i in range(max_results)
+            ]}).encode()
+        self.send_response(StubYouTubeHandler.status_code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_youtube(monkeypatch):
+    StubYouTubeHandler.connections = set()
+    StubYouTubeHandler.requests_seen = []
+    StubYouTubeHandler.status_code = 200
+    StubYouTubeHandler.delay = 0.0
+    StubYouTubeHandler.no_results = False
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), StubYouTubeHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(server, "YOUTUBE_API_BASE", f"http://127.0.0.1:{httpd.server_port}")
+    monkeypatch.setattr(server, "YOUTUBE_API_KEY", "test-key")
+    monkeypatch.setattr(server, "youtube_http", None)
+    monkeypatch.setattr(server, "youtube_breaker", server.YouTubeCircuitBreaker(10000, 5, 60))
+    monkeypatch.setattr(server, "youtube_singleflight", server.SingleFlight())
+    yield StubYouTubeHandler
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_search_parses_results(stub_youtube):
+    async def run():
+        try:
+            return await server.youtube_search("Wonderwall Oasis karaoke", max_results=3)
+        finally:
+            await server.close_youtube_http()
+
+    results = asyncio.run(run())
+    assert [r["video_id"] for r in results] == ["vid00000000", "vid00000001", "vid00000002"]
+    assert results[0]["url"] == "https://www.youtube.com/watch?v=vid00000000"
+    assert results[0]["channel"] == "Stub Karaoke"
+    path, params = stub_youtube.requests_seen[0]
+    assert path == "/search"
+    assert params["key"] == ["test-key"]
+
+
+def test_lookups_reuse_pooled_connection(stub_youtube):
+    async def run():
+        try:
+            for i in range(5):
+                await server.youtube_search(f"song {i} karaoke", max_results=1)
+        finally:
+            await server.close_youtube_http()
+
+    asyncio.run(run())
+    assert len(stub_youtube.requests_seen) == 5
+    assert len(stub_youtube.connections) == 1
+
+
+def test_error_status_raises(stub_youtube):
+    stub_youtube.status_code = 403
+
+    async def run():
+        try:
+            await server.youtube_search("anything karaoke")
+        finally:
+            await server.close_youtube_http()
+
+    with pytest.raises(server.YouTubeAPIError) as exc:
+        asyncio.run(run())
+    assert exc.value.status_code == 403
+
+
+class FakeCacheCollection:
+    """Minimal async stand-in for the youtube_cache Mongo collection"""
+
+    def __init__(self):
+        self.docs = {}
+
+    async def find_one(self, query, projection=None):
+        doc = self.docs.get(query["key"])
+        if doc and doc["expires_at"] > query["expires_at"]["$gt"]:
+            # Mongo hands datetimes back naive (UTC)
+            return {"results": doc["results"], "expires_at": doc["expires_at"].replace(tzinfo=None)}
+        return None
+
+    async def update_one(self, query, update, upsert=False):
+        self.docs[query["key"]] = dict(update["$set"])
+
+
+def test_cache_key_normalization():
+    assert server.youtube_cache_key("Wonderwall", "Oasis") == server.youtube_cache_key("  WONDERWALL!", "oasis ")
+    assert server.youtube_cache_key("Perché", "Modugno") == "perche|modugno"
+
+
+def test_karaoke_search_is_cached(stub_youtube, monkeypatch):
+    collection = FakeCacheCollection()
+    cache = server.YouTubeSearchCache(collection, max_entries=10, ttl_seconds=3600)
+    monkeypatch.setattr(server, "youtube_cache", cache)
+
+    async def run():
+        try:
+            first = await server.search_karaoke_videos("Wonderwall", "Oasis")
+            second = await server.search_karaoke_videos("wonderwall", "OASIS")
+            # Drop the memory tier: the Mongo tier must still answer
+            cache._entries.clear()
+            third = await server.search_karaoke_videos("Wonderwall", "Oasis")
+            return first, second, third
+        finally:
+            await server.close_youtube_http()
+
+    first, second, third = asyncio.run(run())
+    assert first == second == third
+    assert len(stub_youtube.requests_seen) == 1
+    stats = cache.stats()
+    assert stats["misses"] == 1
+    assert stats["memory_hits"] == 1
+    assert stats["db_hits"] == 1
+    assert stats["quota_units_saved"] == 2 * server.YOUTUBE_SEARCH_QUOTA_COST
+
+
+def test_empty_results_are_cached_briefly(stub_youtube, monkeypatch):
+    stub_youtube.no_results = True
+    collection = FakeCacheCollection()
+    cache = server.YouTubeSearchCache(collection, max_entries=10, ttl_seconds=3600, negative_ttl_seconds=600)
+    monkeypatch.setattr(server, "youtube_cache", cache)
+
+    async def run():
+        try:
+            return [await server.search_karaoke_videos("Canzone Sconosciuta", "Nessuno") for _ in range(3)]
+        finally:
+            await server.close_youtube_http()
+
+    assert asyncio.run(run()) == [[], [], []]
+    assert len(stub_youtube.requests_seen) == 1
+    doc = next(iter(collection.docs.values()))
+    assert (doc["expires_at"] - doc["cached_at"]).total_seconds() == 600
+
+
+def test_prefetch_skips_songs_not_found(fake_db, monkeypatch):
+    prepared = []
+    fake_db.song_requests.docs += [
+        {"id": "r1", "pub_id": "pub1", "status": "queued", "title": "Canzone Sconosciuta", "artist": "Nessuno",
+         "youtube_status": "not_found"},
+        {"id": "r2", "pub_id": "pub1", "status": "queued", "title": "Wonderwall", "artist": "Oasis",
+         "youtube_status": None}
+    ]
+
+    async def prepare(pub_id, song):
+        prepared.append(song["id"])
+
+    prefetcher = server.QueuePrefetcher(lookahead=3, debounce=0)
+    monkeypatch.setattr(prefetcher, "_prepare", prepare)
+    asyncio.run(prefetcher._run("pub1"))
+    assert prepared == ["r2"]
+
+
+def test_cache_lru_eviction():
+    cache = server.YouTubeSearchCache(FakeCacheCollection(), max_entries=2, ttl_seconds=3600)
+    expires = datetime.now(timezone.utc).timestamp() + 3600
+    for key in ("a|", "b|", "c|"):
+        cache._remember(key, [{"url": key}], expires)
+    assert list(cache._entries) == ["b|", "c|"]
+
+
+def test_resolver_retries_and_broadcasts(fake_db, broadcasts, monkeypatch):
+    calls = []
+    fake_db.song_requests.docs.append({"id": "req1", "pub_id": "pub1", "youtube_url": None})
+
+    async def flaky_search(title, artist=""):
+        calls.append(title)
+        if len(calls) == 1:
+            raise httpx.ConnectError("boom")
+        return [{"url": "https://www.youtube.com/watch?v=vid0"}]
+
+    monkeypatch.setattr(server, "search_karaoke_videos", flaky_search)
+
+    async def run():
+        resolver = server.YouTubeResolver(workers=1, base_delay=0.01)
+        resolver.submit({"id": "req1", "pub_id": "pub1", "title": "Wonderwall", "artist": "Oasis"})
+        await resolver.queue.join()
+        await resolver.stop()
+
+    asyncio.run(run())
+    assert len(calls) == 2
+    _, query, update = fake_db.song_requests.calls[0]
+    assert query == {"id": "req1", "youtube_url": None}
+    assert update["$set"]["youtube_status"] == "resolved"
+    assert broadcasts.pubs == ["pub1"]
+    assert broadcasts == [{
+        "type": "request_updated",
+        "data": {"id": "req1", "youtube_url": "https://www.youtube.com/watch?v=vid0", "youtube_status": "resolved"}
+    }]
+
+
+def test_video_url_helpers():
+    assert server.youtube_video_id("https://www.youtube.com/watch?v=dQw4w9WgXcQ&t=1") == "dQw4w9WgXcQ"
+    assert server.youtube_video_id("https://youtu.be/dQw4w9WgXcQ") == "dQw4w9WgXcQ"
+    assert server.youtube_video_id("https://example.com/song.mp4") is None
+    assert server.parse_iso_duration("PT4M13S") == 253
+    assert server.parse_iso_duration("PT1H2S") == 3602
+
+
+def test_prefetch_picks_first_embeddable_video(stub_youtube, fake_db, broadcasts, monkeypatch):
+    fake_db.song_requests.docs.append({"id": "req1", "pub_id": "pub1"})
+    monkeypatch.setattr(server, "youtube_cache", server.YouTubeSearchCache(FakeCacheCollection(), 10, 3600))
+    monkeypatch.setattr(server, "youtube_video_meta", server.OrderedDict())
+    monkeypatch.setattr(server, "AUTO_YOUTUBE_SEARCH", True)
+
+    async def run():
+        try:
+            prefetcher = server.QueuePrefetcher(lookahead=3)
+            await prefetcher._prepare("pub1", {"id": "req1", "title": "Wonderwall", "artist": "Oasis"})
+        finally:
+            await server.close_youtube_http()
+
+    asyncio.run(run())
+    assert [path for path, _ in stub_youtube.requests_seen] == ["/search", "/videos"]
+    _, query, update = fake_db.song_requests.calls[0]
+    assert query == {"id": "req1", "youtube_url": None, "youtube_status": None}
+    update = update["$set"]
+    assert update["youtube_url"] == "https://www.youtube.com/watch?v=vid00000001"
+    assert update["youtube_meta"]["duration_seconds"] == 253
+    assert update["youtube_meta"]["embeddable"] is True
+    assert broadcasts[0]["type"] == "request_updated"
+
+
+def test_prefetch_keeps_concurrent_changes(stub_youtube, fake_db, broadcasts, monkeypatch):
+    # The admin picked another video while the prefetcher was validating
+    fake_db.song_requests.docs += [{"id": "req1", "youtube_url": "https://youtu.be/other000000"},
+                                   {"id": "req2", "youtube_url": "https://youtu.be/other000000"}]
+    catalog = server.SongCatalog()
+    monkeypatch.setattr(server, "song_catalog", catalog)
+    monkeypatch.setattr(server, "youtube_video_meta", server.OrderedDict())
+    monkeypatch.setattr(server, "AUTO_YOUTUBE_SEARCH", False)
+
+    async def run():
+        try:
+            prefetcher = server.QueuePrefetcher(lookahead=3)
+            await prefetcher._prepare("pub1", {"id": "req1", "title": "Wonderwall", "artist": "Oasis"})
+            await prefetcher._prepare("pub1", {"id": "req2", "title": "Wonderwall", "artist": "Oasis",
+                                               "youtube_url": "https://youtu.be/vid00000001"})
+        finally:
+            await server.close_youtube_http()
+
+    asyncio.run(run())
+    # No search without AUTO_YOUTUBE_SEARCH; the given URL is still validated
+    assert [path for path, _ in stub_youtube.requests_seen] == ["/videos"]
+    assert broadcasts == []
+    assert len(catalog) == 0
+
+
+def test_identical_lookups_are_merged(stub_youtube, monkeypatch):
+    stub_youtube.delay = 0.2
+    monkeypatch.setattr(server, "youtube_cache", server.YouTubeSearchCache(FakeCacheCollection(), 10, 3600))
+
+    async def run():
+        try:
+            return await asyncio.gather(*[
+                server.search_karaoke_videos("Bohemian Rhapsody" if i % 2 else "bohemian rhapsody!", "Queen")
+                for i in range(10)
+            ])
+        finally:
+            await server.close_youtube_http()
+
+    results = asyncio.run(run())
+    assert all(r == results[0] for r in results)
+    assert len(stub_youtube.requests_seen) == 1
+    assert server.youtube_singleflight.merged == 9
+
+
+def test_quota_exhausted_fails_fast(stub_youtube):
+    stub_youtube.status_code = 403
+
+    async def run():
+        try:
+            with pytest.raises(server.YouTubeAPIError):
+                await server.youtube_search("first karaoke")
+            start = time.perf_counter()
+            with pytest.raises(server.YouTubeUnavailable):
+                await server.youtube_search("second karaoke")
+            return time.perf_counter() - start
+        finally:
+            await server.close_youtube_http()
+
+    elapsed = asyncio.run(run())
+    assert elapsed < 0.05
+    assert len(stub_youtube.requests_seen) == 1
+    assert server.youtube_breaker.stats()["state"] == "quota_exhausted"
+
+
+def test_breaker_opens_after_repeated_errors(stub_youtube, monkeypatch):
+    stub_youtube.status_code = 500
+    monkeypatch.setattr(server, "youtube_breaker", server.YouTubeCircuitBreaker(10000, 3, 60))
+
+    async def run():
+        try:
+            for _ in range(3):
+                with pytest.raises(server.YouTubeAPIError):
+                    await server.youtube_search("broken karaoke")
+            with pytest.raises(server.YouTubeUnavailable):
+                await server.youtube_search("broken karaoke")
+        finally:
+            await server.close_youtube_http()
+
+    asyncio.run(run())
+    assert len(stub_youtube.requests_seen) == 3
+    assert server.youtube_breaker.state == "open"
+
+
+def test_daily_budget_is_enforced(stub_youtube, monkeypatch):
+    monkeypatch.setattr(server, "youtube_breaker", server.YouTubeCircuitBreaker(250, 5, 60))
+
+    async def run():
+        try:
+            await server.youtube_search("one karaoke")
+            await server.youtube_search("two karaoke")
+            with pytest.raises(server.YouTubeUnavailable):
+                await server.youtube_search("three karaoke")
+        finally:
+            await server.close_youtube_http()
+
+    asyncio.run(run())
+    assert len(stub_youtube.requests_seen) == 2
+    assert server.youtube_breaker.units_used == 200
@@ -0,0 +1,54 @@
+"""
+Canonical track keys shared by the backend and the Smart Quiz Generator.
+
+Spotify/Exportify titles carry release decorations ("- Remastered 2011",
+"- Single Version", "(feat. X)") and artists come in many spellings; all of
+them map to one key so the same song is recognised wherever it shows up.
+"""
+import re
+import unicodedata
+
+# Words that mark a suffix as a release variant rather than part of the title
+VERSION_WORDS = (
+    "remaster", "remastered", "version", "versione", "mono", "stereo", "single", "edit", "mix",
+    "live", "demo", "acoustic", "unplugged", "anniversary", "deluxe", "bonus", "bonus track",
+    "explicit", "instrumental", "karaoke", "soundtrack", "feat", "ft", "featuring"
+)
+_VERSION_RE = "|".join(sorted(VERSION_WORDS, key=len, reverse=True))
+
+# " - Remastered 2011", " - 2009 Remaster", " - Single Version", " - Live at Wembley"
+DASH_SUFFIX_RE = re.compile(rf"\s+[-–—]\s+[^-–—]*\b(?:{_VERSION_RE})\b.*$", re.IGNORECASE)
+# "(Remastered)", "[Mono]", "(feat. Someone)"
+BRACKET_SUFFIX_RE = re.compile(rf"\s*[\(\[][^\)\]]*\b(?:{_VERSION_RE})\b[^\)\]]*[\)\]]", re.IGNORECASE)
+# Secondary artists: "A; B", "A feat. B", "A ft. B", "A featuring B"
+ARTIST_SPLIT_RE = re.compile(r"\s*;\s*|\s+(?:feat\.?|ft\.?|featuring)\s+", re.IGNORECASE)
+# Dropped rather than turned into spaces: "U.S.A." == "USA", "Don't" == "Dont"
+JOINING_PUNCTUATION_RE = re.compile(r"['’`.]")
+
+
+def normalize_text(text: str) -> str:
+    """Lowercase, strip accents/punctuation and collapse spaces"""
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = re.sub(r"[^\w\s]", " ", text.lower())
+    return " ".join(text.split())
+
+
+def canonical_title(title: str) -> str:
+    title = (title or "").strip()
+    stripped = BRACKET_SUFFIX_RE.sub("", DASH_SUFFIX_RE.sub("", title))
+    # Never strip a title down to nothing ("Live", "(Mono)")
+    return normalize_text(JOINING_PUNCTUATION_RE.sub("", stripped)) or normalize_text(title)
+
+
+def canonical_artist(artist: str) -> str:
+    main = ARTIST_SPLIT_RE.split((artist or "").strip(), maxsplit=1)[0]
+    words = normalize_text(JOINING_PUNCTUATION_RE.sub("", main)).split()
+    if len(words) > 1 and words[0] == "the":
+        words = words[1:]
+    return " ".join(words)
+
+
+def track_key(title: str, artist: str = "") -> str:
+    """Same key for every spelling/release of the same song"""
+    return f"{canonical_title(title)}|{canonical_artist(artist)}"
@@ -1,29 +1,234 @@
+"""
+Crea progetto_completo.txt con il contenuto dei file di testo del progetto.
+
+- Salta binari (byte NUL), file troppo grandi e tutto ciò che è in .gitignore
+- Scrive il digest in streaming, con un limite sulla dimensione totale
+- Tiene un manifest con dimensione e data di ogni file: ai giri successivi
+  rilegge solo i file cambiati e copia gli altri dal digest precedente
+  (se cambiano i limiti si rilegge tutto)
+- Legge i file modificati in parallelo, pochi alla volta
+
+Uso: python crea_digest.py [--max-file-kb 256] [--max-total-mb 8] [--full]
+"""
+import argparse
+import fnmatch
+import json
 import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import pathspec
+except ImportError:  # senza pathspec si usa un sottoinsieme delle regole .gitignore
+    pathspec = None
 
 # Cartelle e file da ignorare
 IGNORE_DIRS = {'.git', 'node_modules', '__pycache__', '.emergent', 'venv', '.idea', '.vscode'}
 IGNORE_EXT = {'.png', '.jpg', '.jpeg', '.gif', '.ico', '.pyc', '.exe'}
 
 output_file = "progetto_completo.txt"
+manifest_file = ".digest_manifest.json"
+
+MAX_FILE_BYTES = 256 * 1024
+MAX_TOTAL_BYTES = 8 * 1024 * 1024
+SNIFF_BYTES = 8192
+
 
-with open(output_file, "w", encoding="utf-8") as outfile:
+class GitIgnore:
+    """Regole .gitignore (anche annidate), relative alla cartella che le contiene"""
+
+    def __init__(self):
+        self.rules = []  # (cartella, regole)
+
+    def load(self, directory):
+        path = os.path.join(directory, ".gitignore")
+        if not os.path.isfile(path):
+            return
+        with open(path, encoding="utf-8", errors="replace") as f:
+            lines = [l.rstrip("\n") for l in f if l.strip() and not l.startswith("#")]
+        if pathspec:
+            self.rules.append((directory, pathspec.GitIgnoreSpec.from_lines(lines)))
+        else:
+            self.rules.append((directory, lines))
+
+    def ignored(self, path, is_dir=False):
+        for directory, rules in self.rules:
+            rel = os.path.relpath(path, directory).replace(os.sep, "/")
+            if rel.startswith(".."):
+                continue
+            if is_dir:
+                rel += "/"
+            if pathspec:
+                if rules.match_file(rel):
+                    return True
+            elif any(self._match(rel, rule) for rule in rules):
+                return True
+        return False
+
+    @staticmethod
+    def _match(rel, rule):
+        if rule.startswith("!"):
+            return False
+        if rule.endswith("/") and not rel.endswith("/"):
+            return False
+        rule = rule.rstrip("/")
+        rel = rel.rstrip("/")
+        if rule.startswith("/") or "/" in rule:
+            return fnmatch.fnmatch(rel, rule.lstrip("/"))
+        return any(fnmatch.fnmatch(part, rule) for part in rel.split("/"))
+
+
+def find_files(skip):
+    """Percorsi dei file da includere, in ordine stabile"""
+    gitignore = GitIgnore()
+    paths = []
     for root, dirs, files in os.walk("."):
+        gitignore.load(root)
         # Rimuove le cartelle ignorate dalla ricerca
-        dirs[:] = [d for d in dirs if d not in IGNORE_DIRS]
-        
-        for file in files:
-            if any(file.endswith(ext) for ext in IGNORE_EXT):
-                continue
-            if file == "crea_digest.py" or file == output_file:
+        dirs[:] = sorted(
+            d for d in dirs
+            if d not in IGNORE_DIRS and not gitignore.ignored(os.path.join(root, d), is_dir=True)
+        )
+        for file in sorted(files):
+            if any(file.endswith(ext) for ext in IGNORE_EXT) or file in skip:
                 continue
-
             path = os.path.join(root, file)
-            outfile.write(f"\n{'='*20}\nFILE: {path}\n{'='*20}\n")
-            
+            if not gitignore.ignored(path):
+                paths.append(path)
+    return paths
+
+
+def header(path):
+    return f"\n{'='*20}\nFILE: {path}\n{'='*20}\n"
+
+
+def read_fragment(path, max_file_bytes):
+    """Legge un file e prepara il suo pezzo di digest (gira nei thread)"""
+    try:
+        st = os.stat(path)
+        info = {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+        if st.st_size > max_file_bytes:
+            return info, None, f"troppo grande ({st.st_size // 1024} KB)"
+        with open(path, "rb") as f:
+            data = f.read()
+        if b"\0" in data[:SNIFF_BYTES]:
+            return info, None, "binario"
+        try:
+            text = data.decode("utf-8")
+        except UnicodeDecodeError:
+            return info, None, "non UTF-8"
+        return info, (header(path) + text).encode("utf-8"), None
+    except OSError as e:
+        return {}, (header(path) + f"[Errore nella lettura del file: {e}]").encode("utf-8"), None
+
+
+def read_fragments(pool, paths, max_file_bytes, window):
+    """Come pool.map, ma con al massimo `window` file letti in anticipo in memoria"""
+    pending = deque()
+    for path in paths:
+        pending.append(pool.submit(read_fragment, path, max_file_bytes))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def load_manifest(full, limits):
+    """Manifest del giro precedente, solo se il digest non è stato toccato e i limiti sono gli stessi"""
+    if full or not os.path.isfile(manifest_file) or not os.path.isfile(output_file):
+        return {}
+    try:
+        with open(manifest_file, encoding="utf-8") as f:
+            manifest = json.load(f)
+        if os.path.getsize(output_file) != manifest.get("output_size"):
+            return {}
+        # Un file "troppo grande" con il vecchio limite potrebbe entrare con il nuovo
+        if manifest.get("limits") != limits:
+            return {}
+        return manifest.get("files", {})
+    except (OSError, ValueError):
+        return {}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Digest del progetto in un unico file di testo")
+    parser.add_argument("--max-file-kb", type=int, default=MAX_FILE_BYTES // 1024)
+    parser.add_argument("--max-total-mb", type=float, default=MAX_TOTAL_BYTES / (1024 * 1024))
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--full", action="store_true", help="ignora il manifest e rilegge tutto")
+    args = parser.parse_args()
+    max_file_bytes = args.max_file_kb * 1024
+    max_total_bytes = int(args.max_total_mb * 1024 * 1024)
+    limits = {"max_file_bytes": max_file_bytes, "max_total_bytes": max_total_bytes}
+
+    script = os.path.basename(__file__)
+    paths = find_files({script, output_file, manifest_file, output_file + ".tmp"})
+    previous = load_manifest(args.full, limits)
+
+    # Invariati (stessa dimensione e data): si copiano dal digest precedente senza rileggerli
+    unchanged = {}
+    for path in paths:
+        old = previous.get(path)
+        if old and ("offset" in old or "skipped" in old):
             try:
-                with open(path, "r", encoding="utf-8") as infile:
-                    outfile.write(infile.read())
-            except Exception as e:
-                outfile.write(f"[Errore nella lettura del file: {e}]")
+                st = os.stat(path)
+            except OSError:
+                continue
+            if st.st_size == old.get("size") and st.st_mtime_ns == old.get("mtime_ns"):
+                unchanged[path] = old
+    changed = [p for p in paths if p not in unchanged]
+
+    files, skipped = {}, []
+    total = reused = 0
+    old_digest = open(output_file, "rb") if unchanged else None
+    try:
+        with ThreadPoolExecutor(max_workers=args.workers) as pool, open(output_file + ".tmp", "wb") as outfile:
+            # Letti in parallelo, scritti nell'ordine dei percorsi man mano che arrivano
+            fresh = read_fragments(pool, changed, max_file_bytes, window=2 * args.workers)
+            for path in paths:
+                if path in unchanged:
+                    info = dict(unchanged[path])
+                    if "skipped" in info:
+                        skipped.append((path, info["skipped"]))
+                        files[path] = info
+                        continue
+                    old_digest.seek(info["offset"])
+                    fragment = old_digest.read(info["length"])
+                    reused += 1
+                else:
+                    info, fragment, reason = next(fresh)
+                    if fragment is None:
+                        skipped.append((path, reason))
+                        files[path] = dict(info, skipped=reason)
+                        continue
+
+                if total + len(fragment) > max_total_bytes:
+                    skipped.append((path, "limite totale raggiunto"))
+                    files[path] = {k: v for k, v in info.items() if k not in ("offset", "length")}
+                    continue
+
+                info["offset"], info["length"] = outfile.tell(), len(fragment)
+                outfile.write(fragment)
+                files[path] = info
+                total += len(fragment)
+
+            if skipped:
+                outfile.write(f"\n{'='*20}\nFILE ESCLUSI\n{'='*20}\n".encode("utf-8"))
+                for path, reason in skipped:
+                    outfile.write(f"{path}: {reason}\n".encode("utf-8"))
+    finally:
+        if old_digest:
+            old_digest.close()
+
+    os.replace(output_file + ".tmp", output_file)
+    with open(manifest_file, "w", encoding="utf-8") as f:
+        json.dump({"output_size": os.path.getsize(output_file), "limits": limits, "files": files}, f, indent=1)
+
+    included = len(paths) - len(skipped)
+    print(f"{included} file inclusi ({total // 1024} KB), {len(changed)} riletti, "
+          f"{reused} invariati, {len(skipped)} esclusi.")
+    print(f"Fatto! Carica il file '{output_file}' nella chat.")
+
 
-print(f"Fatto! Carica il file '{output_file}' nella chat.")
\ No newline at end of file
+if __name__ == "__main__":
+    main()